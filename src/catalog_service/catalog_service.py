@@ -1,37 +1,456 @@
 # Importing the Required Libraries
-from flask import Flask, request, jsonify
-import logging, csv, os, requests
+from flask import Flask, request, jsonify, g
+from flask.json.provider import JSONProvider
+import logging, csv, os, sys, requests, threading, queue, json, time, random, atexit, multiprocessing, ctypes, zlib
+from logging.handlers import QueueHandler, QueueListener
+from threading import Thread
+from contextlib import contextmanager
+from multiprocessing.sharedctypes import RawArray
+from array import array
+import numpy as np
 from rwlock import RWLock
+try:
+    import orjson
+except ImportError: # Optional, the services fall back to the standard library codec
+    orjson = None
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+# Logging - Request threads only enqueue log records, a QueueListener thread formats them (JSON by default) and writes to stderr.
+# Per-module levels come from LOG_LEVELS (e.g. "werkzeug=WARNING,__main__.hot=DEBUG") and hot-path logs are sampled at LOG_SAMPLE_RATE
+# Reference: https://docs.python.org/3/howto/logging-cookbook.html#dealing-with-handlers-that-block
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "werkzeug=WARNING")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+class SampleFilter(logging.Filter): # Keeps a fraction of the records below WARNING, warnings and errors always pass
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+def setupLogging():
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(logQueue)]
+    root.setLevel(LOG_LEVEL)
+    for entry in filter(None, LOG_LEVELS.split(",")):
+        name, _, level = entry.partition("=")
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+    listener = QueueListener(logQueue, handler)
+    listener.start()
+    atexit.register(listener.stop) # Flushes the queued records on shutdown
+    return listener
+
+setupLogging()
 logger = logging.getLogger(__name__)
+hot_logger = logging.getLogger(f"{__name__}.hot") # Per-request logs on the lookup/replication hot paths
+hot_logger.addFilter(SampleFilter(LOG_SAMPLE_RATE))
 
 # Reference: https://flask.palletsprojects.com/en/stable/quickstart/ 
 app = Flask(__name__)
 
+# JSON Codec - Response bodies and inter-service payloads are encoded with orjson when it is installed (JSON_CODEC=json forces
+# the standard library). Flask's jsonify, dict responses and request.get_json all go through the same codec
+# Reference: https://github.com/ijl/orjson
+JSON_CODEC = os.environ.get("JSON_CODEC", "orjson") if orjson is not None else "json"
+
+def jsonEncode(payload, sort_keys=False, indent=None): # Compact UTF-8 bytes unless indented, orjson only indents by 2
+    if JSON_CODEC == "orjson" and indent in (None, 2):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        option |= (orjson.OPT_SORT_KEYS if sort_keys else 0) | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(payload, option=option)
+    return json.dumps(payload, sort_keys=sort_keys, indent=indent, separators=None if indent is not None else (",", ":")).encode()
+
+def jsonDecode(body): # Accepts bytes or str, raises ValueError on malformed input
+    return orjson.loads(body) if JSON_CODEC == "orjson" else json.loads(body)
+
+class CodecJSONProvider(JSONProvider):
+    sort_keys = False # Unlike Flask's default provider, responses keep the key order instead of paying for a sort
+    compact = None # As in Flask's default provider, None indents responses in debug mode only
+    mimetype = "application/json"
+
+    def dumps(self, obj, sort_keys=False, indent=None, **kwargs): # Other json.dumps options have no orjson equivalent
+        if kwargs:
+            raise TypeError(f"Unsupported JSON encoding options: {', '.join(sorted(kwargs))}")
+        return jsonEncode(obj, sort_keys, indent).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            raise TypeError(f"Unsupported JSON decoding options: {', '.join(sorted(kwargs))}")
+        return jsonDecode(s)
+
+    def response(self, *args, **kwargs): # Same arguments as Flask's jsonify, the encoded bytes are sent without a round trip through str
+        if args and kwargs:
+            raise TypeError("app.json.response() takes either args or kwargs, not both")
+        if not args and not kwargs:
+            obj = None
+        elif len(args) == 1:
+            obj = args[0]
+        else:
+            obj = list(args) or kwargs
+        indent = 2 if self.compact is False or (self.compact is None and self._app.debug) else None
+        return self._app.response_class(jsonEncode(obj, self.sort_keys, indent), mimetype=self.mimetype)
+
+app.json = CodecJSONProvider(app)
+
 # Global Environment variables from Docker Compose file
 CATALOG_PORT = int(os.environ.get("CATALOG_PORT", "8997"))
 CATALOG_HOST = os.environ.get("CATALOG_HOST", "0.0.0.0")
 FRONTEND_SERVICE_URL = os.environ.get("FRONTEND_SERVICE_URL", "http://frontend-service:9001")
 CACHE_ENABLED = int(os.environ.get("CACHE_ENABLED", "1"))
-CATALOG_FILE = "catalog.csv"
+CHANGE_FEED_ENABLED = int(os.environ.get("CHANGE_FEED_ENABLED", "0")) # Notify the front-end's change feed even with the cache disabled
+CATALOG_FILE = os.environ.get("CATALOG_FILE", "catalog.csv")
+CATALOG_BACKEND = os.environ.get("CATALOG_BACKEND", "local")
+CATALOG_LOCK_STRIPES = int(os.environ.get("CATALOG_LOCK_STRIPES", "16"))
+
+catalog_file_lock = multiprocessing.Lock() # Serializes catalog.csv rewrites, also across forked worker processes
+
+# Catalog Partitioning - The symbols are split across CATALOG_PARTITIONS catalog instances by CRC-32 of the stock name, and
+# this instance owns partition CATALOG_PARTITION. It only loads and trades its own symbols, so every instance has its own
+# writer lock and catalog file. The Front-end and Order services route with the same hash over CATALOG_SERVICE_URLS
+CATALOG_PARTITIONS = int(os.environ.get("CATALOG_PARTITIONS", "1"))
+CATALOG_PARTITION = int(os.environ.get("CATALOG_PARTITION", "0"))
+
+def catalogPartition(stockName, partitions): # Must match the Front-end and Order services
+    return zlib.crc32(stockName.encode()) % partitions
+
+def ownsStock(stockName):
+    return CATALOG_PARTITIONS <= 1 or catalogPartition(stockName, CATALOG_PARTITIONS) == CATALOG_PARTITION
+
+def misdirectedStock(stockName): # A caller whose partition map disagrees with this instance's
+    message = f"Stock {stockName} belongs to catalog partition {catalogPartition(stockName, CATALOG_PARTITIONS)}, not {CATALOG_PARTITION}."
+    return jsonify({"error": {"code": 421, "message": message}}), 421
+
+# Distributed Tracing - W3C 'traceparent' header is propagated on every inter-service call, with one span per hop,
+# lock wait and disk write. Spans are exported in the background as JSON lines to TRACE_FILE or to a local collector
+# Reference: https://www.w3.org/TR/trace-context/
+TRACING_ENABLED = int(os.environ.get("TRACING_ENABLED", "0"))
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces_catalog.jsonl")
+TRACE_COLLECTOR_URL = os.environ.get("TRACE_COLLECTOR_URL", "")
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "catalog-service")
+
+trace_context = threading.local()
+trace_queue = queue.Queue()
+
+def startSpan(name, **attributes):
+    parent = getattr(trace_context, "span", None)
+    span = {
+        "trace_id": parent["trace_id"] if parent else os.urandom(16).hex(),
+        "span_id": os.urandom(8).hex(),
+        "parent_span_id": parent["span_id"] if parent else None,
+        "service": TRACE_SERVICE_NAME,
+        "name": name,
+        "start_time_unix_nano": time.time_ns(),
+        "attributes": attributes,
+        "parent": parent
+    }
+    trace_context.span = span
+    return span
+
+def endSpan(span):
+    span["end_time_unix_nano"] = time.time_ns()
+    trace_context.span = span.pop("parent")
+    trace_queue.put(span)
+
+@contextmanager
+def traceSpan(name, **attributes):
+    if TRACING_ENABLED != 1:
+        yield None
+        return
+    span = startSpan(name, **attributes)
+    try:
+        yield span
+    finally:
+        endSpan(span)
+
+@contextmanager
+def tracedLock(lock, name): # Records the time spent waiting for the lock as its own span
+    with traceSpan(f"lock_wait {name}"):
+        lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+def traceHeaders():
+    span = getattr(trace_context, "span", None)
+    if TRACING_ENABLED != 1 or not span:
+        return {}
+    return {"traceparent": f"00-{span['trace_id']}-{span['span_id']}-01"}
+
+def tracedRequest(method, url, **kwargs): # Client span for a single hop, the callee records the matching server span
+    with traceSpan(f"HTTP {method.upper()}", url=url) as span:
+        kwargs["headers"] = {**kwargs.get("headers", {}), **traceHeaders()}
+        response = getattr(requests, method)(url, **kwargs)
+        if span:
+            span["attributes"]["status_code"] = response.status_code
+        return response
+
+def withTraceContext(target): # Carries the current span into a background thread
+    parent = getattr(trace_context, "span", None)
+    def run(*args, **kwargs):
+        previous = getattr(trace_context, "span", None)
+        trace_context.span = parent
+        try:
+            return target(*args, **kwargs)
+        finally:
+            trace_context.span = previous # Pooled threads must not keep the span for the next task
+    return run
+
+def exportSpans():
+    while True:
+        batch = [trace_queue.get()]
+        while not trace_queue.empty() and len(batch) < 100:
+            batch.append(trace_queue.get())
+        try:
+            if TRACE_COLLECTOR_URL:
+                requests.post(f"{TRACE_COLLECTOR_URL}/v1/traces", json={"spans": batch}, timeout=2)
+            else:
+                with open(TRACE_FILE, mode="a") as file:
+                    file.writelines(json.dumps(span) + "\n" for span in batch)
+        except Exception as e:
+            logger.warning(f"Dropped {len(batch)} spans during export: {e}")
+
+@app.before_request
+def startRequestSpan():
+    if TRACING_ENABLED != 1:
+        return
+    trace_context.span = None
+    parts = request.headers.get("traceparent", "").split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        trace_context.span = {"trace_id": parts[1], "span_id": parts[2]} # Remote parent from the calling service
+    g.trace_span = startSpan(f"{request.method} {request.url_rule.rule if request.url_rule else request.path}")
+
+@app.after_request
+def recordResponseStatus(response):
+    span = g.get("trace_span")
+    if span:
+        span["attributes"]["status_code"] = response.status_code
+    return response
+
+@app.teardown_request
+def endRequestSpan(error=None):
+    span = g.pop("trace_span", None)
+    if span:
+        endSpan(span)
+        trace_context.span = None
+
+if TRACING_ENABLED == 1:
+    Thread(target=exportSpans, daemon=True).start()
+
+# Catalog Storage Backends - Both backends keep the stocks as parallel typed columns (price as float64, quantity as int64) indexed by an
+# interned symbol -> slot map. 'local' (default) allocates the columns in process memory guarded by an RWLock. 'shared' allocates
+# them in shared memory with striped process-shared locks, created by catalogInit before gunicorn forks, so every catalog worker
+# process serves the same stocks in parallel. A lookup's JSON body is kept per slot and only serialized again after the stock
+# changed, which a per-slot version column tells every process
+class SlotStockTable:
+    def __init__(self, stocks):
+        self.initColumns(list(stocks), [float(data["price"]) for data in stocks.values()], [int(data["quantity"]) for data in stocks.values()])
+
+    @classmethod
+    def fromColumns(cls, symbols, prices, quantities): # Snapshot columns are copied in one pass, without per-stock dicts
+        table = cls.__new__(cls)
+        table.initColumns(symbols.tolist(), prices, quantities)
+        return table
 
-catalog = {} # In-merory catalog
-catalog_lock = RWLock()
+    def initColumns(self, symbols, prices, quantities):
+        self.slots = {sys.intern(stockName): slot for slot, stockName in enumerate(symbols)} # Fixed after init, inherited by the workers
+        self.symbols = list(self.slots)
+        self.allocate(len(self.symbols))
+        np.frombuffer(self.prices, dtype=np.float64)[:] = prices
+        np.frombuffer(self.quantities, dtype=np.int64)[:] = quantities
+        self.responses = [None] * len(self.symbols) # Per process: (version, serialized lookup body)
+
+    def get(self, stockName):
+        slot = self.slots.get(stockName)
+        if slot is None:
+            return None
+        with self.readLock(slot):
+            return {"price": self.prices[slot], "quantity": self.quantities[slot]}
+
+    def trade(self, stockName, tradeType, quantity):
+        slot = self.slots.get(stockName)
+        if slot is None:
+            return None
+        with self.writeLock(slot):
+            self.quantities[slot] += quantity if tradeType == "sell" else -quantity
+            self.versions[slot] += 1
+            return self.quantities[slot]
+
+    def response(self, stockName): # Serialized lookup body, or None if the stock does not exist
+        slot = self.slots.get(stockName)
+        if slot is None:
+            return None
+        cached = self.responses[slot]
+        with self.readLock(slot):
+            version = self.versions[slot]
+            if cached is not None and cached[0] == version:
+                return cached[1]
+            stock = {"name": self.symbols[slot], "price": self.prices[slot], "quantity": self.quantities[slot]}
+        body = jsonEncode(stock)
+        self.responses[slot] = (version, body)
+        return body
+
+    def items(self):
+        return [(stockName, self.get(stockName)) for stockName in self.symbols]
+
+class LocalStockTable(SlotStockTable):
+    def allocate(self, count):
+        self.prices = array("d", bytes(8 * count))
+        self.quantities = array("q", bytes(8 * count))
+        self.versions = array("q", bytes(8 * count))
+        self.lock = RWLock()
+
+    def readLock(self, slot):
+        return tracedLock(self.lock.reader_lock, "catalog_lock.reader")
+
+    def writeLock(self, slot):
+        return tracedLock(self.lock.writer_lock, "catalog_lock.writer")
+
+class SharedStockTable(SlotStockTable):
+    def allocate(self, count):
+        self.prices = RawArray(ctypes.c_double, count)
+        self.quantities = RawArray(ctypes.c_int64, count)
+        self.versions = RawArray(ctypes.c_int64, count)
+        self.locks = [multiprocessing.Lock() for _ in range(CATALOG_LOCK_STRIPES)] # Striped per-slot locks
+
+    def readLock(self, slot):
+        return tracedLock(self.locks[slot % len(self.locks)], "catalog_slot_lock")
+
+    writeLock = readLock
+
+def stockTableClass():
+    return SharedStockTable if CATALOG_BACKEND == "shared" else LocalStockTable
+
+def createStockTable(stocks):
+    return stockTableClass()(stocks)
+
+def createStockTableFromColumns(symbols, prices, quantities):
+    return stockTableClass().fromColumns(symbols, prices, quantities)
+
+catalog = LocalStockTable({}) # In-memory catalog, replaced by catalogInit
+
+# Catalog Snapshot - A columnar binary copy of catalog.csv in CATALOG_SNAPSHOT_DIR: 'symbols.npy' (the symbol table, fixed-width
+# strings), 'prices.npy' (float64) and 'quantities.npy' (int64), plus 'meta.json' with the size and modification time of the CSV it
+# was converted from. catalogInit memory-maps the columns instead of parsing the CSV, and falls back to the CSV when the snapshot
+# is missing or the CSV changed since. The snapshot is converted again every CATALOG_SNAPSHOT_INTERVAL seconds once the CSV changed
+# (every trade rewrites it, so a snapshot only written on shutdown is always stale after an unclean stop), on shutdown, or with
+# 'python catalog_service.py snapshot'
+# Reference: https://numpy.org/doc/stable/reference/generated/numpy.lib.format.html
+CATALOG_SNAPSHOT = int(os.environ.get("CATALOG_SNAPSHOT", "1"))
+CATALOG_SNAPSHOT_DIR = os.environ.get("CATALOG_SNAPSHOT_DIR", "catalog_snapshot")
+CATALOG_SNAPSHOT_INTERVAL = float(os.environ.get("CATALOG_SNAPSHOT_INTERVAL", "60")) # 0 only converts on shutdown
+SNAPSHOT_COLUMNS = ["symbols", "prices", "quantities"]
+
+def writeCatalogSnapshot(csvFile=None, snapshotDir=None): # Converts the CSV, returns the number of stocks
+    csvFile, snapshotDir = csvFile or CATALOG_FILE, snapshotDir or CATALOG_SNAPSHOT_DIR
+    with catalog_file_lock:
+        source = os.stat(csvFile)
+        with open(csvFile, mode="r") as file:
+            stocks = {row["stock_name"]: (float(row["price"]), int(row["quantity"])) for row in csv.DictReader(file) if ownsStock(row["stock_name"])}
+    columns = {
+        "symbols": np.array(list(stocks), dtype=np.str_),
+        "prices": np.fromiter((price for price, _ in stocks.values()), dtype=np.float64, count=len(stocks)),
+        "quantities": np.fromiter((quantity for _, quantity in stocks.values()), dtype=np.int64, count=len(stocks))
+    }
+    os.makedirs(snapshotDir, exist_ok=True)
+    for name, values in columns.items():
+        with open(os.path.join(snapshotDir, f"{name}.npy.tmp"), mode="wb") as file:
+            np.save(file, values)
+        os.replace(os.path.join(snapshotDir, f"{name}.npy.tmp"), os.path.join(snapshotDir, f"{name}.npy"))
+    with open(os.path.join(snapshotDir, "meta.json.tmp"), mode="w") as file: # Written last, the snapshot is valid once it matches
+        json.dump({"count": len(stocks), "source_size": source.st_size, "source_mtime_ns": source.st_mtime_ns}, file)
+    os.replace(os.path.join(snapshotDir, "meta.json.tmp"), os.path.join(snapshotDir, "meta.json"))
+    logger.info(f"Wrote catalog snapshot of {len(stocks)} stocks to {snapshotDir}")
+    return len(stocks)
+
+def saveCatalogSnapshot(server=None): # Shutdown hook, gunicorn passes its arbiter
+    try:
+        writeCatalogSnapshot()
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Error while saving catalog snapshot: {e}")
+
+def refreshCatalogSnapshot(stop): # Converts the CSV again whenever it changed since the last conversion, until 'stop' is set
+    converted = None
+    while not stop.wait(CATALOG_SNAPSHOT_INTERVAL):
+        try:
+            source = os.stat(CATALOG_FILE)
+            if (source.st_size, source.st_mtime_ns) != converted:
+                writeCatalogSnapshot()
+                converted = (source.st_size, source.st_mtime_ns)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Error while refreshing catalog snapshot: {e}")
+
+def startSnapshotRefresh(server=None): # gunicorn passes its arbiter, only the master converts so workers never race on the files
+    if CATALOG_SNAPSHOT_INTERVAL > 0:
+        Thread(target=refreshCatalogSnapshot, args=(threading.Event(),), daemon=True).start()
+
+def readCatalogSnapshot(csvFile=None, snapshotDir=None): # Returns the memory-mapped columns, or None
+    csvFile, snapshotDir = csvFile or CATALOG_FILE, snapshotDir or CATALOG_SNAPSHOT_DIR
+    try:
+        with open(os.path.join(snapshotDir, "meta.json"), mode="r") as file:
+            meta = json.load(file)
+        if os.path.exists(csvFile):
+            source = os.stat(csvFile)
+            if (source.st_size, source.st_mtime_ns) != (meta["source_size"], meta["source_mtime_ns"]):
+                logger.info(f"Catalog snapshot in {snapshotDir} is older than {csvFile}, loading the CSV.")
+                return None
+        columns = [np.load(os.path.join(snapshotDir, f"{name}.npy"), mmap_mode="r") for name in SNAPSHOT_COLUMNS]
+        if any(len(column) != meta["count"] for column in columns):
+            logger.warning(f"Catalog snapshot in {snapshotDir} is incomplete, loading the CSV.")
+            return None
+        return columns
+    except (OSError, ValueError, KeyError) as e:
+        logger.info(f"No catalog snapshot loaded from {snapshotDir}: {e}")
+        return None
 
 def catalogInit():
     global catalog
+    columns = readCatalogSnapshot() if CATALOG_SNAPSHOT == 1 else None
+    if columns is not None and not all(ownsStock(str(stockName)) for stockName in columns[0]):
+        logger.info("Catalog snapshot holds stocks of other partitions, loading the catalog file instead.")
+        columns = None
+    if columns is not None:
+        catalog = createStockTableFromColumns(*columns)
+        logger.info(f"Catalog loaded from the snapshot in {CATALOG_SNAPSHOT_DIR} ({len(columns[0])} stocks).")
+        if not os.path.exists(CATALOG_FILE):
+            loadCatalogToDisk()
+        return
     try:
+        stocks = {}
         with open(CATALOG_FILE, mode="r") as file:
             reader = csv.DictReader(file)
             for row in reader:
-                catalog[row["stock_name"]] = {
+                if not ownsStock(row["stock_name"]): # Rows of other partitions stay in the file untouched
+                    continue
+                stocks[row["stock_name"]] = {
                     "price": float(row["price"]),
                     "quantity": int(row["quantity"])
                 }
+        catalog = createStockTable(stocks)
     except FileNotFoundError:
         logger.warning("Catalog file not found. Initializing with default catalog.")
-        catalog = {
+        catalog = createStockTable({stockName: stock for stockName, stock in {
             "APPL": {"price": 150.0, "quantity": 100},
             "GOOG": {"price": 280.0, "quantity": 100},
             "MSFT": {"price": 200.0, "quantity": 100},
@@ -42,7 +461,7 @@ def catalogInit():
             "NVDA": {"price": 380.0, "quantity": 100},
             "AMD": {"price": 990.0, "quantity": 100},
             "IBM": {"price": 100.0, "quantity": 100}
-        }
+        }.items() if ownsStock(stockName)})
         loadCatalogToDisk()
     except Exception as e:
         logger.error(f"Error during catalog initialization: {e}")
@@ -51,7 +470,7 @@ def catalogInit():
 # Helper Functions - Load and save catalog to disk, notify for invalidation when stock is updated
 def loadCatalogToDisk(stockName=None):
     try:
-        with catalog_lock.writer_lock:
+        with tracedLock(catalog_file_lock, "catalog_file_lock"), traceSpan("disk_write", file=CATALOG_FILE):
             if stockName:
                 try:
                     with open(CATALOG_FILE, mode="r") as file:
@@ -65,7 +484,7 @@ def loadCatalogToDisk(stockName=None):
                     writer.writeheader()
                     for row in rows:
                         if row["stock_name"] == stockName:
-                            row["quantity"] = catalog[stockName]["quantity"]
+                            row["quantity"] = catalog.get(stockName)["quantity"]
                         writer.writerow(row)
             else:
                 # Create a new file
@@ -81,12 +500,13 @@ def loadCatalogToDisk(stockName=None):
     except Exception as e:
         logger.error(f"Error while saving catalog to disk: {e}")
 
-def notifyForInvalidation(stockName):
+def notifyForInvalidation(stockName, stock=None):
     try:
-        # Frontend call to invalidate cache
-        response = requests.post(f"{FRONTEND_SERVICE_URL}/invalidate/{stockName}")
+        # Frontend call to invalidate cache, carrying the updated stock for the front-end's change feed
+        body = {"name": stockName, "price": stock["price"], "quantity": stock["quantity"]} if stock else None
+        response = tracedRequest("post", f"{FRONTEND_SERVICE_URL}/invalidate/{stockName}", json=body)
         if response.status_code == 200:
-            logger.info(f"Invalidation of cache request sent. Stock Name: {stockName}")
+            hot_logger.info("Invalidation of cache request sent. Stock Name: %s", stockName)
         else:
             logger.info(f"Failed to invalidate cache for stock: {stockName}")
     except requests.RequestException as e:
@@ -95,22 +515,29 @@ def notifyForInvalidation(stockName):
 # API Endpoints - GET and POST for stock lookup and update stocks which is requested from frontend service        
 @app.route("/stocks/<stockName>", methods=["GET"])
 def stockLookup(stockName):
+    hot_logger.info("Looking for stock: %s", stockName)
     try:
-        with catalog_lock.reader_lock:
-            stock = catalog.get(stockName)
-            if stock:
-                logger.info(f"Looking for stock: {stockName}")
-                return jsonify({
-                    "name": stockName,
-                    "price": stock["price"],
-                    "quantity": stock["quantity"]
-                }), 200
-            else:
-                return jsonify({"error": {"code": 404, "message": "No stock found."}}), 404
+        body = catalog.response(stockName)
+        if body:
+            return app.response_class(body, mimetype="application/json"), 200
+        elif not ownsStock(stockName):
+            return misdirectedStock(stockName)
+        else:
+            return jsonify({"error": {"code": 404, "message": "No stock found."}}), 404
     except Exception as e:
         logger.error(f"Error during stock lookup for {stockName}: {e}")
         return jsonify({"error": {"code": 500, "message": "Internal server error"}}), 500
 
+@app.route("/stocks", methods=["GET"])
+def stockList(): # Bulk dump of every stock, used by the front-end to warm its cache on startup
+    try:
+        return jsonify({"stocks": [
+            {"name": stockName, "price": data["price"], "quantity": data["quantity"]} for stockName, data in catalog.items()
+        ]}), 200
+    except Exception as e:
+        logger.error(f"Error during stock listing: {e}")
+        return jsonify({"error": {"code": 500, "message": "Internal server error"}}), 500
+
 # Reference: LAB 2 - Catalog Service - Update the stock quantity and price
 @app.route("/stocks/<stockName>", methods=["POST"])
 def stockUpdate(stockName):
@@ -122,31 +549,68 @@ def stockUpdate(stockName):
         if not tradeType or not stockQuantity:
             return jsonify({"error": {"code": 400, "message": "Request Data is invalid"}}), 400
 
-        with catalog_lock.writer_lock:  # Acquire writer lock while update
-            stock = catalog.get(stockName)
-            if not stock:
-                return jsonify({"error": {"code": 404, "message": "No stock found."}}), 404
-
-            if tradeType == "buy":
-                stock["quantity"] -= stockQuantity
-            elif tradeType == "sell":
-                stock["quantity"] += stockQuantity
-            else:
-                return jsonify({"error": {"code": 400, "message": "Found invalid trade type"}}), 400
+        if catalog.get(stockName) is None:
+            return misdirectedStock(stockName) if not ownsStock(stockName) else (jsonify({"error": {"code": 404, "message": "No stock found."}}), 404)
+        if tradeType not in ["buy", "sell"]:
+            return jsonify({"error": {"code": 400, "message": "Found invalid trade type"}}), 400
+        catalog.trade(stockName, tradeType, stockQuantity) # Atomic under the table's writer/slot lock
 
         logger.info(f"Updated the catalog for stock: {stockName}")
         loadCatalogToDisk(stockName)
 
-        if CACHE_ENABLED == 1:
-            # Only notify when cache is enabled
-            notifyForInvalidation(stockName)
+        if CACHE_ENABLED == 1 or CHANGE_FEED_ENABLED == 1:
+            # Only notify when cache or change feed is enabled
+            notifyForInvalidation(stockName, catalog.get(stockName))
 
         return jsonify({"message": "Successfully updated the stock."}), 200
     except Exception as e:
         logger.error(f"Error during stock update for {stockName}: {e}")
         return jsonify({"error": {"code": 500, "message": "Internal server error"}}), 500
 
+# Production Serving - SERVER_MODE=gunicorn serves the app with gunicorn gthread workers instead of the Werkzeug development server.
+# Service state is initialized in the master before the fork, and the background threads are started again inside every worker
+# Reference: https://docs.gunicorn.org/en/stable/custom.html
+SERVER_MODE = os.environ.get("SERVER_MODE", "dev")
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "1"))
+WEB_THREADS = int(os.environ.get("WEB_THREADS", "32"))
+GRACEFUL_TIMEOUT = int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+
+def restartAfterFork(server, worker): # Threads do not survive fork, so the log listener and span exporter are restarted
+    setupLogging()
+    if TRACING_ENABLED == 1:
+        Thread(target=exportSpans, daemon=True).start()
+
+def runServer(host, port, maxWorkers):
+    if SERVER_MODE != "gunicorn":
+        app.run(host=host, port=port, threaded=True)
+        return
+    from gunicorn.app.base import BaseApplication
+
+    class ProductionServer(BaseApplication):
+        def load_config(self):
+            workers = min(WEB_WORKERS, maxWorkers)
+            if workers < WEB_WORKERS:
+                logger.warning(f"WEB_WORKERS={WEB_WORKERS} capped to {workers} as the service state is held in process memory.")
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", WEB_THREADS)
+            self.cfg.set("graceful_timeout", GRACEFUL_TIMEOUT) # In-flight requests finish on SIGTERM before workers exit
+            self.cfg.set("post_fork", restartAfterFork)
+            if CATALOG_SNAPSHOT == 1:
+                self.cfg.set("on_exit", saveCatalogSnapshot) # Runs once, in the master
+                self.cfg.set("when_ready", startSnapshotRefresh)
+
+        def load(self):
+            return app
+
+    ProductionServer().run()
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "snapshot": # Converter: 'python catalog_service.py snapshot [catalog.csv] [snapshot dir]'
+        writeCatalogSnapshot(*sys.argv[2:4])
+        exit(0)
+
     try:
         catalogInit()
         logger.info("Catalog initialized Correctly.")
@@ -154,8 +618,12 @@ if __name__ == "__main__":
         logger.error(f"Error during catalog initialization: {e}")
         exit(1) 
 
+    if CATALOG_SNAPSHOT == 1 and SERVER_MODE != "gunicorn":
+        atexit.register(saveCatalogSnapshot)
+        startSnapshotRefresh()
+
     try:
-        app.run(host=CATALOG_HOST, port=CATALOG_PORT, threaded=True)
+        runServer(CATALOG_HOST, CATALOG_PORT, WEB_WORKERS if CATALOG_BACKEND == "shared" else 1)
     except Exception as e:
         logger.error(f"Error while starting the Flask server: {e}")
         exit(1) 
\ No newline at end of file
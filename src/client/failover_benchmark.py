@@ -0,0 +1,71 @@
+# Importing the Required Libraries
+import requests, time, os, argparse, subprocess, threading, logging
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+logger = logging.getLogger(__name__)
+
+# Failover Benchmark - Places a steady stream of orders through the Front-end, stops the order leader after 'kill_after' seconds
+# (e.g. '--kill-command "docker stop order-service-3"') and reports how long the order path was unavailable
+FRONTEND_SERVICE_URL = os.environ.get("FRONTEND_SERVICE_URL", "http://frontend-service:9001")
+
+def placeOrder(session, trade_type):
+    start = time.monotonic()
+    try:
+        response = session.post(f"{FRONTEND_SERVICE_URL}/orders", json={"stock_name": "APPL", "type": trade_type, "quantity": 1}, timeout=10)
+        succeeded = response.status_code == 200
+    except requests.RequestException as e:
+        logger.info(f"Error during order placement: {e}")
+        succeeded = False
+    return start, time.monotonic(), succeeded
+
+def runBenchmark(duration, interval, kill_after, kill_command):
+    results = []
+    killed_at = []
+    def killLeader():
+        killed_at.append(time.monotonic())
+        logger.info(f"Stopping the leader: {kill_command}")
+        subprocess.run(kill_command, shell=True, check=False)
+    killer = threading.Timer(kill_after, killLeader)
+    if kill_command:
+        killer.start()
+    benchmark_start = time.monotonic()
+    with requests.Session() as session:
+        while time.monotonic() - benchmark_start < duration:
+            result = placeOrder(session, "buy" if len(results) % 2 == 0 else "sell") # Alternating keeps the stock level stable
+            results.append(result)
+            time.sleep(max(0, interval - (result[1] - result[0])))
+    killer.cancel()
+    return results, killed_at[0] if killed_at else None
+
+def summarizeFailover(results, killed_at):
+    latencies = np.array([(end - start) * 1000 for start, end, _ in results])
+    summary = {
+        "orders": len(results),
+        "failed": sum(1 for _, _, succeeded in results if not succeeded),
+        "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+        "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+        "failover_ms": None
+    }
+    if killed_at is not None:
+        recovered = [end for start, end, succeeded in results if succeeded and start >= killed_at]
+        if recovered: # The first order placed after the kill that succeeded marks the end of the failover
+            summary["failover_ms"] = (recovered[0] - killed_at) * 1000
+    return summary
+
+def printReport(summary):
+    print(f"orders: {summary['orders']}  failed: {summary['failed']}")
+    print(f"order latency p50: {summary['p50_ms']:.2f} ms  p99: {summary['p99_ms']:.2f} ms")
+    if summary["failover_ms"] is not None:
+        print(f"failover (leader stopped -> first successful order): {summary['failover_ms']:.2f} ms")
+    else:
+        print("failover: no successful order after the leader was stopped")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure order-path failover time when the order leader is stopped")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds to keep placing orders")
+    parser.add_argument("--interval", type=float, default=0.05, help="Seconds between orders")
+    parser.add_argument("--kill-after", type=float, default=5, help="Seconds before the leader is stopped")
+    parser.add_argument("--kill-command", default="", help="Shell command that stops the leader, e.g. 'docker stop order-service-3'")
+    args = parser.parse_args()
+    printReport(summarizeFailover(*runBenchmark(args.duration, args.interval, args.kill_after, args.kill_command)))
@@ -0,0 +1,77 @@
+# Importing the Required Libraries
+from flask import Flask, request, jsonify
+import os, sys, json, logging, threading, re
+from collections import defaultdict
+from urllib.parse import urlparse
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+logger = logging.getLogger(__name__)
+
+# Local stand-in for an OTLP collector - services started with TRACE_COLLECTOR_URL post their spans to '/v1/traces',
+# which are appended to TRACE_FILE. Running 'python trace_collector.py report <file>' prints the per-hop latency breakdown
+app = Flask(__name__)
+
+# Global Environment variables
+TRACE_COLLECTOR_PORT = int(os.environ.get("TRACE_COLLECTOR_PORT", "4318"))
+TRACE_COLLECTOR_HOST = os.environ.get("TRACE_COLLECTOR_HOST", "0.0.0.0")
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces.jsonl")
+
+trace_file_lock = threading.Lock()
+
+@app.route("/v1/traces", methods=["POST"])
+def collectSpans():
+    spans = (request.get_json(silent=True) or {}).get("spans", [])
+    with trace_file_lock:
+        with open(TRACE_FILE, mode="a") as file:
+            file.writelines(json.dumps(span) + "\n" for span in spans)
+    return jsonify({"received": len(spans)}), 200
+
+# Helper Functions - Group spans by hop (service, operation and target endpoint) and summarize their latencies
+def hopName(span):
+    name = f"{span['service']} {span['name']}"
+    url = span.get("attributes", {}).get("url")
+    if url:
+        parsed = urlparse(url)
+        path = re.sub(r"/[^/]+$", "/<id>", parsed.path) if parsed.path.count("/") > 1 else parsed.path
+        name += f" {parsed.netloc}{path}"
+    return name
+
+def loadSpans(path):
+    spans = []
+    with open(path, mode="r") as file:
+        for line in file:
+            try:
+                spans.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return spans
+
+def summarizeHops(spans):
+    durations = defaultdict(list)
+    for span in spans:
+        durations[hopName(span)].append((span["end_time_unix_nano"] - span["start_time_unix_nano"]) / 1e6)
+    summary = []
+    for hop, values in durations.items():
+        values = np.array(values)
+        summary.append({
+            "hop": hop,
+            "count": len(values),
+            "mean_ms": float(values.mean()),
+            "p50_ms": float(np.percentile(values, 50)),
+            "p99_ms": float(np.percentile(values, 99)),
+            "total_ms": float(values.sum())
+        })
+    return sorted(summary, key=lambda row: row["total_ms"], reverse=True)
+
+def printReport(path):
+    print(f"{'hop':<90} {'count':>7} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for row in summarizeHops(loadSpans(path)):
+        print(f"{row['hop']:<90} {row['count']:>7} {row['mean_ms']:>9.2f} {row['p50_ms']:>9.2f} {row['p99_ms']:>9.2f}")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "report":
+        printReport(sys.argv[2] if len(sys.argv) > 2 else TRACE_FILE)
+    else:
+        logger.info(f"Trace collector writing spans to {TRACE_FILE}")
+        app.run(host=TRACE_COLLECTOR_HOST, port=TRACE_COLLECTOR_PORT, threaded=True)
@@ -1,54 +1,492 @@
 # Importing the Required Libraries
-from flask import Flask, request
-import requests, os, logging, threading
-from collections import deque
+from flask import Flask, request, g, Response, stream_with_context
+from flask.json.provider import JSONProvider
+import requests, os, logging, threading, queue, json, time, random, atexit, asyncio, contextvars, functools, zlib
+import aiohttp
+from aiohttp import web
+from logging.handlers import QueueHandler, QueueListener
+from threading import Thread
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import orjson
+except ImportError: # Optional, the services fall back to the standard library codec
+    orjson = None
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+# Logging - Request threads only enqueue log records, a QueueListener thread formats them (JSON by default) and writes to stderr.
+# Per-module levels come from LOG_LEVELS (e.g. "werkzeug=WARNING,__main__.hot=DEBUG") and hot-path logs are sampled at LOG_SAMPLE_RATE
+# Reference: https://docs.python.org/3/howto/logging-cookbook.html#dealing-with-handlers-that-block
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "werkzeug=WARNING")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+class SampleFilter(logging.Filter): # Keeps a fraction of the records below WARNING, warnings and errors always pass
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+def setupLogging():
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(logQueue)]
+    root.setLevel(LOG_LEVEL)
+    for entry in filter(None, LOG_LEVELS.split(",")):
+        name, _, level = entry.partition("=")
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+    listener = QueueListener(logQueue, handler)
+    listener.start()
+    atexit.register(listener.stop) # Flushes the queued records on shutdown
+    return listener
+
+setupLogging()
 logger = logging.getLogger(__name__)
+hot_logger = logging.getLogger(f"{__name__}.hot") # Per-request logs on the lookup/replication hot paths
+hot_logger.addFilter(SampleFilter(LOG_SAMPLE_RATE))
 
 # LRU Cache Implementation to cache most used stocks, where the stocks are invalidated when catalog is updated using server-push technique
 # Reference: https://www.geeksforgeeks.org/lru-cache-implementation/
 class LRUCache:
-    def __init__(self, capacity):
+    def __init__(self, capacity, admission=None):
         self.cache = {}  
         self.access_order = deque()  
+        self.stale_since = {} # Keys marked stale by an invalidation, kept until refreshed while stale reads are allowed
+        self.bodies = {} # key -> (value, encoded response body), dropped whenever the key is replaced or leaves the cache
+        self.admission = admission # Optional admission policy consulted before a new key evicts the LRU key
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.rejected = 0
         self.capacity = capacity
         self.lock = threading.Lock() 
 
     def get(self, key):
+        return self.getWithStaleness(key, 0)[0]
+
+    def getWithStaleness(self, key, max_staleness): # Returns (value, stale), logging happens after the lock is released
         with self.lock: 
-            if key in self.cache:
+            value = self.cache.get(key)
+            stale = key in self.stale_since
+            if value is not None and stale and time.monotonic() - self.stale_since[key] > max_staleness:
+                value = None
+            if value is not None:
                 self.access_order.remove(key)
                 self.access_order.append(key)
-                logger.info(f"Cache hit for key: {key}") 
-                return self.cache[key]
-            logger.info(f"Cache miss for key: {key}") 
-            return None
+                self.hits += 1
+                if stale:
+                    self.stale_hits += 1
+            else:
+                self.misses += 1
+            if self.admission is not None:
+                self.admission.record(key)
+        hot_logger.info("Cache %s for key: %s", ("stale hit" if stale else "hit") if value is not None else "miss", key)
+        return value, value is not None and stale
 
     def put(self, key, value):
+        lru_key = rejected_by = None
         with self.lock:
+            self.stale_since.pop(key, None)
+            self.bodies.pop(key, None)
             if key in self.cache:
                 self.cache[key] = value
                 self.access_order.remove(key)
                 self.access_order.append(key)
-            else:
+            elif len(self.cache) < self.capacity or self.admission is None or self.admission.admit(key, self.access_order[0]):
                 if len(self.cache) >= self.capacity:
                     lru_key = self.access_order.popleft()
                     del self.cache[lru_key]
-                    logger.info(f"Evicted {lru_key} from cache due to capacity limit.")
+                    self.stale_since.pop(lru_key, None)
+                    self.bodies.pop(lru_key, None)
                 self.cache[key] = value
                 self.access_order.append(key)
+            else:
+                self.rejected += 1
+                rejected_by = self.access_order[0]
+        if lru_key is not None:
+            hot_logger.info("Evicted %s from cache due to capacity limit.", lru_key)
+        if rejected_by is not None:
+            hot_logger.info("Rejected %s from cache, less frequent than %s.", key, rejected_by)
 
     def invalidate(self, key):
         with self.lock: 
-            if key in self.cache:
+            invalidated = key in self.cache
+            self.stale_since.pop(key, None)
+            self.bodies.pop(key, None)
+            if invalidated:
                 del self.cache[key]
                 self.access_order.remove(key)
-                logger.info(f"Invalidated {key} from cache.")
+        if invalidated:
+            hot_logger.info("Invalidated %s from cache.", key)
+
+    def encoded(self, key, value, encode): # Encodes 'value' once while it is the cached value of 'key'
+        with self.lock:
+            body = self.bodies.get(key)
+            if body is not None and body[0] is value:
+                return body[1]
+        encoded = encode(value) # Outside the lock, a concurrent miss at worst encodes the same value twice
+        with self.lock:
+            if self.cache.get(key) is value:
+                self.bodies[key] = (value, encoded)
+        return encoded
+
+    def markStale(self, key): # Keeps the entry for stale reads, the first invalidation starts the staleness clock
+        with self.lock:
+            if key in self.cache:
+                self.stale_since.setdefault(key, time.monotonic())
+
+    def hottest(self, count):
+        with self.lock:
+            return list(self.access_order)[-count:] if count > 0 else []
+
+# TinyLFU Admission - A Count-Min Sketch estimates how often every stock was looked up recently (4-bit counters, halved after
+# every 'sample_size' lookups). A new stock only replaces the LRU victim when it is estimated to be more frequent, so a single
+# scan over the whole catalog cannot flush the hot set out of the LRU cache
+# Reference: https://arxiv.org/abs/1512.00727
+SKETCH_SEEDS = (0xc3a5c85c97cb3127, 0xb492b66fbe98f273, 0x9ae16a3b2f90404f, 0xcbf29ce484222325)
+
+class CountMinSketch:
+    def __init__(self, width, depth=4):
+        self.width = width
+        self.rows = [[0] * width for _ in range(depth)]
+        self.sample_size = 10 * width
+        self.additions = 0
+
+    def indexes(self, key): # One multiplicative hash per row, so keys colliding in one row rarely collide in the others
+        key_hash = hash(key)
+        return [(((key_hash * seed) & 0xFFFFFFFFFFFFFFFF) >> 32) % self.width for seed in SKETCH_SEEDS[:len(self.rows)]]
+
+    def increment(self, key):
+        for row, index in zip(self.rows, self.indexes(key)):
+            if row[index] < 15:
+                row[index] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.reset()
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self.indexes(key)))
+
+    def reset(self): # Aging, so keys that were hot a while ago lose their frequency
+        for row in self.rows:
+            row[:] = [count // 2 for count in row]
+        self.additions //= 2
+
+class TinyLFUAdmission: # Called under the cache lock
+    def __init__(self, capacity):
+        self.sketch = CountMinSketch(max(64, 16 * capacity))
+
+    def record(self, key):
+        self.sketch.increment(key)
+
+    def admit(self, candidate, victim):
+        return self.sketch.estimate(candidate) > self.sketch.estimate(victim)
+
+# Negative Cache - Stocks the Catalog reported as not found are remembered for NEGATIVE_CACHE_TTL seconds, so repeated lookups of
+# typos and delisted tickers are answered without a Catalog hop. Bounded to 'capacity' entries, the oldest entry is evicted first
+class NegativeCache:
+    def __init__(self, capacity, ttl):
+        self.entries = OrderedDict() # stock name -> (expiry time, Catalog error body)
+        self.capacity = capacity
+        self.ttl = ttl
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self.entries[key]
+                entry = None
+            if entry is not None:
+                self.hits += 1
+        if entry is not None:
+            hot_logger.info("Negative cache hit for key: %s", key)
+            return entry[1]
+        return None
+
+    def put(self, key, body):
+        with self.lock:
+            self.entries.pop(key, None)
+            if len(self.entries) >= self.capacity:
+                self.entries.popitem(last=False)
+            self.entries[key] = (time.monotonic() + self.ttl, body)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+# Order Cache - Completed orders never change, so unlike the stock cache there are no invalidations, stale reads or encoded
+# bodies to track. An OrderedDict keeps the recency order, moving or evicting a key is O(1) instead of a deque scan
+class OrderCache:
+    def __init__(self, capacity):
+        self.entries = OrderedDict() # transaction number -> order
+        self.capacity = capacity
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            order = self.entries.get(key)
+            if order is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+        return order
+
+    def put(self, key, order):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            elif len(self.entries) >= self.capacity:
+                self.entries.popitem(last=False)
+            self.entries[key] = order
+
+# Single-flight Request Coalescing - Concurrent cache misses for the same stock share one in-flight Catalog fetch. The caller that
+# starts the flight fetches and stores the result, the others wait for it. An invalidation forgets the in-flight fetch, so its
+# possibly stale result is still returned to its waiters but is not cached, and the next miss starts a new flight
+# Reference: https://pkg.go.dev/golang.org/x/sync/singleflight
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}
+        self.coalesced = 0
+        self.forgets = 0
+        self.lock = threading.Lock()
+
+    def do(self, key, fetch, store=None): # store runs under the lock, so it cannot interleave with forget
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self.calls[key] = call
+            else:
+                self.coalesced += 1
+        if not leader:
+            hot_logger.info("Joined in-flight fetch for key: %s", key)
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = fetch()
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                if self.calls.get(key) is call:
+                    del self.calls[key]
+                    if call["error"] is None and store is not None:
+                        store(call["result"])
+            call["done"].set()
+        return call["result"]
+
+    def forget(self, key):
+        with self.lock:
+            self.calls.pop(key, None)
+            self.forgets += 1
+
+    def storeUnlessForgotten(self, forgets, store): # For results fetched outside a flight, dropped if any key was invalidated since
+        with self.lock:
+            if self.forgets == forgets:
+                store()
+                return True
+            return False
+
+class AsyncSingleFlight: # Event loop counterpart of SingleFlight, waiters await the leader's future
+    def __init__(self):
+        self.calls = {}
+        self.coalesced = 0
+
+    async def do(self, key, fetch, store=None):
+        call = self.calls.get(key)
+        if call is not None:
+            self.coalesced += 1
+            hot_logger.info("Joined in-flight fetch for key: %s", key)
+            return await asyncio.shield(call)
+        call = asyncio.get_running_loop().create_future()
+        self.calls[key] = call
+        try:
+            result = await fetch()
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except Exception as e:
+            call.set_exception(e)
+            call.exception() # Marks the exception as retrieved when no caller is waiting
+            raise
+        finally:
+            if self.calls.get(key) is call:
+                del self.calls[key]
+                if not call.done() and store is not None:
+                    store(result)
+        call.set_result(result)
+        return result
+
+    def forget(self, key):
+        self.calls.pop(key, None)
+
+# Change Feed - Catalog updates reach the front-end through the same '/invalidate' call that drops the cached entry, and are pushed
+# to clients subscribed on '/stream/stocks' as server-sent events. Each subscriber buffers at most one pending update per stock
+# (newer updates replace older ones), and a subscriber with more than CHANGE_FEED_BUFFER stocks pending is disconnected
+# Reference: https://html.spec.whatwg.org/multipage/server-sent-events.html
+class ChangeSubscriber:
+    def __init__(self, symbols, capacity, wakeup):
+        self.symbols = symbols # None subscribes to every stock
+        self.capacity = capacity
+        self.wakeup = wakeup # Called after every offer, sets a threading.Event or an asyncio.Event
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+        self.coalesced = 0
+        self.overflowed = False
+
+    def offer(self, stock_name, update):
+        with self.lock:
+            if stock_name in self.pending:
+                del self.pending[stock_name] # The newer update is delivered in the older one's place in line
+                self.coalesced += 1
+            self.pending[stock_name] = update
+            self.overflowed = self.overflowed or len(self.pending) > self.capacity
+        self.wakeup()
+
+    def drain(self):
+        with self.lock:
+            updates = list(self.pending.values())
+            self.pending.clear()
+        return updates
+
+class ChangeFeed:
+    def __init__(self, max_subscribers, capacity):
+        self.max_subscribers = max_subscribers
+        self.capacity = capacity
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, symbols, wakeup): # Returns None when the feed is full
+        subscriber = ChangeSubscriber(symbols, self.capacity, wakeup)
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, stock_name, update):
+        with self.lock:
+            subscribers = list(self.subscribers)
+            self.published += 1
+        for subscriber in subscribers:
+            if subscriber.symbols is None or stock_name in subscriber.symbols:
+                subscriber.offer(stock_name, update)
+
+# Order Replica Selection - Order queries are spread over the replicas round-robin or to the one with the fewest queries in flight.
+# A replica that fails a query is skipped for 'retry_after' seconds
+class ReplicaSelector:
+    def __init__(self, urls, retry_after=5):
+        self.urls = list(urls)
+        self.in_flight = {url: 0 for url in self.urls}
+        self.unhealthy_until = {}
+        self.retry_after = retry_after
+        self.next_index = 0
+        self.lock = threading.Lock()
+
+    def choose(self, policy):
+        now = time.monotonic()
+        with self.lock:
+            healthy = [url for url in self.urls if self.unhealthy_until.get(url, 0) <= now]
+            if not healthy:
+                return None
+            if policy == "least_loaded":
+                return min(healthy, key=lambda url: self.in_flight[url])
+            self.next_index += 1
+            return healthy[self.next_index % len(healthy)]
+
+    @contextmanager
+    def track(self, url):
+        with self.lock:
+            self.in_flight[url] += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_flight[url] -= 1
+
+    def markUnhealthy(self, url):
+        with self.lock:
+            self.unhealthy_until[url] = time.monotonic() + self.retry_after
 
 # Reference: https://flask.palletsprojects.com/en/stable/quickstart/ 
 app = Flask(__name__)
 
+# JSON Codec - Response bodies and inter-service payloads are encoded with orjson when it is installed (JSON_CODEC=json forces
+# the standard library). Flask's jsonify, dict responses and request.get_json all go through the same codec
+# Reference: https://github.com/ijl/orjson
+JSON_CODEC = os.environ.get("JSON_CODEC", "orjson") if orjson is not None else "json"
+
+def jsonEncode(payload, sort_keys=False, indent=None): # Compact UTF-8 bytes unless indented, orjson only indents by 2
+    if JSON_CODEC == "orjson" and indent in (None, 2):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        option |= (orjson.OPT_SORT_KEYS if sort_keys else 0) | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(payload, option=option)
+    return json.dumps(payload, sort_keys=sort_keys, indent=indent, separators=None if indent is not None else (",", ":")).encode()
+
+def jsonDecode(body): # Accepts bytes or str, raises ValueError on malformed input
+    return orjson.loads(body) if JSON_CODEC == "orjson" else json.loads(body)
+
+class CodecJSONProvider(JSONProvider):
+    sort_keys = False # Unlike Flask's default provider, responses keep the key order instead of paying for a sort
+    compact = None # As in Flask's default provider, None indents responses in debug mode only
+    mimetype = "application/json"
+
+    def dumps(self, obj, sort_keys=False, indent=None, **kwargs): # Other json.dumps options have no orjson equivalent
+        if kwargs:
+            raise TypeError(f"Unsupported JSON encoding options: {', '.join(sorted(kwargs))}")
+        return jsonEncode(obj, sort_keys, indent).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            raise TypeError(f"Unsupported JSON decoding options: {', '.join(sorted(kwargs))}")
+        return jsonDecode(s)
+
+    def response(self, *args, **kwargs): # Same arguments as Flask's jsonify, the encoded bytes are sent without a round trip through str
+        if args and kwargs:
+            raise TypeError("app.json.response() takes either args or kwargs, not both")
+        if not args and not kwargs:
+            obj = None
+        elif len(args) == 1:
+            obj = args[0]
+        else:
+            obj = list(args) or kwargs
+        indent = 2 if self.compact is False or (self.compact is None and self._app.debug) else None
+        return self._app.response_class(jsonEncode(obj, self.sort_keys, indent), mimetype=self.mimetype)
+
+app.json = CodecJSONProvider(app)
+
 # Global Environment variables from Docker Compose file
 CATALOG_SERVICE_URL = os.environ.get("CATALOG_SERVICE_URL", "http://catalog-service:8997")
 ORDER_SERVICE_URLS = os.environ.get("ORDER_SERVICE_URLS", "http://order-service-3:9000").split(",")
@@ -57,43 +495,264 @@ FRONTEND_HOST = os.environ.get("FRONTEND_HOST", "0.0.0.0")
 CACHE_ENABLED = int(os.environ.get("CACHE_ENABLED","1"))
 LEADER_URL = None
 CACHE_SIZE = int(os.environ.get("CACHE_SIZE","5"))
+CACHE_POLICY = os.environ.get("CACHE_POLICY", "lru") # 'lru' admits every fetched stock, 'tinylfu' adds frequency-based admission
 
-logger.info(f"Initialized cache with size: {CACHE_SIZE}")
+logger.info(f"Initialized cache with size: {CACHE_SIZE} and policy: {CACHE_POLICY}")
 
 if CACHE_ENABLED == 1:
-    cache = LRUCache(CACHE_SIZE)
+    cache = LRUCache(CACHE_SIZE, TinyLFUAdmission(CACHE_SIZE) if CACHE_POLICY == "tinylfu" else None)
 else:
     logger.info("Set to No Cache")
     cache = None
 
+# Catalog Partitioning - CATALOG_SERVICE_URLS lists one catalog instance per partition, in partition order. A stock is owned
+# by partition CRC-32(name) % N, the same hash the Catalog instances use, and CATALOG_SERVICE_URL is the single partition
+CATALOG_SERVICE_URLS = os.environ.get("CATALOG_SERVICE_URLS", CATALOG_SERVICE_URL).split(",")
+
+def catalogPartition(stock_name, partitions): # Must match the Catalog service
+    return zlib.crc32(stock_name.encode()) % partitions
+
+def catalogUrl(stock_name):
+    return CATALOG_SERVICE_URLS[catalogPartition(stock_name, len(CATALOG_SERVICE_URLS))]
+
+ORDER_READ_POLICY = os.environ.get("ORDER_READ_POLICY", "round_robin") # 'leader', 'round_robin' or 'least_loaded'
+order_replicas = ReplicaSelector(ORDER_SERVICE_URLS)
+
+# Completed orders never change once written, so they are cached by transaction number without invalidation. Entries come from
+# successful order placements and order queries, which lets clients verify their orders without an Order service hop
+ORDER_CACHE_ENABLED = int(os.environ.get("ORDER_CACHE_ENABLED", "1"))
+ORDER_CACHE_SIZE = int(os.environ.get("ORDER_CACHE_SIZE", "1000"))
+order_cache = OrderCache(ORDER_CACHE_SIZE)
+
+SINGLE_FLIGHT_ENABLED = int(os.environ.get("SINGLE_FLIGHT_ENABLED", "1"))
+lookup_flights = SingleFlight()
+
+NEGATIVE_CACHE_ENABLED = int(os.environ.get("NEGATIVE_CACHE_ENABLED", "1"))
+NEGATIVE_CACHE_SIZE = int(os.environ.get("NEGATIVE_CACHE_SIZE", "1000"))
+NEGATIVE_CACHE_TTL = float(os.environ.get("NEGATIVE_CACHE_TTL", "5"))
+negative_cache = NegativeCache(NEGATIVE_CACHE_SIZE, NEGATIVE_CACHE_TTL)
+
+# Stale-while-revalidate and Refresh-ahead - With CACHE_STALE_SECONDS > 0 an invalidation only marks the entry stale. Stale entries are
+# served for up to CACHE_STALE_SECONDS while one background fetch refreshes them, older ones are treated as a miss. Independently,
+# an invalidated stock among the REFRESH_AHEAD_KEYS most recently used ones is fetched again REFRESH_AHEAD_DELAY seconds later
+# Reference: https://datatracker.ietf.org/doc/html/rfc5861
+CACHE_STALE_SECONDS = float(os.environ.get("CACHE_STALE_SECONDS", "0"))
+REFRESH_AHEAD_KEYS = int(os.environ.get("REFRESH_AHEAD_KEYS", "0"))
+REFRESH_AHEAD_DELAY = float(os.environ.get("REFRESH_AHEAD_DELAY", "0.05"))
+pending_refreshes = set() # Stocks with a scheduled or running background refresh
+refresh_lock = threading.Lock()
+
+CHANGE_FEED_ENABLED = int(os.environ.get("CHANGE_FEED_ENABLED", "1"))
+
+def defaultFeedSubscribers(): # A sync stream holds a gunicorn thread for its lifetime, so streams get at most half of WEB_THREADS
+    if os.environ.get("FRONTEND_MODE", "sync") == "async":
+        return 100
+    return max(1, int(os.environ.get("WEB_THREADS", "32")) // 2)
+
+CHANGE_FEED_MAX_SUBSCRIBERS = int(os.environ.get("CHANGE_FEED_MAX_SUBSCRIBERS", defaultFeedSubscribers()))
+CHANGE_FEED_BUFFER = int(os.environ.get("CHANGE_FEED_BUFFER", "1000"))
+CHANGE_FEED_HEARTBEAT = float(os.environ.get("CHANGE_FEED_HEARTBEAT", "15")) # Seconds between keep-alive comments on an idle stream
+change_feed = ChangeFeed(CHANGE_FEED_MAX_SUBSCRIBERS, CHANGE_FEED_BUFFER)
+
+# Distributed Tracing - W3C 'traceparent' header is propagated on every inter-service call, with one span per hop,
+# lock wait and disk write. Spans are exported in the background as JSON lines to TRACE_FILE or to a local collector
+# Reference: https://www.w3.org/TR/trace-context/
+TRACING_ENABLED = int(os.environ.get("TRACING_ENABLED", "0"))
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces_frontend.jsonl")
+TRACE_COLLECTOR_URL = os.environ.get("TRACE_COLLECTOR_URL", "")
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "frontend-service")
+
+trace_context = contextvars.ContextVar("trace_span", default=None) # Per request thread in Flask, per task in async mode
+trace_queue = queue.Queue()
+
+def startSpan(name, **attributes):
+    parent = trace_context.get()
+    span = {
+        "trace_id": parent["trace_id"] if parent else os.urandom(16).hex(),
+        "span_id": os.urandom(8).hex(),
+        "parent_span_id": parent["span_id"] if parent else None,
+        "service": TRACE_SERVICE_NAME,
+        "name": name,
+        "start_time_unix_nano": time.time_ns(),
+        "attributes": attributes,
+        "parent": parent
+    }
+    trace_context.set(span)
+    return span
+
+def endSpan(span):
+    span["end_time_unix_nano"] = time.time_ns()
+    trace_context.set(span.pop("parent"))
+    trace_queue.put(span)
+
+@contextmanager
+def traceSpan(name, **attributes):
+    if TRACING_ENABLED != 1:
+        yield None
+        return
+    span = startSpan(name, **attributes)
+    try:
+        yield span
+    finally:
+        endSpan(span)
+
+@contextmanager
+def tracedLock(lock, name): # Records the time spent waiting for the lock as its own span
+    with traceSpan(f"lock_wait {name}"):
+        lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+def traceHeaders():
+    span = trace_context.get()
+    if TRACING_ENABLED != 1 or not span:
+        return {}
+    return {"traceparent": f"00-{span['trace_id']}-{span['span_id']}-01"}
+
+def tracedRequest(method, url, **kwargs): # Client span for a single hop, the callee records the matching server span
+    with traceSpan(f"HTTP {method.upper()}", url=url) as span:
+        kwargs["headers"] = {**kwargs.get("headers", {}), **traceHeaders()}
+        response = getattr(requests, method)(url, **kwargs)
+        if span:
+            span["attributes"]["status_code"] = response.status_code
+        return response
+
+def withTraceContext(target): # Carries the current span into a background thread
+    parent = trace_context.get()
+    def run(*args, **kwargs):
+        previous = trace_context.get()
+        trace_context.set(parent)
+        try:
+            return target(*args, **kwargs)
+        finally:
+            trace_context.set(previous) # Pooled threads must not keep the span for the next task
+    return run
+
+def exportSpans():
+    while True:
+        batch = [trace_queue.get()]
+        while not trace_queue.empty() and len(batch) < 100:
+            batch.append(trace_queue.get())
+        try:
+            if TRACE_COLLECTOR_URL:
+                requests.post(f"{TRACE_COLLECTOR_URL}/v1/traces", json={"spans": batch}, timeout=2)
+            else:
+                with open(TRACE_FILE, mode="a") as file:
+                    file.writelines(json.dumps(span) + "\n" for span in batch)
+        except Exception as e:
+            logger.warning(f"Dropped {len(batch)} spans during export: {e}")
+
+def continueTrace(traceparent):
+    trace_context.set(None)
+    parts = traceparent.split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        trace_context.set({"trace_id": parts[1], "span_id": parts[2]}) # Remote parent from the calling service
+
+@app.before_request
+def startRequestSpan():
+    if TRACING_ENABLED != 1:
+        return
+    continueTrace(request.headers.get("traceparent", ""))
+    g.trace_span = startSpan(f"{request.method} {request.url_rule.rule if request.url_rule else request.path}")
+
+@app.after_request
+def recordResponseStatus(response):
+    span = g.get("trace_span")
+    if span:
+        span["attributes"]["status_code"] = response.status_code
+    return response
+
+@app.teardown_request
+def endRequestSpan(error=None):
+    span = g.pop("trace_span", None)
+    if span:
+        endSpan(span)
+        trace_context.set(None)
+
+if TRACING_ENABLED == 1:
+    Thread(target=exportSpans, daemon=True).start()
+
 # Helper functions - 3 Order Service Replicas are created and one of them is Elected as Leader, and the Leader is notified to all other replicas
+# All replicas are probed concurrently and the highest-ID responsive one is chosen as soon as its probe answers, so a dead replica
+# costs one probe timeout in total. The timeout adapts to the observed ping round trip (4x its moving average, within bounds)
+ELECTION_TIMEOUT_MIN = float(os.environ.get("ELECTION_TIMEOUT_MIN", "0.05"))
+ELECTION_TIMEOUT_MAX = float(os.environ.get("ELECTION_TIMEOUT_MAX", "1.0"))
+election_pool = None # Created per process by electionPool
+election_pool_pid = None
+election_pool_lock = threading.Lock()
+probe_rtt = None # Moving average of the ping round trip in seconds
+probe_rtt_lock = threading.Lock()
+
+def electionPool(): # The start-up election runs in the gunicorn master, and a pool inherited across fork has no threads in the worker
+    global election_pool, election_pool_pid
+    with election_pool_lock:
+        if election_pool is None or election_pool_pid != os.getpid():
+            election_pool = ThreadPoolExecutor(max_workers=max(8, 2 * len(ORDER_SERVICE_URLS)))
+            election_pool_pid = os.getpid()
+        return election_pool
+
+def recordProbeRtt(rtt):
+    global probe_rtt
+    with probe_rtt_lock:
+        probe_rtt = rtt if probe_rtt is None else 0.8 * probe_rtt + 0.2 * rtt
+
+def probeTimeout():
+    with probe_rtt_lock:
+        rtt = probe_rtt
+    return ELECTION_TIMEOUT_MAX if rtt is None else min(ELECTION_TIMEOUT_MAX, max(ELECTION_TIMEOUT_MIN, 4 * rtt))
+
+def pingReplica(url, timeout=None): # Raises requests.RequestException when the replica does not answer within the timeout
+    start = time.monotonic()
+    response = tracedRequest("get", f"{url}/ping", timeout=timeout or probeTimeout())
+    if response.status_code == 200:
+        recordProbeRtt(time.monotonic() - start)
+    return response
+
+def probeReplica(url): # Returns the replica's ping reply, or None when it is unresponsive
+    try:
+        response = pingReplica(url)
+        return jsonDecode(response.content) if response.status_code == 200 else None
+    except (requests.RequestException, ValueError) as e:
+        logger.info(f"Order Service Replica at {url} is unresponsive. Skipped. Error: {e}")
+        return None
+
 def findLeader():
     global LEADER_URL
     logger.info("Selecting Leader")
-    for url in sorted(ORDER_SERVICE_URLS, reverse=True):
-        logger.info(f"Pinging Order Service Replica at {url}")
-        try:
-            response = requests.get(f"{url}/ping", timeout=5)
-            if response.status_code == 200:
-                LEADER_URL = url
-                logger.info(f"Leader selected: {LEADER_URL}")
-                notifyOrderServiceReplicas(LEADER_URL)
-                return
-        except requests.RequestException as e:
-            logger.info(f"Order Service Replica at {url} is unresponsive. Skipped. Error: {e}")
+    candidates = sorted(ORDER_SERVICE_URLS, reverse=True)
+    logger.info(f"Pinging Order Service Replicas at {candidates}")
+    probes = {url: electionPool().submit(withTraceContext(probeReplica), url) for url in candidates}
+    for url in candidates: # Highest ID first, the lower ones are probed meanwhile
+        status = probes[url].result()
+        if status is not None:
+            holder = status.get("lease_holder")
+            if holder in probes and holder != url and probes[holder].result() is not None:
+                url = holder # A live leader lease wins over the preference order, so several front-ends agree on one leader
+            LEADER_URL = url
+            logger.info(f"Leader selected: {LEADER_URL}")
+            notifyOrderServiceReplicas(LEADER_URL, probes)
+            return
     logger.error("No responsive replicas found. Cannot select a leader.")
     raise Exception("No responsive replicas found. Cannot select a leader.")
 
-def notifyOrderServiceReplicas(leader_url):
-    for url in ORDER_SERVICE_URLS:
-        try:
-            response = requests.post(f"{url}/set_leader", json={"leader_id": leader_url}, timeout=5)
-            if response.status_code == 200:
-                logger.info(f"Replica at {url} notified about the leader chosen: {leader_url}")
-            else:
-                logger.info(f"Failed to notify replica at {url}. Response: {response.status_code}")
-        except requests.RequestException as e:
-            logger.info(f"Skipping replica at {url} due to error: {e}")
+def notifyReplica(url, leader_url):
+    try:
+        response = tracedRequest("post", f"{url}/set_leader", json={"leader_id": leader_url}, timeout=probeTimeout())
+        if response.status_code == 200:
+            logger.info(f"Replica at {url} notified about the leader chosen: {leader_url}")
+        else:
+            logger.info(f"Failed to notify replica at {url}. Response: {response.status_code}")
+    except requests.RequestException as e:
+        logger.info(f"Skipping replica at {url} due to error: {e}")
+
+def notifyOrderServiceReplicas(leader_url, probes): # Only the leader's notification is awaited
+    notify = withTraceContext(notifyReplica)
+    for url, probe in probes.items(): # Followers are notified in the background once their probe answered, unresponsive ones never
+        if url != leader_url:
+            probe.add_done_callback(lambda done, url=url: done.result() is not None and electionPool().submit(notify, url, leader_url))
+    notify(leader_url, leader_url)
 
 def orderHandler(order_data, max_retries=3):
     global LEADER_URL
@@ -101,31 +760,50 @@ def orderHandler(order_data, max_retries=3):
         findLeader()
     for attempt in range(max_retries):
         try:
-            logger.info(f"Order happening on leader: {LEADER_URL}")
-            response = requests.get(f"{LEADER_URL}/ping", timeout=5)
+            hot_logger.info("Order happening on leader: %s", LEADER_URL)
+            response = pingReplica(LEADER_URL)
             if response.status_code != 200:
                 raise requests.RequestException("Leader unresponsive")
             else:
-                logger.info(f"Making the post call on {LEADER_URL}")
-                response = requests.post(f"{LEADER_URL}/orders", json=order_data, timeout=5)
-            return response.json(), response.status_code
+                hot_logger.info("Making the post call on %s", LEADER_URL)
+                response = tracedRequest("post", f"{LEADER_URL}/orders", json=order_data, timeout=5)
+            return jsonDecode(response.content), response.status_code
         except requests.RequestException as e:
             logger.info(f"Re-Selecting the Leader as, Leader at {LEADER_URL} is unresponsive - {e}. Attempt Number: {attempt+1}")
             findLeader()
     logger.error(f"Leader unreachable after {max_retries} retries. Order could not be processed.")
     return {"error": {"code": 503, "message": "Leader unavailable after retries"}}, 503
 
+def queryReplica(order_number): # Returns None when the query has to go to the leader
+    replica = order_replicas.choose(ORDER_READ_POLICY) if ORDER_READ_POLICY != "leader" else None
+    if replica is None or replica == LEADER_URL:
+        return None
+    try:
+        with order_replicas.track(replica):
+            response = tracedRequest("get", f"{replica}/orders/{order_number}", timeout=5)
+    except requests.RequestException as e:
+        logger.info(f"Order Service Replica at {replica} is unresponsive, querying the leader. Error: {e}")
+        order_replicas.markUnhealthy(replica)
+        return None
+    if response.status_code != 200:
+        hot_logger.info("Order %s not yet replicated to %s, querying the leader.", order_number, replica)
+        return None
+    return jsonDecode(response.content), response.status_code
+
 def queryOrderHandler(order_number, max_retries=3): # Helper function to Query the successful orders
     global LEADER_URL
     if not LEADER_URL:
         findLeader()
+    replicaResponse = queryReplica(order_number) # Followers serve orders they already have, the leader is the fallback
+    if replicaResponse is not None:
+        return replicaResponse
     for attempt in range(max_retries):
         try:
-            response = requests.get(f"{LEADER_URL}/ping", timeout=5)
+            response = pingReplica(LEADER_URL)
             if response.status_code != 200:
                 raise requests.RequestException("Leader unresponsive")
-            response = requests.get(f"{LEADER_URL}/orders/{order_number}", timeout=5)
-            return response.json(), response.status_code
+            response = tracedRequest("get", f"{LEADER_URL}/orders/{order_number}", timeout=5)
+            return jsonDecode(response.content), response.status_code
         except requests.RequestException as e:
             logger.info(f"Leader {LEADER_URL} is unresponsive. Re-selecting leader... Attempt {attempt+1}")
             findLeader()
@@ -136,44 +814,206 @@ def queryOrderHandler(order_number, max_retries=3): # Helper function to Query t
 @app.route('/stocks/<stock_name>', methods=['GET'])
 def lookup(stock_name):
     if CACHE_ENABLED == 1:
-        logger.info("Cache enabled lookup")
-        cached_data = cache.get(stock_name)
+        cached_data, stale = cache.getWithStaleness(stock_name, CACHE_STALE_SECONDS)
+        if stale:
+            scheduleRefresh(stock_name, 0)
     else:
-        logger.info("No Cache enabled lookup")
         cached_data = None
     if cached_data:
-        logger.info(f"Cache hit: {stock_name}")
-        return {
-            "message": "Lookup successful",
-            "data": cached_data
-        }, 200
+        return app.response_class(lookupBody(stock_name, cached_data), mimetype="application/json"), 200
+    not_found = negative_cache.get(stock_name) if NEGATIVE_CACHE_ENABLED == 1 else None
+    if not_found is not None:
+        return not_found, 404
 
     try:
-        response = requests.get(f"{CATALOG_SERVICE_URL}/stocks/{stock_name}")
-        if response.status_code == 200:
-            data = response.json()
-            if CACHE_ENABLED == 1:
-                cache.put(stock_name, data)
-                logger.info(f"Cache miss: {stock_name}. Adding to cache.")
-            return {
-                "message": "Lookup successful",
-                "data": data
-            }, 200
+        if SINGLE_FLIGHT_ENABLED == 1:
+            data, status_code = lookup_flights.do(stock_name, lambda: fetchStock(stock_name), lambda result: cacheStock(stock_name, result))
+        else:
+            data, status_code = fetchStock(stock_name)
+            cacheStock(stock_name, (data, status_code))
+        if status_code == 200:
+            return app.response_class(lookupBody(stock_name, data), mimetype="application/json"), 200
         else:
-            return response.json(), response.status_code
+            return data, status_code
     except requests.RequestException as e:
         return {"error": str(e)}, 500
 
+def fetchStock(stock_name):
+    response = tracedRequest("get", f"{catalogUrl(stock_name)}/stocks/{stock_name}")
+    return jsonDecode(response.content), response.status_code
+
+def lookupBody(stock_name, data): # Encoded once per cached stock, until the Catalog invalidates it
+    encode = lambda data: jsonEncode({"message": "Lookup successful", "data": data})
+    return cache.encoded(stock_name, data, encode) if CACHE_ENABLED == 1 else encode(data)
+
+def cacheStock(stock_name, result):
+    data, status_code = result
+    if CACHE_ENABLED == 1 and status_code == 200:
+        cache.put(stock_name, data)
+        hot_logger.info("Cache miss: %s. Adding to cache.", stock_name)
+    elif NEGATIVE_CACHE_ENABLED == 1 and status_code == 404:
+        negative_cache.put(stock_name, data)
+        hot_logger.info("Stock not found: %s. Adding to negative cache.", stock_name)
+
+def claimRefresh(stock_name): # At most one background refresh per stock is scheduled at a time
+    with refresh_lock:
+        if stock_name in pending_refreshes:
+            return False
+        pending_refreshes.add(stock_name)
+        return True
+
+def refreshStock(stock_name):
+    try:
+        lookup_flights.do(stock_name, lambda: fetchStock(stock_name), lambda result: cacheStock(stock_name, result))
+        hot_logger.info("Refreshed %s in the background.", stock_name)
+    except requests.RequestException as e:
+        logger.warning(f"Background refresh of {stock_name} failed: {e}")
+    finally:
+        with refresh_lock:
+            pending_refreshes.discard(stock_name)
+
+def scheduleRefresh(stock_name, delay):
+    if claimRefresh(stock_name):
+        timer = threading.Timer(delay, withTraceContext(refreshStock), args=(stock_name,))
+        timer.daemon = True
+        timer.start()
+
+def invalidateStock(stock_name, flights): # Returns whether the stock should be refreshed ahead of the next lookup
+    negative_cache.invalidate(stock_name)
+    if CACHE_ENABLED != 1: # Nothing cached, the change is still published to the change feed
+        return False
+    refresh_ahead = stock_name in cache.hottest(REFRESH_AHEAD_KEYS)
+    flights.forget(stock_name) # Forgotten before the cache entry is dropped, so an in-flight fetch cannot re-cache stale data
+    if flights is not lookup_flights:
+        lookup_flights.forget(stock_name) # Cache warm-up always runs on the thread-based flights
+    if CACHE_STALE_SECONDS > 0:
+        cache.markStale(stock_name)
+    else:
+        cache.invalidate(stock_name)
+    return refresh_ahead
+
+# Cache Warm-up - CACHE_WARMUP=snapshot re-fetches the hot keys saved in CACHE_SNAPSHOT_FILE when the previous process exited,
+# CACHE_WARMUP=catalog fills the cache from one bulk 'GET /stocks' (the snapshot keys if present, otherwise the first CACHE_SIZE
+# stocks). Warm-up runs in a background thread while the front-end already serves, and the hot keys are saved again on exit
+CACHE_WARMUP = os.environ.get("CACHE_WARMUP", "none")
+CACHE_SNAPSHOT_FILE = os.environ.get("CACHE_SNAPSHOT_FILE", "cache_snapshot.json")
+
+def loadCacheSnapshot():
+    try:
+        with open(CACHE_SNAPSHOT_FILE, mode="r") as file:
+            return json.load(file).get("hot_keys", [])
+    except (OSError, ValueError) as e:
+        logger.info(f"No cache snapshot loaded from {CACHE_SNAPSHOT_FILE}: {e}")
+        return []
+
+def saveCacheSnapshot():
+    try:
+        temp_file = f"{CACHE_SNAPSHOT_FILE}.tmp"
+        with open(temp_file, mode="w") as file:
+            json.dump({"hot_keys": cache.hottest(CACHE_SIZE)}, file) # Least to most recently used
+        os.replace(temp_file, CACHE_SNAPSHOT_FILE)
+        logger.info(f"Saved cache snapshot to {CACHE_SNAPSHOT_FILE}")
+    except OSError as e:
+        logger.error(f"Error while saving cache snapshot: {e}")
+
+def warmCache():
+    hot_keys = loadCacheSnapshot()
+    warmed = 0
+    try:
+        if CACHE_WARMUP == "catalog":
+            forgets = lookup_flights.forgets
+            stocks = {} # Every partition lists only the stocks it owns
+            for catalog_url in CATALOG_SERVICE_URLS:
+                response = tracedRequest("get", f"{catalog_url}/stocks")
+                stocks.update((stock["name"], stock) for stock in jsonDecode(response.content).get("stocks", []))
+            for stock_name in [name for name in hot_keys if name in stocks] or list(stocks)[:CACHE_SIZE]:
+                if lookup_flights.storeUnlessForgotten(forgets, functools.partial(cache.put, stock_name, stocks[stock_name])):
+                    warmed += 1
+        else:
+            for stock_name in hot_keys:
+                data, status_code = lookup_flights.do(stock_name, lambda: fetchStock(stock_name), lambda result: cacheStock(stock_name, result))
+                if status_code == 200:
+                    warmed += 1
+    except (requests.RequestException, ValueError) as e:
+        logger.warning(f"Cache warm-up stopped early: {e}")
+    logger.info(f"Cache warm-up ({CACHE_WARMUP}) loaded {warmed} stocks.")
+
+def startCacheWarmup(): # Called in the process that serves requests, the gunicorn worker or the single dev/async process
+    if CACHE_ENABLED != 1 or CACHE_WARMUP == "none":
+        return
+    atexit.register(saveCacheSnapshot)
+    Thread(target=warmCache, daemon=True).start()
+
+def publishChange(stock_name, stock): # 'stock' is the updated name, price and quantity sent by the Catalog, if any
+    if CHANGE_FEED_ENABLED == 1 and isinstance(stock, dict) and "price" in stock and "quantity" in stock:
+        change_feed.publish(stock_name, {"name": stock_name, "price": stock["price"], "quantity": stock["quantity"]})
+
+def subscribedSymbols(args):
+    symbols = {symbol for symbol in args.get("symbols", "").split(",") if symbol}
+    return symbols or None
+
+def changeEvents(updates):
+    return "".join(f"event: quote\ndata: {jsonEncode(update).decode()}\n\n" for update in updates)
+
 @app.route('/invalidate/<stock_name>', methods=['POST'])
 def invalidate(stock_name):
-    cache.invalidate(stock_name)
-    logger.info(f"Cache invalidated: {stock_name}")
+    if invalidateStock(stock_name, lookup_flights):
+        scheduleRefresh(stock_name, REFRESH_AHEAD_DELAY)
+    publishChange(stock_name, request.get_json(silent=True))
+    hot_logger.info("Cache invalidated: %s", stock_name)
     return {"message": f"Cache invalidated: {stock_name}"}, 200
 
-@app.route('/orders', methods=['POST'])
-def order():
-    order_data = request.get_json()
-    response, status_code = orderHandler(order_data)
+@app.route('/stream/stocks', methods=['GET'])
+def streamStocks(): # Server-sent events for '?symbols=A,B', or for every stock without the parameter
+    if CHANGE_FEED_ENABLED != 1:
+        return {"error": {"code": 404, "message": "Change feed is disabled"}}, 404
+    changed = threading.Event()
+    subscriber = change_feed.subscribe(subscribedSymbols(request.args), changed.set)
+    if subscriber is None:
+        return {"error": {"code": 503, "message": "Too many change feed subscribers"}}, 503
+
+    def events():
+        try:
+            yield ": subscribed\n\n"
+            while not subscriber.overflowed:
+                if not changed.wait(CHANGE_FEED_HEARTBEAT):
+                    yield ": keep-alive\n\n" # Also detects clients that went away
+                    continue
+                changed.clear()
+                updates = subscriber.drain()
+                if updates:
+                    yield changeEvents(updates)
+            logger.warning("Change feed subscriber fell behind and was disconnected.")
+        finally:
+            change_feed.unsubscribe(subscriber)
+    return Response(stream_with_context(events()), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/cache/stats', methods=['GET'])
+def cacheStats():
+    lookups = cache.hits + cache.misses if CACHE_ENABLED == 1 else 0
+    return {
+        "policy": CACHE_POLICY,
+        "hits": cache.hits if CACHE_ENABLED == 1 else 0,
+        "misses": cache.misses if CACHE_ENABLED == 1 else 0,
+        "hit_ratio": cache.hits / lookups if lookups else 0.0,
+        "rejected": cache.rejected if CACHE_ENABLED == 1 else 0,
+        "stale_hits": cache.stale_hits if CACHE_ENABLED == 1 else 0,
+        "negative_hits": negative_cache.hits,
+        "negative_entries": len(negative_cache.entries),
+        "coalesced_lookups": lookup_flights.coalesced,
+        "order_hits": order_cache.hits,
+        "order_entries": len(order_cache.entries)
+    }, 200
+
+def committedTransaction(response, status_code): # A 504 with a transaction number is committed on the leader, only short of follower acks
+    if status_code in (200, 504):
+        return (response.get("data") or {}).get("transaction_number")
+    return None
+
+def orderResponse(response, status_code):
+    if status_code == 504 and committedTransaction(response, status_code) is not None:
+        # Not a failed order, a client retry would trade twice
+        return {"data": {"transaction_number": committedTransaction(response, status_code), "durability_pending": True}}, 200
     if status_code == 200:
         data = response.get("data", {})
         transaction_number = data.get("transaction_number")
@@ -184,9 +1024,7 @@ def order():
     else:
         return {"error": {"code": status_code, "message": response.get("error", "An error occurred")}}, status_code
 
-@app.route('/orders/<int:order_number>', methods=['GET'])
-def getOrder(order_number):
-    response, status_code = queryOrderHandler(order_number)
+def orderQueryResponse(response, status_code):
     if status_code == 200:
         data = response.get("data", {})
         return {
@@ -200,6 +1038,279 @@ def getOrder(order_number):
     else:
         return {"error": {"code": status_code, "message": response.get("error", "An error occurred")}}, status_code
 
+def rememberOrder(order_data, response, status_code): # Caches a placed order under the transaction number the leader assigned
+    transaction_number = committedTransaction(response, status_code)
+    if ORDER_CACHE_ENABLED == 1 and transaction_number is not None:
+        order_cache.put(transaction_number, {
+            "transaction_number": transaction_number,
+            "stock_name": order_data.get("stock_name"),
+            "type": order_data.get("type"),
+            "quantity": order_data.get("quantity")
+        })
+    return response, status_code
+
+def rememberQueriedOrder(order_number, response, status_code):
+    if ORDER_CACHE_ENABLED == 1 and status_code == 200 and response.get("data"):
+        order_cache.put(order_number, response["data"])
+    return response, status_code
+
+def cachedOrder(order_number):
+    order_data = order_cache.get(order_number) if ORDER_CACHE_ENABLED == 1 else None
+    return ({"data": order_data}, 200) if order_data else None
+
+@app.route('/orders', methods=['POST'])
+def order():
+    order_data = request.get_json()
+    return orderResponse(*rememberOrder(order_data, *orderHandler(order_data)))
+
+@app.route('/orders/<int:order_number>', methods=['GET'])
+def getOrder(order_number):
+    return orderQueryResponse(*(cachedOrder(order_number) or rememberQueriedOrder(order_number, *queryOrderHandler(order_number))))
+
+# Async Front-end - FRONTEND_MODE=async serves the same routes on an aiohttp event loop with one pooled ClientSession towards
+# the Catalog and Order services, so concurrent connections are no longer bounded by a thread per request. LRUCache is safe to
+# share with the event loop as none of its critical sections await. Leader re-election is rare and reuses findLeader in a thread
+# Reference: https://docs.aiohttp.org/en/stable/web_quickstart.html
+FRONTEND_MODE = os.environ.get("FRONTEND_MODE", "sync")
+ASYNC_CONNECTION_LIMIT = int(os.environ.get("ASYNC_CONNECTION_LIMIT", "1000"))
+session_key = web.AppKey("session", aiohttp.ClientSession)
+election_lock_key = web.AppKey("election_lock", asyncio.Lock)
+lookup_flights_key = web.AppKey("lookup_flights", AsyncSingleFlight)
+refresh_tasks_key = web.AppKey("refresh_tasks", set)
+
+def asyncJsonResponse(payload, status=200):
+    return web.Response(body=jsonEncode(payload), status=status, content_type="application/json")
+
+async def asyncTracedRequest(session, method, url, timeout=None, **kwargs):
+    with traceSpan(f"HTTP {method.upper()}", url=url) as span:
+        kwargs["headers"] = {**kwargs.get("headers", {}), **traceHeaders()}
+        async with session.request(method.upper(), url, timeout=aiohttp.ClientTimeout(total=timeout), **kwargs) as response:
+            if span:
+                span["attributes"]["status_code"] = response.status
+            return await response.json(content_type=None, loads=jsonDecode), response.status
+
+async def asyncFindLeader(asyncApp, failedLeader):
+    async with asyncApp[election_lock_key]:
+        if LEADER_URL == failedLeader: # Otherwise a concurrent request has already re-elected the leader
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, functools.partial(contextvars.copy_context().run, findLeader))
+
+async def asyncLeaderRequest(asyncApp, method, path, max_retries=3, **kwargs):
+    if not LEADER_URL:
+        await asyncFindLeader(asyncApp, None)
+    for attempt in range(max_retries):
+        leader = LEADER_URL
+        try:
+            start = time.monotonic()
+            _, status_code = await asyncTracedRequest(asyncApp[session_key], "get", f"{leader}/ping", timeout=probeTimeout())
+            if status_code != 200:
+                raise aiohttp.ClientError("Leader unresponsive")
+            recordProbeRtt(time.monotonic() - start)
+            hot_logger.info("Sending %s %s to leader %s", method.upper(), path, leader)
+            return await asyncTracedRequest(asyncApp[session_key], method, f"{leader}{path}", timeout=5, **kwargs)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.info(f"Re-Selecting the Leader as, Leader at {leader} is unresponsive - {e}. Attempt Number: {attempt+1}")
+            await asyncFindLeader(asyncApp, leader)
+    logger.error(f"Leader unreachable after {max_retries} retries. Request {method.upper()} {path} could not be processed.")
+    return {"error": {"code": 503, "message": f"Leader unavailable after {max_retries} retries"}}, 503
+
+@web.middleware
+async def asyncTraceMiddleware(request, handler):
+    if TRACING_ENABLED != 1:
+        return await handler(request)
+    continueTrace(request.headers.get("traceparent", ""))
+    span = startSpan(f"{request.method} {request.match_info.route.resource.canonical if request.match_info.route.resource else request.path}")
+    try:
+        response = await handler(request)
+        span["attributes"]["status_code"] = response.status
+        return response
+    finally:
+        endSpan(span)
+
+async def asyncLookup(request):
+    stock_name = request.match_info["stock_name"]
+    cached_data, stale = cache.getWithStaleness(stock_name, CACHE_STALE_SECONDS) if CACHE_ENABLED == 1 else (None, False)
+    if stale:
+        asyncScheduleRefresh(request.app, stock_name, 0)
+    if cached_data:
+        return web.Response(body=lookupBody(stock_name, cached_data), content_type="application/json")
+    not_found = negative_cache.get(stock_name) if NEGATIVE_CACHE_ENABLED == 1 else None
+    if not_found is not None:
+        return asyncJsonResponse(not_found, status=404)
+    fetch = lambda: asyncFetchStock(request.app, stock_name)
+    try:
+        if SINGLE_FLIGHT_ENABLED == 1:
+            data, status_code = await request.app[lookup_flights_key].do(stock_name, fetch, lambda result: cacheStock(stock_name, result))
+        else:
+            data, status_code = await fetch()
+            cacheStock(stock_name, (data, status_code))
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return asyncJsonResponse({"error": str(e)}, status=500)
+    if status_code != 200:
+        return asyncJsonResponse(data, status=status_code)
+    return web.Response(body=lookupBody(stock_name, data), content_type="application/json")
+
+async def asyncFetchStock(asyncApp, stock_name):
+    return await asyncTracedRequest(asyncApp[session_key], "get", f"{catalogUrl(stock_name)}/stocks/{stock_name}")
+
+async def asyncRefreshStock(asyncApp, stock_name, delay):
+    try:
+        await asyncio.sleep(delay)
+        await asyncApp[lookup_flights_key].do(stock_name, lambda: asyncFetchStock(asyncApp, stock_name), lambda result: cacheStock(stock_name, result))
+        hot_logger.info("Refreshed %s in the background.", stock_name)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning(f"Background refresh of {stock_name} failed: {e}")
+    finally:
+        with refresh_lock:
+            pending_refreshes.discard(stock_name)
+
+def asyncScheduleRefresh(asyncApp, stock_name, delay):
+    if claimRefresh(stock_name):
+        task = asyncio.get_running_loop().create_task(asyncRefreshStock(asyncApp, stock_name, delay))
+        asyncApp[refresh_tasks_key].add(task) # The loop only keeps weak references to tasks
+        task.add_done_callback(asyncApp[refresh_tasks_key].discard)
+
+async def asyncInvalidate(request):
+    stock_name = request.match_info["stock_name"]
+    if invalidateStock(stock_name, request.app[lookup_flights_key]):
+        asyncScheduleRefresh(request.app, stock_name, REFRESH_AHEAD_DELAY)
+    try:
+        stock = await request.json() if request.can_read_body else None
+    except ValueError:
+        stock = None
+    publishChange(stock_name, stock)
+    hot_logger.info("Cache invalidated: %s", stock_name)
+    return asyncJsonResponse({"message": f"Cache invalidated: {stock_name}"})
+
+async def asyncStreamStocks(request):
+    if CHANGE_FEED_ENABLED != 1:
+        return asyncJsonResponse({"error": {"code": 404, "message": "Change feed is disabled"}}, status=404)
+    changed = asyncio.Event() # Updates are published on the event loop thread, by asyncInvalidate
+    subscriber = change_feed.subscribe(subscribedSymbols(request.query), changed.set)
+    if subscriber is None:
+        return asyncJsonResponse({"error": {"code": 503, "message": "Too many change feed subscribers"}}, status=503)
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    try:
+        await response.prepare(request)
+        await response.write(b": subscribed\n\n")
+        while not subscriber.overflowed:
+            try:
+                await asyncio.wait_for(changed.wait(), CHANGE_FEED_HEARTBEAT)
+            except asyncio.TimeoutError:
+                await response.write(b": keep-alive\n\n")
+                continue
+            changed.clear()
+            updates = subscriber.drain()
+            if updates:
+                await response.write(changeEvents(updates).encode()) # Waits while the client's socket buffer is full
+        logger.warning("Change feed subscriber fell behind and was disconnected.")
+    except ConnectionResetError:
+        pass
+    finally:
+        change_feed.unsubscribe(subscriber)
+    return response
+
+async def asyncCacheStats(request):
+    stats, _ = cacheStats()
+    stats["coalesced_lookups"] = request.app[lookup_flights_key].coalesced
+    return asyncJsonResponse(stats)
+
+async def asyncOrder(request):
+    order_data = await request.json()
+    body, status_code = orderResponse(*rememberOrder(order_data, *await asyncLeaderRequest(request.app, "post", "/orders", json=order_data)))
+    return asyncJsonResponse(body, status=status_code)
+
+async def asyncQueryReplica(asyncApp, order_number):
+    if ORDER_READ_POLICY == "leader":
+        return None
+    if not LEADER_URL:
+        await asyncFindLeader(asyncApp, None)
+    replica = order_replicas.choose(ORDER_READ_POLICY)
+    if replica is None or replica == LEADER_URL:
+        return None
+    try:
+        with order_replicas.track(replica):
+            body, status_code = await asyncTracedRequest(asyncApp[session_key], "get", f"{replica}/orders/{order_number}", timeout=5)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.info(f"Order Service Replica at {replica} is unresponsive, querying the leader. Error: {e}")
+        order_replicas.markUnhealthy(replica)
+        return None
+    if status_code != 200:
+        hot_logger.info("Order %s not yet replicated to %s, querying the leader.", order_number, replica)
+        return None
+    return body, status_code
+
+async def asyncGetOrder(request):
+    order_number = int(request.match_info["order_number"])
+    response = cachedOrder(order_number)
+    if response is None:
+        response = await asyncQueryReplica(request.app, order_number) or await asyncLeaderRequest(request.app, "get", f"/orders/{order_number}")
+        response = rememberQueriedOrder(order_number, *response)
+    body, status_code = orderQueryResponse(*response)
+    return asyncJsonResponse(body, status=status_code)
+
+async def startAsyncClient(asyncApp):
+    asyncApp[session_key] = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=ASYNC_CONNECTION_LIMIT))
+    asyncApp[election_lock_key] = asyncio.Lock()
+    asyncApp[lookup_flights_key] = AsyncSingleFlight()
+    asyncApp[refresh_tasks_key] = set()
+
+async def closeAsyncClient(asyncApp):
+    for task in list(asyncApp[refresh_tasks_key]):
+        task.cancel()
+    await asyncApp[session_key].close()
+
+def createAsyncApp():
+    asyncApp = web.Application(middlewares=[asyncTraceMiddleware])
+    asyncApp.add_routes([
+        web.get("/stocks/{stock_name}", asyncLookup),
+        web.post("/invalidate/{stock_name}", asyncInvalidate),
+        web.get("/stream/stocks", asyncStreamStocks),
+        web.get("/cache/stats", asyncCacheStats),
+        web.post("/orders", asyncOrder),
+        web.get(r"/orders/{order_number:\d+}", asyncGetOrder)
+    ])
+    asyncApp.on_startup.append(startAsyncClient)
+    asyncApp.on_cleanup.append(closeAsyncClient)
+    return asyncApp
+
+# Production Serving - SERVER_MODE=gunicorn serves the app with gunicorn gthread workers instead of the Werkzeug development server.
+# Service state is initialized in the master before the fork, and the background threads are started again inside every worker
+# Reference: https://docs.gunicorn.org/en/stable/custom.html
+SERVER_MODE = os.environ.get("SERVER_MODE", "dev")
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "1"))
+WEB_THREADS = int(os.environ.get("WEB_THREADS", "32"))
+GRACEFUL_TIMEOUT = int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+
+def restartAfterFork(server, worker): # Threads do not survive fork, so the log listener and span exporter are restarted
+    setupLogging()
+    if TRACING_ENABLED == 1:
+        Thread(target=exportSpans, daemon=True).start()
+    startCacheWarmup()
+
+def runServer(host, port, maxWorkers):
+    if SERVER_MODE != "gunicorn":
+        app.run(host=host, port=port, threaded=True)
+        return
+    from gunicorn.app.base import BaseApplication
+
+    class ProductionServer(BaseApplication):
+        def load_config(self):
+            workers = min(WEB_WORKERS, maxWorkers)
+            if workers < WEB_WORKERS:
+                logger.warning(f"WEB_WORKERS={WEB_WORKERS} capped to {workers} as the service state is held in process memory.")
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", WEB_THREADS)
+            self.cfg.set("graceful_timeout", GRACEFUL_TIMEOUT) # In-flight requests finish on SIGTERM before workers exit
+            self.cfg.set("post_fork", restartAfterFork)
+
+        def load(self):
+            return app
+
+    ProductionServer().run()
+
 # Reference: https://stackoverflow.com/questions/38876721/handle-flask-requests-concurrently-with-threaded-true
 if __name__ == "__main__":
     try:
@@ -208,8 +1319,14 @@ if __name__ == "__main__":
         logger.error(f"Error during leader selection: {e}")
         exit(1)
 
+    if FRONTEND_MODE == "async" or SERVER_MODE != "gunicorn":
+        startCacheWarmup()
+
     try:
-        app.run(host=FRONTEND_HOST, port=FRONT_END_PORT, threaded=True)
+        if FRONTEND_MODE == "async":
+            web.run_app(createAsyncApp(), host=FRONTEND_HOST, port=FRONT_END_PORT, shutdown_timeout=GRACEFUL_TIMEOUT, access_log=None)
+        else:
+            runServer(FRONTEND_HOST, FRONT_END_PORT, WEB_WORKERS if CACHE_ENABLED != 1 and CHANGE_FEED_ENABLED != 1 else 1)
     except Exception as e:
         logger.error(f"Error while starting the Flask server: {e}")
         exit(1)
\ No newline at end of file
@@ -1,14 +1,117 @@
 # Importing the Required Libraries
-from flask import Flask, request, jsonify
-import requests, csv, os, threading, logging
+from flask import Flask, request, jsonify, g
+from flask.json.provider import JSONProvider
+import requests, csv, os, threading, logging, queue, json, time, random, atexit, hashlib, gzip, zlib
+from logging.handlers import QueueHandler, QueueListener
 from threading import Thread
+from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+try:
+    import orjson
+except ImportError: # Optional, the services fall back to the standard library codec
+    orjson = None
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+# Logging - Request threads only enqueue log records, a QueueListener thread formats them (JSON by default) and writes to stderr.
+# Per-module levels come from LOG_LEVELS (e.g. "werkzeug=WARNING,__main__.hot=DEBUG") and hot-path logs are sampled at LOG_SAMPLE_RATE
+# Reference: https://docs.python.org/3/howto/logging-cookbook.html#dealing-with-handlers-that-block
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "werkzeug=WARNING")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+class SampleFilter(logging.Filter): # Keeps a fraction of the records below WARNING, warnings and errors always pass
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+def setupLogging():
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(logQueue)]
+    root.setLevel(LOG_LEVEL)
+    for entry in filter(None, LOG_LEVELS.split(",")):
+        name, _, level = entry.partition("=")
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+    listener = QueueListener(logQueue, handler)
+    listener.start()
+    atexit.register(listener.stop) # Flushes the queued records on shutdown
+    return listener
+
+setupLogging()
 logger = logging.getLogger(__name__)
+hot_logger = logging.getLogger(f"{__name__}.hot") # Per-request logs on the lookup/replication hot paths
+hot_logger.addFilter(SampleFilter(LOG_SAMPLE_RATE))
 
 # Reference: https://flask.palletsprojects.com/en/stable/quickstart/
 app = Flask(__name__)
 
+# JSON Codec - Response bodies and inter-service payloads are encoded with orjson when it is installed (JSON_CODEC=json forces
+# the standard library). Flask's jsonify, dict responses and request.get_json all go through the same codec
+# Reference: https://github.com/ijl/orjson
+JSON_CODEC = os.environ.get("JSON_CODEC", "orjson") if orjson is not None else "json"
+
+def jsonEncode(payload, sort_keys=False, indent=None): # Compact UTF-8 bytes unless indented, orjson only indents by 2
+    if JSON_CODEC == "orjson" and indent in (None, 2):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        option |= (orjson.OPT_SORT_KEYS if sort_keys else 0) | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(payload, option=option)
+    return json.dumps(payload, sort_keys=sort_keys, indent=indent, separators=None if indent is not None else (",", ":")).encode()
+
+def jsonDecode(body): # Accepts bytes or str, raises ValueError on malformed input
+    return orjson.loads(body) if JSON_CODEC == "orjson" else json.loads(body)
+
+class CodecJSONProvider(JSONProvider):
+    sort_keys = False # Unlike Flask's default provider, responses keep the key order instead of paying for a sort
+    compact = None # As in Flask's default provider, None indents responses in debug mode only
+    mimetype = "application/json"
+
+    def dumps(self, obj, sort_keys=False, indent=None, **kwargs): # Other json.dumps options have no orjson equivalent
+        if kwargs:
+            raise TypeError(f"Unsupported JSON encoding options: {', '.join(sorted(kwargs))}")
+        return jsonEncode(obj, sort_keys, indent).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            raise TypeError(f"Unsupported JSON decoding options: {', '.join(sorted(kwargs))}")
+        return jsonDecode(s)
+
+    def response(self, *args, **kwargs): # Same arguments as Flask's jsonify, the encoded bytes are sent without a round trip through str
+        if args and kwargs:
+            raise TypeError("app.json.response() takes either args or kwargs, not both")
+        if not args and not kwargs:
+            obj = None
+        elif len(args) == 1:
+            obj = args[0]
+        else:
+            obj = list(args) or kwargs
+        indent = 2 if self.compact is False or (self.compact is None and self._app.debug) else None
+        return self._app.response_class(jsonEncode(obj, self.sort_keys, indent), mimetype=self.mimetype)
+
+app.json = CodecJSONProvider(app)
+
 # Global Environment variables from Docker Compose file
 REPLICA_ID = int(os.environ.get("REPLICA_ID", 1))
 ORDER_PORT = int(os.environ.get("ORDER_PORT", 8997 + REPLICA_ID))
@@ -16,6 +119,16 @@ ORDER_HOST = os.environ.get("ORDER_HOST", "0.0.0.0")
 CATALOG_SERVICE_URL = os.environ.get("CATALOG_SERVICE_URL", "http://catalog-service:8997")
 TOTAL_REPLICAS = int(os.environ.get("TOTAL_REPLICAS", 3))
 
+# Catalog Partitioning - CATALOG_SERVICE_URLS lists one catalog instance per partition, in partition order. A stock is owned
+# by partition CRC-32(name) % N, the same hash the Catalog instances use, and CATALOG_SERVICE_URL is the single partition
+CATALOG_SERVICE_URLS = os.environ.get("CATALOG_SERVICE_URLS", CATALOG_SERVICE_URL).split(",")
+
+def catalogPartition(stockName, partitions): # Must match the Catalog service
+    return zlib.crc32(stockName.encode()) % partitions
+
+def catalogUrl(stockName):
+    return CATALOG_SERVICE_URLS[catalogPartition(stockName, len(CATALOG_SERVICE_URLS))]
+
 # Global Environment variables for the Order Service
 transactionNumber = 0
 ordersList = []
@@ -24,10 +137,277 @@ transaction_lock = threading.Lock()
 orders_list_lock = threading.Lock()
 order_log_lock = threading.Lock()
 leader_recovery_lock = threading.Lock()
+leader_tasks = [] # Lease renewal and catch-up threads started by '/set_leader', they outlive the request
 ORDER_LOG_FILE = f"order_log_{REPLICA_ID}.csv"
+ORDER_FIELDS = ["transaction_number", "stock_name", "type", "quantity"]
+ORDER_LOG_FIELDS = ORDER_FIELDS + ["timestamp"] # When the leader placed the order, empty for orders logged before it was recorded
 SELF_URL = f"http://order-service-{REPLICA_ID}:{ORDER_PORT}"
 LEADER_ID = None
 
+# Write Concern - The leader sends every order to all followers concurrently and answers the client once WRITE_CONCERN is met:
+# 'leader' (no follower ack, the previous behaviour), 'majority' (with the leader, a majority of all replicas) or 'all'.
+# Replication to the remaining followers continues in the background. Per-follower acks are tracked to report replication lag.
+# Every follower has its own REPLICATION_THREADS senders, so a follower that hangs cannot hold up the acks of the others. At most
+# REPLICATION_BACKLOG orders wait for one follower; later orders are not sent to it, and anti-entropy repairs it once it is back
+WRITE_CONCERN = os.environ.get("WRITE_CONCERN", "leader")
+REPLICATION_TIMEOUT = float(os.environ.get("REPLICATION_TIMEOUT", "2"))
+REPLICATION_THREADS = int(os.environ.get("REPLICATION_THREADS", "4"))
+REPLICATION_BACKLOG = int(os.environ.get("REPLICATION_BACKLOG", "1000"))
+replication_pool = ThreadPoolExecutor(max_workers=4 * max(1, TOTAL_REPLICAS - 1)) # Lease and recovery queries, threads start after any fork
+follower_status = {} # follower url -> last acknowledged transaction and replication latency
+follower_status_lock = threading.Lock()
+
+# Order Log Segments - Orders are appended to the active segment ORDER_LOG_FILE. Once it holds ORDER_LOG_SEGMENT_ROWS orders
+# (0 disables rotation) it is renamed to 'order_log_<id>.<seq>.pending.csv' and a new active segment is started, both under the
+# log lock. A background thread then seals the pending segment: compacted (sorted, duplicates dropped), written read-only as
+# 'order_log_<id>.<seq>.csv', gzip-compressed with ORDER_LOG_COMPRESS=1, and recorded in the manifest with its min/max transaction
+# number. Lookups only open the segments whose range covers the order, and backups only need to copy the segments sealed since the last run
+ORDER_LOG_SEGMENT_ROWS = int(os.environ.get("ORDER_LOG_SEGMENT_ROWS", "100000"))
+ORDER_LOG_COMPRESS = int(os.environ.get("ORDER_LOG_COMPRESS", "0"))
+ORDER_LOG_MANIFEST = f"order_log_{REPLICA_ID}.manifest.json"
+log_segments = [] # Sealed segments: file, min/max transaction number and row count, guarded by order_log_lock
+active_segment_rows = 0
+pending_segments = [] # Rotated segments waiting for the seal thread, guarded by order_log_lock
+seal_pool = None # Created per process by sealPool, seals run in rotation order on its single thread
+seal_pool_pid = None
+seal_pool_lock = threading.Lock()
+
+# Order Analytics - A columnar copy of the order store in NumPy arrays, appended to whenever an order is loaded into memory.
+# '/analytics/orders' aggregates per-symbol buy/sell volume, net position and order counts over a transaction range or time window
+# Reference: https://numpy.org/doc/stable/reference/generated/numpy.bincount.html
+class OrderAnalytics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.allocate(1024)
+
+    def allocate(self, capacity):
+        self.size = 0
+        self.transactions = np.empty(capacity, dtype=np.int64)
+        self.symbols = np.empty(capacity, dtype=np.int32)
+        self.quantities = np.empty(capacity, dtype=np.int64)
+        self.sides = np.empty(capacity, dtype=np.int8) # 1 for buy, -1 for sell
+        self.timestamps = np.empty(capacity, dtype=np.float64) # NaN when the order has no timestamp
+        self.symbol_index = {}
+        self.symbol_names = []
+
+    def grow(self): # Doubling keeps appends amortized O(1)
+        for column in ("transactions", "symbols", "quantities", "sides", "timestamps"):
+            values = getattr(self, column)
+            setattr(self, column, np.concatenate([values, np.empty_like(values)]))
+
+    def store(self, order): # Called with the lock held
+        if self.size == len(self.transactions):
+            self.grow()
+        name = order["stock_name"]
+        if name not in self.symbol_index:
+            self.symbol_index[name] = len(self.symbol_names)
+            self.symbol_names.append(name)
+        timestamp = order.get("timestamp")
+        self.transactions[self.size] = order["transaction_number"]
+        self.symbols[self.size] = self.symbol_index[name]
+        self.quantities[self.size] = int(order["quantity"])
+        self.sides[self.size] = 1 if order["type"] == "buy" else -1
+        self.timestamps[self.size] = np.nan if timestamp is None else timestamp
+        self.size += 1
+
+    def append(self, order):
+        with self.lock:
+            self.store(order)
+
+    def rebuild(self, orders):
+        with self.lock:
+            self.allocate(max(1024, 2 * len(orders)))
+            for order in orders:
+                self.store(order)
+
+    def summarize(self, start=None, end=None, since=None, until=None, symbol=None):
+        with self.lock:
+            count = self.size
+            mask = np.ones(count, dtype=bool)
+            if start is not None:
+                mask &= self.transactions[:count] >= start
+            if end is not None:
+                mask &= self.transactions[:count] <= end
+            if since is not None: # Comparisons with NaN are false, so orders without a timestamp drop out of time windows
+                mask &= self.timestamps[:count] >= since
+            if until is not None:
+                mask &= self.timestamps[:count] <= until
+            if symbol is not None:
+                mask &= self.symbols[:count] == self.symbol_index.get(symbol, -1)
+            symbols = self.symbols[:count][mask]
+            quantities = self.quantities[:count][mask]
+            sides = self.sides[:count][mask]
+            names = list(self.symbol_names)
+        orders = np.bincount(symbols, minlength=len(names))
+        bought = np.bincount(symbols, weights=quantities * (sides > 0), minlength=len(names))
+        sold = np.bincount(symbols, weights=quantities * (sides < 0), minlength=len(names))
+        return {
+            "orders": int(mask.sum()),
+            "symbols": {
+                names[i]: {
+                    "orders": int(orders[i]),
+                    "buy_volume": int(bought[i]),
+                    "sell_volume": int(sold[i]),
+                    "net_position": int(bought[i] - sold[i])
+                } for i in np.flatnonzero(orders)
+            }
+        }
+
+order_analytics = OrderAnalytics()
+
+# Incremental Leader Recovery - Every replica tracks the highest transaction each peer is known to hold, from replication acks,
+# replicated orders and '/max_transaction' answers. A new leader positions its transaction counter past every mark and accepts
+# orders right away, then fetches only the transactions it is missing from the peers furthest ahead in the background
+peer_high_water = {} # peer url -> highest transaction the peer is known to hold
+peer_high_water_lock = threading.Lock()
+
+# Anti-Entropy - Every ANTI_ENTROPY_INTERVAL seconds (0 disables) a replica compares range digests with a random peer. Both split a
+# transaction range into ANTI_ENTROPY_FANOUT buckets, hashed as the XOR of their orders' SHA-256 digests, and only differing buckets
+# are split again, until a range of ANTI_ENTROPY_LEAF_SIZE transactions is small enough to fetch. Gaps below the max get repaired
+# Reference: https://www.cs.cornell.edu/projects/ladis2009/papers/lakshman-ladis2009.pdf
+ANTI_ENTROPY_INTERVAL = float(os.environ.get("ANTI_ENTROPY_INTERVAL", "30"))
+ANTI_ENTROPY_FANOUT = int(os.environ.get("ANTI_ENTROPY_FANOUT", "16"))
+ANTI_ENTROPY_LEAF_SIZE = int(os.environ.get("ANTI_ENTROPY_LEAF_SIZE", "64"))
+
+# Bulk Sync Encoding - A requester sending 'Accept: SYNC_MEDIA_TYPE' gets '/get_missing_orders' as one array per field instead of
+# one object per order, and bodies of at least SYNC_COMPRESS_MIN_BYTES are gzip-compressed when 'Accept-Encoding' allows it.
+# Start-up sync splits the missing range between the peers that hold it and fetches the parts in parallel
+# Reference: https://developer.mozilla.org/en-US/docs/Web/HTTP/Content_negotiation
+SYNC_MEDIA_TYPE = "application/vnd.stocknet.orders.columnar+json"
+SYNC_ENCODING = os.environ.get("SYNC_ENCODING", "columnar") # Format this replica asks for: 'columnar' or 'json'
+SYNC_COMPRESS_MIN_BYTES = int(os.environ.get("SYNC_COMPRESS_MIN_BYTES", "1024"))
+SYNC_COMPRESS_LEVEL = int(os.environ.get("SYNC_COMPRESS_LEVEL", "6"))
+
+# Leader Leases - With LEASE_ENABLED=1 the leader only accepts orders while a majority of replicas (itself included) granted it a
+# lease. A replica grants one lease at a time for LEASE_DURATION seconds, and the leader renews it every LEASE_DURATION/3 seconds.
+# The leader counts its lease from before it asked and gives up LEASE_DRIFT of it, so it stops before any grantor's copy expires.
+# Followers only accept replication from the replica holding their lease, and the leader serves reads locally while it holds one
+# Reference: https://dl.acm.org/doi/10.1145/74851.74870
+LEASE_ENABLED = int(os.environ.get("LEASE_ENABLED", "0"))
+LEASE_DURATION = float(os.environ.get("LEASE_DURATION", "2"))
+LEASE_DRIFT = float(os.environ.get("LEASE_DRIFT", "0.1"))
+granted_lease = {"holder": None, "expiry": 0.0} # The lease this replica granted
+lease_expiry = 0.0 # Until when this replica holds a majority lease as the leader
+lease_term = 0 # Bumped whenever this replica becomes leader, so only the newest renewal thread keeps running
+lease_lock = threading.Lock()
+
+# Distributed Tracing - W3C 'traceparent' header is propagated on every inter-service call, with one span per hop,
+# lock wait and disk write. Spans are exported in the background as JSON lines to TRACE_FILE or to a local collector
+# Reference: https://www.w3.org/TR/trace-context/
+TRACING_ENABLED = int(os.environ.get("TRACING_ENABLED", "0"))
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces_order.jsonl")
+TRACE_COLLECTOR_URL = os.environ.get("TRACE_COLLECTOR_URL", "")
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", f"order-service-{REPLICA_ID}")
+
+trace_context = threading.local()
+trace_queue = queue.Queue()
+
+def startSpan(name, **attributes):
+    parent = getattr(trace_context, "span", None)
+    span = {
+        "trace_id": parent["trace_id"] if parent else os.urandom(16).hex(),
+        "span_id": os.urandom(8).hex(),
+        "parent_span_id": parent["span_id"] if parent else None,
+        "service": TRACE_SERVICE_NAME,
+        "name": name,
+        "start_time_unix_nano": time.time_ns(),
+        "attributes": attributes,
+        "parent": parent
+    }
+    trace_context.span = span
+    return span
+
+def endSpan(span):
+    span["end_time_unix_nano"] = time.time_ns()
+    trace_context.span = span.pop("parent")
+    trace_queue.put(span)
+
+@contextmanager
+def traceSpan(name, **attributes):
+    if TRACING_ENABLED != 1:
+        yield None
+        return
+    span = startSpan(name, **attributes)
+    try:
+        yield span
+    finally:
+        endSpan(span)
+
+@contextmanager
+def tracedLock(lock, name): # Records the time spent waiting for the lock as its own span
+    with traceSpan(f"lock_wait {name}"):
+        lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+def traceHeaders():
+    span = getattr(trace_context, "span", None)
+    if TRACING_ENABLED != 1 or not span:
+        return {}
+    return {"traceparent": f"00-{span['trace_id']}-{span['span_id']}-01"}
+
+def tracedRequest(method, url, **kwargs): # Client span for a single hop, the callee records the matching server span
+    with traceSpan(f"HTTP {method.upper()}", url=url) as span:
+        kwargs["headers"] = {**kwargs.get("headers", {}), **traceHeaders()}
+        response = getattr(requests, method)(url, **kwargs)
+        if span:
+            span["attributes"]["status_code"] = response.status_code
+        return response
+
+def withTraceContext(target): # Carries the current span into a background thread
+    parent = getattr(trace_context, "span", None)
+    def run(*args, **kwargs):
+        previous = getattr(trace_context, "span", None)
+        trace_context.span = parent
+        try:
+            return target(*args, **kwargs)
+        finally:
+            trace_context.span = previous # Pooled threads must not keep the span for the next task
+    return run
+
+def exportSpans():
+    while True:
+        batch = [trace_queue.get()]
+        while not trace_queue.empty() and len(batch) < 100:
+            batch.append(trace_queue.get())
+        try:
+            if TRACE_COLLECTOR_URL:
+                requests.post(f"{TRACE_COLLECTOR_URL}/v1/traces", json={"spans": batch}, timeout=2)
+            else:
+                with open(TRACE_FILE, mode="a") as file:
+                    file.writelines(json.dumps(span) + "\n" for span in batch)
+        except Exception as e:
+            logger.warning(f"Dropped {len(batch)} spans during export: {e}")
+
+@app.before_request
+def startRequestSpan():
+    if TRACING_ENABLED != 1:
+        return
+    trace_context.span = None
+    parts = request.headers.get("traceparent", "").split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        trace_context.span = {"trace_id": parts[1], "span_id": parts[2]} # Remote parent from the calling service
+    g.trace_span = startSpan(f"{request.method} {request.url_rule.rule if request.url_rule else request.path}")
+
+@app.after_request
+def recordResponseStatus(response):
+    span = g.get("trace_span")
+    if span:
+        span["attributes"]["status_code"] = response.status_code
+    return response
+
+@app.teardown_request
+def endRequestSpan(error=None):
+    span = g.pop("trace_span", None)
+    if span:
+        endSpan(span)
+        trace_context.span = None
+
+if TRACING_ENABLED == 1:
+    Thread(target=exportSpans, daemon=True).start()
+
 # Helper Functions to manage the order log and synchronization which is used in the API endpoints to process the order requests from frontend service
 # This includes the order log initialization, loading orders to memory and disk, and appending missing orders from other replicas
 def getAllReplicas():
@@ -35,70 +415,239 @@ def getAllReplicas():
 
 # Reference: https://docs.python.org/3/library/csv.html
 def loadOrderToDisk(orderData):
-    with order_log_lock:
+    global active_segment_rows
+    with tracedLock(order_log_lock, "order_log_lock"), traceSpan("disk_write", file=ORDER_LOG_FILE):
         try:
-            if not all(k in orderData for k in ["transaction_number", "stock_name", "type", "quantity"]):
+            if not all(k in orderData for k in ORDER_FIELDS):
                 logger.error(f"Replica {REPLICA_ID}: Invalid order data provided for disk write: {orderData}")
                 return
             with open(ORDER_LOG_FILE, mode="a", newline="") as file:
-                writer = csv.DictWriter(file, fieldnames=["transaction_number", "stock_name", "type", "quantity"])
+                writer = csv.DictWriter(file, fieldnames=ORDER_LOG_FIELDS)
                 if not os.path.exists(ORDER_LOG_FILE) or os.path.getsize(ORDER_LOG_FILE) == 0:
                     writer.writeheader()
                     logger.info(f"Replica {REPLICA_ID}: Wrote header to new/empty log file {ORDER_LOG_FILE}")
-                writer.writerow({
-                    "transaction_number": orderData["transaction_number"],
-                    "stock_name": orderData["stock_name"],
-                    "type": orderData["type"],
-                    "quantity": orderData["quantity"]
-                })
+                writer.writerow({field: orderData.get(field) for field in ORDER_LOG_FIELDS})
+            active_segment_rows += 1
+            if ORDER_LOG_SEGMENT_ROWS > 0 and active_segment_rows >= ORDER_LOG_SEGMENT_ROWS:
+                sealPool().submit(sealPendingSegment, rotateActiveSegment())
         except IOError as e:
             logger.error(f"Replica {REPLICA_ID}: Failed to persist order {orderData.get('transaction_number')} to log: {e}")
         except Exception as e:
             logger.error(f"Replica {REPLICA_ID}: Unexpected error persisting order {orderData.get('transaction_number')}: {e}")
 
+def parseOrderRow(row): # Returns the order stored in a log row, or None if the row is invalid
+    try:
+        order = {
+            "transaction_number": int(row.get("transaction_number")),
+            "stock_name": row.get("stock_name"),
+            "type": row.get("type"),
+            "quantity": int(row.get("quantity") or 0)
+        }
+    except (ValueError, TypeError):
+        return None
+    if not order["stock_name"] or order["type"] not in ["buy", "sell"] or order["quantity"] <= 0:
+        return None
+    try:
+        if row.get("timestamp"):
+            order["timestamp"] = float(row["timestamp"])
+    except ValueError:
+        pass
+    return order
+
+def openSegment(path, mode="r"):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode=mode + "t", newline="")
+    return open(path, mode=mode, newline="")
+
+def readSegment(path): # Yields the rows of a log segment, sealed or active
+    with openSegment(path) as file:
+        yield from csv.DictReader(file)
+
+def loadManifest():
+    global log_segments
+    try:
+        with open(ORDER_LOG_MANIFEST, mode="r") as file:
+            log_segments = json.load(file).get("segments", [])
+    except FileNotFoundError:
+        log_segments = []
+
+def saveManifest():
+    temporaryFile = f"{ORDER_LOG_MANIFEST}.tmp"
+    with open(temporaryFile, mode="w") as file:
+        json.dump({"segments": log_segments}, file)
+    os.replace(temporaryFile, ORDER_LOG_MANIFEST) # Readers never see a half-written manifest
+
+def sealPool(): # Start-up sync can seal in the gunicorn master, and a pool inherited across fork has no thread in the worker
+    global seal_pool, seal_pool_pid
+    with seal_pool_lock:
+        if seal_pool is None or seal_pool_pid != os.getpid():
+            seal_pool = ThreadPoolExecutor(max_workers=1)
+            seal_pool_pid = os.getpid()
+        return seal_pool
+
+def waitForSeals(): # Returns once every segment rotated so far is sealed
+    sealPool().submit(lambda: None).result()
+
+def rotateActiveSegment(): # Called with order_log_lock held, only renames the file so the write path never waits for a seal
+    global active_segment_rows
+    pendingFile = f"order_log_{REPLICA_ID}.{len(log_segments) + len(pending_segments) + 1:06d}.pending.csv"
+    os.replace(ORDER_LOG_FILE, pendingFile)
+    pending_segments.append(pendingFile)
+    with open(ORDER_LOG_FILE, mode="w", newline="") as file:
+        csv.DictWriter(file, fieldnames=ORDER_LOG_FIELDS).writeheader()
+    active_segment_rows = 0
+    return pendingFile
+
+def sealPendingSegment(pendingFile): # Compacts a rotated segment without the lock, only the manifest update takes it
+    segmentFile = pendingFile.replace(".pending.csv", ".csv" + (".gz" if ORDER_LOG_COMPRESS == 1 else ""))
+    try:
+        orders = {}
+        for row in readSegment(pendingFile):
+            order = parseOrderRow(row)
+            if order:
+                orders[order["transaction_number"]] = order
+        sortedOrders = [orders[transaction] for transaction in sorted(orders)]
+        temporaryFile = f"{segmentFile}.tmp"
+        with (gzip.open if ORDER_LOG_COMPRESS == 1 else open)(temporaryFile, mode="wt", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=ORDER_LOG_FIELDS)
+            writer.writeheader()
+            writer.writerows(sortedOrders)
+        os.replace(temporaryFile, segmentFile)
+        os.chmod(segmentFile, 0o444)
+        with order_log_lock:
+            log_segments.append({
+                "file": segmentFile,
+                "min_transaction": sortedOrders[0]["transaction_number"] if sortedOrders else -1,
+                "max_transaction": sortedOrders[-1]["transaction_number"] if sortedOrders else -1,
+                "rows": len(sortedOrders)
+            })
+            saveManifest()
+            if pendingFile in pending_segments:
+                pending_segments.remove(pendingFile)
+            os.remove(pendingFile) # A crash before this point leaves rows in both, which orderLogInit drops
+    except Exception as e: # The pending segment stays on disk and in lookups, orderLogInit seals it on the next start
+        logger.error(f"Replica {REPLICA_ID}: Failed to seal {pendingFile}: {e}")
+        return
+    logger.info(f"Replica {REPLICA_ID}: Sealed {len(sortedOrders)} orders into {segmentFile}.")
+
+def findOrderOnDisk(transactionNum): # Scans the active segment, the pending ones and only the sealed segments whose range covers the order
+    with order_log_lock:
+        segments = list(pending_segments) + [segment["file"] for segment in log_segments
+                                             if segment["min_transaction"] <= transactionNum <= segment["max_transaction"]]
+        if os.path.exists(ORDER_LOG_FILE):
+            for row in readSegment(ORDER_LOG_FILE):
+                order = parseOrderRow(row)
+                if order and order["transaction_number"] == transactionNum:
+                    return order
+    for segmentFile in segments: # Sealed and pending segments are never rewritten, so they are read without the lock
+        try:
+            for row in readSegment(segmentFile):
+                order = parseOrderRow(row)
+                if order and order["transaction_number"] == transactionNum:
+                    return order
+        except FileNotFoundError: # Sealed meanwhile, the manifest now lists the segment that replaced it
+            return findOrderOnDisk(transactionNum)
+    return None
+
 def loadOrderToMemory(orderData):
     if not all(k in orderData for k in ["transaction_number", "stock_name", "type", "quantity"]):
         logger.warning(f"Replica {REPLICA_ID}: Attempted to add invalid order data to memory: {orderData}")
         return False
     if any(order["transaction_number"] == orderData["transaction_number"] for order in ordersList):
-        logger.info(f"Replica {REPLICA_ID}: Order {orderData['transaction_number']} already in memory. Skipping add.")
+        hot_logger.info("Replica %s: Order %s already in memory. Skipping add.", REPLICA_ID, orderData['transaction_number'])
         return False
     ordersList.append(orderData)
+    order_analytics.append(orderData)
     return True
 
+def encodeOrderColumns(orders):
+    return {"columns": {field: [order.get(field) for order in orders] for field in ORDER_LOG_FIELDS}}
+
+def decodeOrderColumns(payload):
+    columns = payload["columns"]
+    fields = [field for field in ORDER_LOG_FIELDS if field in columns] # Peers without timestamps send the core fields only
+    return [{field: value for field, value in zip(fields, row) if value is not None} for row in zip(*(columns[field] for field in fields))]
+
+def syncResponse(payload, mimetype): # Compact JSON, gzip-compressed when large enough and accepted by the requester
+    body = jsonEncode(payload)
+    response = app.response_class(body, mimetype=mimetype)
+    response.headers["Vary"] = "Accept, Accept-Encoding"
+    if len(body) >= SYNC_COMPRESS_MIN_BYTES and "gzip" in request.headers.get("Accept-Encoding", ""):
+        response.set_data(gzip.compress(body, compresslevel=SYNC_COMPRESS_LEVEL))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
+def fetchOrdersFrom(url, lastOrderNum, upto=None): # Returns the valid orders the peer holds after lastOrderNum, or None on failure
+    try:
+        params = {"upto": upto} if upto is not None else None
+        headers = {"Accept-Encoding": "gzip"} # 'requests' decompresses the body transparently
+        if SYNC_ENCODING == "columnar":
+            headers["Accept"] = f"{SYNC_MEDIA_TYPE}, application/json;q=0.5"
+        response = tracedRequest("get", f"{url}/get_missing_orders/{lastOrderNum}", params=params, headers=headers, timeout = 5)
+        if response.status_code == 200:
+            payload = jsonDecode(response.content)
+            orders = decodeOrderColumns(payload) if "columns" in payload else payload.get("data", [])
+            logger.info(f"Replica {REPLICA_ID}: Received {len(orders)} orders from {url}")
+            validOrders = [
+                order for order in orders if
+                isinstance(order.get("transaction_number"), int) and
+                isinstance(order.get("stock_name"), str) and
+                order.get("type") in ["buy", "sell"] and
+                isinstance(order.get("quantity"), int) and
+                order.get("quantity") > 0
+            ]
+            if len(validOrders) != len(orders):
+                logger.info(f"Replica {REPLICA_ID}: Filtered out {len(orders) - len(validOrders)} invalid orders from {url}")
+            return validOrders
+        else:
+            logger.warning(f"Replica {REPLICA_ID}: Failed to get missing orders from {url}, status: {response.status_code}, Response: {response.text[:200]}")
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Replica {REPLICA_ID}: Could not connect to {url} for missing orders: {e}")
+    except Exception as e:
+        logger.error(f"Replica {REPLICA_ID}: Error processing response from {url} for missing orders: {e}")
+    return None
+
+def assignSyncRanges(start, end, peerMax): # Splits [start, end] into one part per peer, each given to a peer holding it
+    holders = [url for url, maxTransaction in peerMax.items() if maxTransaction >= start]
+    assigned = {url: 0 for url in holders}
+    parts = []
+    for low, high in splitRange(start, end, max(1, len(holders))):
+        url = min((url for url in holders if peerMax[url] >= high), key=lambda url: assigned[url]) # Spread the parts over the peers
+        assigned[url] += 1
+        parts.append((url, low, high))
+    return parts
+
 def appendMissingOrders(maxtransactionNum):
+    peers = [url for url in getAllReplicas() if url != SELF_URL]
+    if not peers:
+        return 0
+    with ThreadPoolExecutor(max_workers=len(peers)) as pool: # Not replication_pool, as this also runs before a gunicorn fork
+        peerMax = {url: -1 if maxTransaction is None else maxTransaction
+                   for url, maxTransaction in zip(peers, pool.map(withTraceContext(queryMaxTransaction), peers))}
+        end = max(peerMax.values())
+        if end <= maxtransactionNum:
+            logger.info(f"Replica {REPLICA_ID}: No peer holds orders after {maxtransactionNum}.")
+            return 0
+        parts = assignSyncRanges(maxtransactionNum + 1, end, peerMax)
+        results = list(pool.map(withTraceContext(lambda part: fetchOrdersFrom(part[0], part[1] - 1, upto=part[2])), parts))
     ordersFetched = []
-    for url in getAllReplicas():
-        if url == SELF_URL:
-            continue
-        try:
-            response = requests.get(f"{url}/get_missing_orders/{maxtransactionNum}", timeout = 5)
-            if response.status_code == 200:
-                orders = response.json().get("data", [])
-                logger.info(f"Replica {REPLICA_ID}: Received {len(orders)} orders from {url}")
-                validOrders = [
-                    order for order in orders if
-                    isinstance(order.get("transaction_number"), int) and
-                    isinstance(order.get("stock_name"), str) and
-                    order.get("type") in ["buy", "sell"] and
-                    isinstance(order.get("quantity"), int) and
-                    order.get("quantity") > 0
-                ]
-                # Append the fetched missing orders
-                ordersFetched.extend(validOrders)
-                if len(validOrders) != len(orders):
-                    logger.info(f"Replica {REPLICA_ID}: Filtered out {len(orders) - len(validOrders)} invalid orders from {url}")
-            else:
-                logger.warning(f"Replica {REPLICA_ID}: Failed to get missing orders from {url}, status: {response.status_code}, Response: {response.text[:200]}")
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Replica {REPLICA_ID}: Could not connect to {url} for missing orders: {e}")
-        except Exception as e:
-            logger.error(f"Replica {REPLICA_ID}: Error processing response from {url} for missing orders: {e}")
+    for (url, low, high), orders in zip(parts, results):
+        if orders is None: # Fall back to the other peers holding the part
+            for other in sorted(peers, key=peerMax.get, reverse=True):
+                if other != url and peerMax[other] >= low:
+                    orders = fetchOrdersFrom(other, low - 1, upto=high)
+                    if orders is not None:
+                        break
+        # Append the fetched missing orders
+        ordersFetched.extend(orders or [])
+    return applyFetchedOrders(ordersFetched, maxtransactionNum)
+
+def applyFetchedOrders(ordersFetched, maxtransactionNum):
     count = 0
     if ordersFetched:
         ordersWithTxnNum = {order['transaction_number']: order for order in ordersFetched}.values()
         sortedOrders = sorted(list(ordersWithTxnNum), key=lambda x: x['transaction_number'])
-        logger.info(f"Replica {REPLICA_ID} fetched {sortedOrders} orders.")
+        logger.info(f"Replica {REPLICA_ID} fetched {len(sortedOrders)} orders ({sortedOrders[0]['transaction_number']} to {sortedOrders[-1]['transaction_number']}).")
         with orders_list_lock:
             existingTransactionNums = {order["transaction_number"] for order in ordersList}
             ordersAdded = set()
@@ -110,59 +659,67 @@ def appendMissingOrders(maxtransactionNum):
                         ordersAdded.add(transaction)
                         count += 1
                 elif transaction <= maxtransactionNum:
-                    logger.info(f"Replica {REPLICA_ID}: Skipping fetched order {transaction} as it's not > own_max {maxtransactionNum}")
+                    hot_logger.info("Replica %s: Skipping fetched order %s as it's not > own_max %s", REPLICA_ID, transaction, maxtransactionNum)
                 elif transaction in existingTransactionNums or transaction in ordersAdded:
-                    logger.info(f"Replica {REPLICA_ID}: Skipping fetched order {transaction} as it already exists.")
+                    hot_logger.info("Replica %s: Skipping fetched order %s as it already exists.", REPLICA_ID, transaction)
     logger.info(f"Replica {REPLICA_ID}: Finished applying fetched orders. Added {count} new orders.")
     return count
 
 def orderLogInit():
-    global ordersList
+    global ordersList, active_segment_rows
     logger.info(f"Replica {REPLICA_ID}: Initializing order log from {ORDER_LOG_FILE}.")
+    with order_bodies_lock:
+        order_bodies.clear()
     maxTransactionNum = -1
-    tempOrdersList = []
+    legacyActiveSegment = False
+    tempOrders = {} # By transaction number, as a crash while sealing can leave an order in two segments
     try:
         if not os.path.exists(ORDER_LOG_FILE):
             loadOrderToDisk({})
     except Exception as e:
         logger.error(f"Replica {REPLICA_ID}: Could not ensure order log file {ORDER_LOG_FILE} exists: {e}")
     try:
-        if os.path.exists(ORDER_LOG_FILE):
-            with open(ORDER_LOG_FILE, mode="r", newline="") as file:
+        loadManifest()
+        with order_log_lock:
+            pending_segments[:] = sorted(file for file in os.listdir(".") if file.startswith(f"order_log_{REPLICA_ID}.") and file.endswith(".pending.csv"))
+        for pendingFile in list(pending_segments): # Rotated before a restart but never sealed
+            if any(segment["file"].startswith(pendingFile.replace(".pending.csv", ".csv")) for segment in log_segments):
+                pending_segments.remove(pendingFile) # Sealed, the restart came before the pending file was removed
+                os.remove(pendingFile)
+            else:
+                sealPendingSegment(pendingFile)
+        segmentFiles = [segment["file"] for segment in log_segments] + ([ORDER_LOG_FILE] if os.path.exists(ORDER_LOG_FILE) else [])
+        if not os.path.exists(ORDER_LOG_FILE):
+            logger.warning(f"Replica {REPLICA_ID}: Order log file {ORDER_LOG_FILE} not found. Starting with {len(log_segments)} sealed segments.")
+        for segmentFile in segmentFiles:
+            with openSegment(segmentFile) as file:
                 reader = csv.DictReader(file)
-                if "transaction_number" not in reader.fieldnames:
-                    logger.error(f"Replica {REPLICA_ID}: Log file {ORDER_LOG_FILE} missing 'transaction_number' header.")
+                if "transaction_number" not in (reader.fieldnames or []):
+                    logger.error(f"Replica {REPLICA_ID}: Log file {segmentFile} missing 'transaction_number' header.")
                     reader = []
                 rowsProcessed = 0
                 for row in reader:
                     rowsProcessed += 1
-                    try:
-                        transactionNum = int(row.get("transaction_number"))
-                        stockName = row.get("stock_name")
-                        tradeType = row.get("type")
-                        quantity = row.get("quantity") if row.get("quantity") is not None else 0
-                        if stockName and tradeType in ["buy", "sell"] and quantity > 0:
-                            maxTransactionNum = max(maxTransactionNum, transactionNum)
-                            tempOrdersList.append({
-                                "transaction_number": transactionNum,
-                                "stock_name": stockName,
-                                "type": tradeType,
-                                "quantity": quantity
-                            })
-                        else:
-                            logger.warning(f"Replica {REPLICA_ID}: Skipping row with invalid data in log: {row}")
-                    except (ValueError, TypeError, KeyError) as e:
-                        logger.warning(f"Replica {REPLICA_ID}: Skipping row with parsing error (txn='{row.get('transaction_number')}', qty='{row.get('quantity')}'): {row} - Error: {e}")
-                        continue
-                logger.info(f"Replica {REPLICA_ID}: Read {rowsProcessed} rows from log. Max local transaction found: {maxTransactionNum}")
-        else:
-            logger.warning(f"Replica {REPLICA_ID}: Order log file {ORDER_LOG_FILE} not found. Starting with empty state.")
-            maxTransactionNum = -1
+                    order = parseOrderRow(row)
+                    if order:
+                        maxTransactionNum = max(maxTransactionNum, order["transaction_number"])
+                        tempOrders[order["transaction_number"]] = order
+                    else:
+                        logger.warning(f"Replica {REPLICA_ID}: Skipping row with invalid data in log: {row}")
+            if segmentFile == ORDER_LOG_FILE:
+                active_segment_rows = rowsProcessed
+                legacyActiveSegment = rowsProcessed > 0 and "timestamp" not in (reader.fieldnames or [])
+            logger.info(f"Replica {REPLICA_ID}: Read {rowsProcessed} rows from {segmentFile}. Max local transaction found: {maxTransactionNum}")
     except Exception as e:
         logger.error(f"Replica {REPLICA_ID}: Failed to read order log file {ORDER_LOG_FILE}: {e}")
         maxTransactionNum = -1
+    if legacyActiveSegment: # Rows without the timestamp column are sealed, so new rows are appended under the current header
+        with order_log_lock:
+            pendingFile = rotateActiveSegment()
+        sealPendingSegment(pendingFile)
     with orders_list_lock:
-        ordersList = sorted(tempOrdersList, key=lambda x: x['transaction_number'])
+        ordersList = [tempOrders[transaction] for transaction in sorted(tempOrders)]
+        order_analytics.rebuild(ordersList)
     logger.info(f"Replica {REPLICA_ID}: Initialization complete. {len(ordersList)} orders loaded into memory.")
     return maxTransactionNum
 
@@ -170,7 +727,51 @@ def syncOnInit(maxTransactionNum):
     appendMissingOrders(maxTransactionNum)
     logger.info(f"Synchronization finished on {REPLICA_ID}")
 
-def recoverStateForLeader():
+def recordPeerHighWater(url, transactionNum):
+    with peer_high_water_lock:
+        peer_high_water[url] = max(peer_high_water.get(url, -1), transactionNum)
+
+def queryMaxTransaction(url): # Returns the peer's highest transaction, or None if it could not be reached
+    try:
+        logger.info(f"Replica {REPLICA_ID}: Querying max transaction from {url}...")
+        resp = tracedRequest("get", f"{url}/max_transaction", timeout = 2)
+        if resp.status_code == 200:
+            payload = jsonDecode(resp.content)
+            replicaMaxTransaction = payload.get("max_transaction", -1)
+            if isinstance(replicaMaxTransaction, int):
+                logger.info(f"Replica {REPLICA_ID}: Received max_transaction {replicaMaxTransaction} from {url}")
+                recordPeerHighWater(url, replicaMaxTransaction)
+                return replicaMaxTransaction
+            logger.warning(f"Replica {REPLICA_ID}: Invalid max_transaction format received from {url}: {payload}")
+        else:
+            logger.warning(f"Replica {REPLICA_ID}: Failed to get max_transaction from {url}, status: {resp.status_code}")
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Replica {REPLICA_ID}: Could not connect to {url} for max_transaction: {e}")
+    except Exception as e:
+        logger.error(f"Replica {REPLICA_ID}: Error processing response from {url} for max_transaction: {e}")
+    return None
+
+def gapRanges(held, first, last): # Contiguous (first, last) ranges within [first, last] missing from the sorted 'held'
+    ranges, expected = [], first
+    for transaction in held:
+        if transaction < first or transaction > last:
+            continue
+        if transaction > expected:
+            ranges.append((expected, transaction - 1))
+        expected = transaction + 1
+    if expected <= last:
+        ranges.append((expected, last))
+    return ranges
+
+def missingRanges(upto): # Ranges of transactions up to 'upto' that this replica does not hold
+    with orders_list_lock:
+        held = sorted({order["transaction_number"] for order in ordersList})
+    return gapRanges(held, 0, upto)
+
+def missingTransactions(upto): # Transaction numbers up to 'upto' that this replica does not hold
+    return [transaction for first, last in missingRanges(upto) for transaction in range(first, last + 1)]
+
+def recoverStateForLeader(): # Positions the transaction counter and returns the highest transaction seen on any replica
     global transactionNumber
     logger.info(f"Replica {REPLICA_ID}: Starting state recovery as new leader.")
     maxTransactionNum = -1
@@ -178,61 +779,268 @@ def recoverStateForLeader():
         if ordersList:
             maxTransactionNum = max((order.get("transaction_number", -1) for order in ordersList), default=-1)
     logger.info(f"Replica {REPLICA_ID}: Own max transaction number (from memory) is {maxTransactionNum}.")
-    otherMaxTransaction = -1
-    allReplicas = getAllReplicas()
-    for url in allReplicas:
-        if url == SELF_URL:
-            continue
-        try:
-            logger.info(f"Replica {REPLICA_ID}: Querying max transaction from {url}...")
-            resp = requests.get(f"{url}/max_transaction", timeout = 2)
-            if resp.status_code == 200:
-                replicaMaxTransaction = resp.json().get("max_transaction", -1)
-                if isinstance(replicaMaxTransaction, int):
-                    logger.info(f"Replica {REPLICA_ID}: Received max_transaction {replicaMaxTransaction} from {url}")
-                    otherMaxTransaction = max(otherMaxTransaction, replicaMaxTransaction)
-                else:
-                    logger.warning(f"Replica {REPLICA_ID}: Invalid max_transaction format received from {url}: {resp.json()}")
-            else:
-                logger.warning(f"Replica {REPLICA_ID}: Failed to get max_transaction from {url}, status: {resp.status_code}")
-        except requests.exceptions.RequestException as e:
-            logger.warning(f"Replica {REPLICA_ID}: Could not connect to {url} for max_transaction: {e}")
-        except Exception as e:
-            logger.error(f"Replica {REPLICA_ID}: Error processing response from {url} for max_transaction: {e}")
+    peers = [url for url in getAllReplicas() if url != SELF_URL]
+    list(replication_pool.map(withTraceContext(queryMaxTransaction), peers))
+    with peer_high_water_lock: # Also covers peers that are down now but acknowledged or replicated orders earlier
+        otherMaxTransaction = max(peer_high_water.values(), default=-1)
     seenMaxTransaction = max(maxTransactionNum, otherMaxTransaction)
     with transaction_lock:
         transactionNumber = max(transactionNumber, seenMaxTransaction + 1)
-        logger.info(f"Replica {REPLICA_ID}: Global max seen: {seenMaxTransaction}. Original local counter: {transactionNumber}. Updated transaction_number counter to: {transactionNumber}")
-    appendMissingOrders(maxTransactionNum)
+        logger.info(f"Replica {REPLICA_ID}: Global max seen: {seenMaxTransaction}. Updated transaction_number counter to: {transactionNumber}")
+    return seenMaxTransaction
+
+def catchUpFromPeers(seenMaxTransaction): # Runs in the background, fetching only the missing ranges from the peers furthest ahead
+    missing = missingRanges(seenMaxTransaction)
+    with peer_high_water_lock:
+        peers = sorted(peer_high_water.items(), key=lambda peer: peer[1], reverse=True)
+    for url, highWater in peers:
+        if not missing:
+            break
+        if url == SELF_URL:
+            continue
+        remaining = []
+        for index, (first, last) in enumerate(missing):
+            if highWater < first:
+                remaining.append((first, last))
+                continue
+            orders = fetchOrdersFrom(url, first - 1, upto=last)
+            if orders is None: # Unreachable, the next peer gets this and every later range
+                remaining.extend(missing[index:])
+                break
+            applyFetchedOrders(orders, first - 1)
+            remaining.extend(gapRanges(sorted(order["transaction_number"] for order in orders), first, last))
+        missing = remaining
+    if missing:
+        count = sum(last - first + 1 for first, last in missing)
+        logger.warning(f"Replica {REPLICA_ID}: Catch-up finished with {count} transactions up to {seenMaxTransaction} held by no reachable peer.")
     logger.info(f"Replica {REPLICA_ID}: State recovery finished.")
 
-def sendToFollowers(orderData):
+def orderDigest(order):
+    record = f"{order['transaction_number']},{order['stock_name']},{order['type']},{order['quantity']}"
+    return int.from_bytes(hashlib.sha256(record.encode()).digest(), "big")
+
+def splitRange(start, end, buckets): # Same split on both replicas, so bucket i covers the same transactions on each
+    size = max(1, -(-(end - start + 1) // buckets))
+    return [(low, min(low + size - 1, end)) for low in range(start, end + 1, size)]
+
+def rangeDigests(start, end, buckets):
+    ranges = splitRange(start, end, buckets)
+    size = ranges[0][1] - ranges[0][0] + 1 if ranges else 1
+    counts, digests = [0] * len(ranges), [0] * len(ranges)
+    with orders_list_lock: # Only copy the range under the lock, hashing it would stall every order being applied
+        inRange = [order for order in ordersList if start <= order["transaction_number"] <= end]
+    for order in inRange:
+        index = (order["transaction_number"] - start) // size
+        counts[index] += 1
+        digests[index] ^= orderDigest(order)
+    return [{"from": low, "to": high, "count": counts[i], "digest": f"{digests[i]:064x}"} for i, (low, high) in enumerate(ranges)]
+
+def fetchRangeDigests(url, start, end):
+    try:
+        response = tracedRequest("get", f"{url}/range_digest", params={"from": start, "to": end, "buckets": ANTI_ENTROPY_FANOUT}, timeout = 2)
+        if response.status_code == 200:
+            return jsonDecode(response.content).get("buckets")
+        logger.warning(f"Replica {REPLICA_ID}: Failed to get range digests from {url}, status: {response.status_code}")
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Replica {REPLICA_ID}: Could not connect to {url} for range digests: {e}")
+    except ValueError as e:
+        logger.warning(f"Replica {REPLICA_ID}: Invalid range digests received from {url}: {e}")
+    return None
+
+def reconcileRange(url, start, end): # Returns the number of orders repaired in [start, end]
+    if end - start + 1 <= ANTI_ENTROPY_LEAF_SIZE:
+        orders = fetchOrdersFrom(url, start - 1, upto=end)
+        return applyFetchedOrders(orders, start - 1) if orders else 0
+    remote = fetchRangeDigests(url, start, end)
+    if remote is None:
+        return 0
+    repaired = 0
+    for mine, theirs in zip(rangeDigests(start, end, ANTI_ENTROPY_FANOUT), remote):
+        if theirs["count"] > 0 and mine["digest"] != theirs["digest"]:
+            repaired += reconcileRange(url, theirs["from"], theirs["to"])
+    return repaired
+
+def antiEntropyRound(url):
+    peerMaxTransaction = queryMaxTransaction(url)
+    if peerMaxTransaction is None or peerMaxTransaction < 0:
+        return 0
+    repaired = reconcileRange(url, 0, peerMaxTransaction)
+    if repaired:
+        logger.info(f"Replica {REPLICA_ID}: Anti-entropy with {url} repaired {repaired} orders.")
+    return repaired
+
+def runAntiEntropy():
+    while True:
+        time.sleep(ANTI_ENTROPY_INTERVAL * random.uniform(0.5, 1.5)) # Jitter keeps replicas from syncing in lockstep
+        try:
+            antiEntropyRound(random.choice([url for url in getAllReplicas() if url != SELF_URL]))
+        except Exception as e:
+            logger.error(f"Replica {REPLICA_ID}: Error during anti-entropy: {e}")
+
+def startAntiEntropy(): # Called in the process that serves requests, the gunicorn worker or the single dev process
+    if ANTI_ENTROPY_INTERVAL <= 0 or TOTAL_REPLICAS < 2:
+        return
+    Thread(target=runAntiEntropy, daemon=True).start()
+
+def requiredAcks(followers):
+    if WRITE_CONCERN == "all":
+        return len(followers)
+    if WRITE_CONCERN == "majority":
+        return min(len(followers), TOTAL_REPLICAS // 2) # The leader's own copy counts towards the majority
+    return 0
+
+def recordFollowerAck(follower, transactionNum, latency):
+    with follower_status_lock:
+        status = follower_status.setdefault(follower, {"acked_transaction": -1, "last_ack_ms": None, "failures": 0})
+        if transactionNum is None:
+            status["failures"] += 1
+        else:
+            status["acked_transaction"] = max(status["acked_transaction"], transactionNum)
+            status["last_ack_ms"] = round(latency * 1000, 2)
+
+class FollowerSender: # Bounded executor of a single follower
+    def __init__(self, threads, backlog):
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.backlog = backlog
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args): # Returns None when the follower is already 'backlog' orders behind
+        with self.lock:
+            if self.pending >= self.backlog:
+                return None
+            self.pending += 1
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(self.finished)
+        return future
+
+    def finished(self, future):
+        with self.lock:
+            self.pending -= 1
+
+follower_senders = {} # follower url -> FollowerSender, created on the first order sent to it
+follower_senders_lock = threading.Lock()
+
+def followerSender(follower):
+    with follower_senders_lock:
+        if follower not in follower_senders:
+            follower_senders[follower] = FollowerSender(REPLICATION_THREADS, REPLICATION_BACKLOG)
+        return follower_senders[follower]
+
+def replicateTo(follower, orderData): # Returns whether the follower holds the order
+    transactionNum = orderData.get('transaction_number')
+    start = time.monotonic()
+    try:
+        response = tracedRequest("post", f"{follower}/replicate_order", json=orderData, headers={"X-Leader": SELF_URL}, timeout=5)
+        if response.status_code == 200:
+            hot_logger.info("Replica %s (Leader): Order %s successfully sent to %s", REPLICA_ID, transactionNum, follower)
+            recordFollowerAck(follower, transactionNum, time.monotonic() - start)
+            recordPeerHighWater(follower, transactionNum)
+            return True
+        elif response.status_code == 409:
+            logger.info(f"Replica {REPLICA_ID} (Leader): Follower {follower} rejected replication (Status 409), possibly thinks it's leader.")
+        else:
+            logger.warning(f"Replica {REPLICA_ID} (Leader): Failed to send order {transactionNum} to {follower}. Status: {response.status_code}, Response: {response.text[:200]}")
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Replica {REPLICA_ID} (Leader): Error sending order {transactionNum} to {follower}: {e}")
+    recordFollowerAck(follower, None, None)
+    return False
+
+def sendToFollowers(orderData): # Returns (acks, required acks), waiting only as long as the write concern needs
     followers = [url for url in getAllReplicas() if url != SELF_URL]
     if not followers:
         logger.info(f"Replica {REPLICA_ID} (Leader): No followers to send order {orderData.get('transaction_number')} to.")
-        return
+        return 0, 0
     transactionNum = orderData.get('transaction_number')
-    logger.info(f"Replica {REPLICA_ID} (Leader): Propagating order {transactionNum} to followers: {followers}")
+    hot_logger.info("Replica %s (Leader): Propagating order %s to followers: %s", REPLICA_ID, transactionNum, followers)
+    pending = set()
     for follower in followers:
-        try:
-            response = requests.post(f"{follower}/replicate_order", json=orderData)
-            if response.status_code == 200:
-                logger.info(f"Replica {REPLICA_ID} (Leader): Order {transactionNum} successfully sent to {follower}")
-            elif response.status_code == 409:
-                logger.info(f"Replica {REPLICA_ID} (Leader): Follower {follower} rejected replication (Status 409), possibly thinks it's leader.")
-            else:
-                logger.warning(f"Replica {REPLICA_ID} (Leader): Failed to send order {transactionNum} to {follower}. Status: {response.status_code}, Response: {response.text[:200]}")
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Replica {REPLICA_ID} (Leader): Error sending order {transactionNum} to {follower}: {e}")
+        future = followerSender(follower).submit(withTraceContext(replicateTo), follower, orderData)
+        if future is None:
+            hot_logger.warning("Replica %s (Leader): Follower %s is %s orders behind, order %s is left to anti-entropy.", REPLICA_ID, follower, REPLICATION_BACKLOG, transactionNum)
+            recordFollowerAck(follower, None, None)
+        else:
+            pending.add(future)
+    required = requiredAcks(followers)
+    acks = 0
+    deadline = time.monotonic() + REPLICATION_TIMEOUT
+    with traceSpan("replication_wait", write_concern=WRITE_CONCERN, required_acks=required):
+        while pending and acks < required:
+            done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            acks += sum(1 for future in done if future.result())
+    return acks, required
+
+def grantLease(candidate, duration):
+    now = time.monotonic()
+    with lease_lock:
+        if granted_lease["holder"] not in (None, candidate) and granted_lease["expiry"] > now:
+            return False, granted_lease["holder"]
+        granted_lease["holder"] = candidate
+        granted_lease["expiry"] = now + duration
+        return True, candidate
+
+def currentLeaseHolder():
+    with lease_lock:
+        return granted_lease["holder"] if granted_lease["expiry"] > time.monotonic() else None
+
+def holdsLease():
+    return LEASE_ENABLED != 1 or lease_expiry > time.monotonic()
+
+def requestLease(url):
+    try:
+        response = tracedRequest("post", f"{url}/lease", json={"candidate": SELF_URL, "duration": LEASE_DURATION}, timeout=LEASE_DURATION / 4)
+        return response.status_code == 200 and jsonDecode(response.content).get("granted") is True
+    except (requests.exceptions.RequestException, ValueError) as e:
+        hot_logger.info("Replica %s (Leader): Lease request to %s failed: %s", REPLICA_ID, url, e)
+        return False
+
+def acquireLease():
+    global lease_expiry
+    start = time.monotonic()
+    granted, holder = grantLease(SELF_URL, LEASE_DURATION)
+    if not granted:
+        logger.warning(f"Replica {REPLICA_ID}: Cannot take the lease, it is held by {holder}.")
+        return False
+    requests_sent = [replication_pool.submit(withTraceContext(requestLease), url) for url in getAllReplicas() if url != SELF_URL]
+    grants = 1 + sum(1 for future in requests_sent if future.result())
+    if grants < TOTAL_REPLICAS // 2 + 1:
+        logger.warning(f"Replica {REPLICA_ID}: Lease granted by {grants} of {TOTAL_REPLICAS} replicas, no majority.")
+        return False
+    with lease_lock:
+        lease_expiry = start + LEASE_DURATION * (1 - LEASE_DRIFT)
+    return True
+
+def renewLease(term): # Heartbeat of the leader, stops once another replica is leader or a newer term started
+    while LEADER_ID == SELF_URL and term == lease_term:
+        acquireLease()
+        time.sleep(LEASE_DURATION / 3)
+    logger.info(f"Replica {REPLICA_ID}: Stopped renewing the lease of term {term}.")
 
 # API Endpoints - Using the helper functions to process the order requests from frontend service
 @app.route("/ping", methods=["GET"]) # '/ping' from frontend service which is used when electing leader and check the server running condition
 def checkHealth():
-    return jsonify({"status": "healthy", "replica_id": REPLICA_ID, "leader_id": LEADER_ID}), 200
+    return jsonify({"status": "healthy", "replica_id": REPLICA_ID, "leader_id": LEADER_ID, "lease_holder": currentLeaseHolder()}), 200
+
+@app.route("/lease", methods=["POST"])
+def leaseRequest():
+    data = request.get_json()
+    candidate = data.get("candidate")
+    duration = data.get("duration")
+    if not candidate or not isinstance(duration, (int, float)) or duration <= 0:
+        return jsonify({"error": "Invalid lease request."}), 400
+    granted, holder = grantLease(candidate, duration)
+    return jsonify({"granted": granted, "holder": holder}), 200
+
+def startLeaderTask(target, *args): # No trace context, the task runs long after the request that started it
+    task = Thread(target=target, args=args, daemon=True)
+    task.start()
+    leader_tasks[:] = [running for running in leader_tasks if running.is_alive()] + [task]
 
 @app.route("/set_leader", methods=["POST"])
 def setLeader():
-    global LEADER_ID, leaderRecoveryCompleted
+    global LEADER_ID, leaderRecoveryCompleted, lease_term
     leaderId = request.get_json().get("leader_id")
     if not leaderId:
         return jsonify({"error": "Missing leader id."}), 400
@@ -241,14 +1049,18 @@ def setLeader():
     LEADER_ID = leaderId
     if LEADER_ID == SELF_URL and previousLeader != SELF_URL:
         logger.info(f"Replica {REPLICA_ID}: Set as leader.")
+        if LEASE_ENABLED == 1:
+            lease_term += 1
+            startLeaderTask(renewLease, lease_term)
         
         with leader_recovery_lock: # Acquire lock to recover the state if leader
             leaderRecoveryCompleted = False
             logger.info(f"Replica {REPLICA_ID}: Leader recovery process started.")
             try:
-                recoverStateForLeader()
-                leaderRecoveryCompleted = True
-                logger.info(f"Replica {REPLICA_ID}: Leader recovery process completed successfully.")
+                seenMaxTransaction = recoverStateForLeader()
+                leaderRecoveryCompleted = True # New orders are numbered past every peer, so the catch-up no longer blocks them
+                startLeaderTask(catchUpFromPeers, seenMaxTransaction)
+                logger.info(f"Replica {REPLICA_ID}: Transaction counter positioned. Catching up to {seenMaxTransaction} in the background.")
             except Exception as e:
                 logger.info(f"Replica {REPLICA_ID}: ERROR during leader recovery: {e}")
                 leaderRecoveryCompleted = False
@@ -271,6 +1083,8 @@ def processOrder(): # Place Order API endpoint
     
     if LEADER_ID != SELF_URL:
         return jsonify({"error": {"code": 403, "message": "This replica is not the leader"}}), 403
+    if not holdsLease():
+        return jsonify({"error": {"code": 503, "message": "Service Unavailable: Leader does not hold a majority lease"}}), 503
     with leader_recovery_lock:
         if not leaderRecoveryCompleted:
             return jsonify({"error": {"code": 503, "message": "Service Unavailable: Leader initializing"}}), 503
@@ -283,33 +1097,41 @@ def processOrder(): # Place Order API endpoint
         return jsonify({"error": {"code": 400, "message": "Invalid request data (stockName, tradeType=buy/sell, quantity not int)"}}), 400
     try:
         # Get call to catalog to retrieve the stock
-        getResponse = requests.get(f"{CATALOG_SERVICE_URL}/stocks/{stockName}", timeout = 5)
+        catalogServiceUrl = catalogUrl(stockName)
+        getResponse = tracedRequest("get", f"{catalogServiceUrl}/stocks/{stockName}", timeout = 5)
         getResponse.raise_for_status()
-        currentQuantity = getResponse.json().get("quantity")
+        currentQuantity = jsonDecode(getResponse.content).get("quantity")
         if tradeType == "buy" and quantity > currentQuantity:
             return jsonify({"error": {"code": 400, "message": f"Insufficient stock for {stockName}. Available: {currentQuantity}, Requested: {quantity}"}}), 400
         # Post call to catalog to update the stock
-        postResponse = requests.post(f"{CATALOG_SERVICE_URL}/stocks/{stockName}", json={"type": tradeType, "quantity": quantity}, timeout = 5)
+        postResponse = tracedRequest("post", f"{catalogServiceUrl}/stocks/{stockName}", json={"type": tradeType, "quantity": quantity}, timeout = 5)
         postResponse.raise_for_status()
-        with transaction_lock:
+        with tracedLock(transaction_lock, "transaction_lock"):
             currentTransactionNum = transactionNumber
             transactionNumber += 1
         orderToBeSaved = {
             "transaction_number": currentTransactionNum,
             "stock_name": stockName,
             "type": tradeType,
-            "quantity": quantity
+            "quantity": quantity,
+            "timestamp": time.time()
         }
         loadOrderToDisk(orderToBeSaved)
-        with orders_list_lock:
+        with tracedLock(orders_list_lock, "orders_list_lock"):
             loadOrderToMemory(orderToBeSaved)
-        Thread(target=sendToFollowers, args=(orderToBeSaved,)).start()
+        acks, required = sendToFollowers(orderToBeSaved)
+        if acks < required:
+            logger.warning(f"Replica {REPLICA_ID} (Leader): Order {currentTransactionNum} acknowledged by {acks} of {required} followers required by write concern '{WRITE_CONCERN}'.")
+            return jsonify({
+                "error": {"code": 504, "message": f"Order {currentTransactionNum} committed on the leader but acknowledged by {acks} of {required} required followers"},
+                "data": {"transaction_number": currentTransactionNum}
+            }), 504
         return jsonify({"data": {"transaction_number": currentTransactionNum}}), 200
     except requests.exceptions.RequestException as e:
         error_payload = {"code": 500, "message": f"Catalog service error: {str(e)}"}
         try:
             if e.response is not None:
-                error_payload = e.response.json().get("error", error_payload)
+                error_payload = jsonDecode(e.response.content).get("error", error_payload)
         except:
             pass
         status_code = e.response.status_code if hasattr(e, 'response') and e.response else 500
@@ -322,6 +1144,9 @@ def replicateOrderToFollowers():
     if LEADER_ID == SELF_URL:
         logger.warning(f"Replica {REPLICA_ID}: Received replicate_order for leader. Sending 409 error.")
         return jsonify({"message": "Ignoring replication request as current leader"}), 409
+    if LEASE_ENABLED == 1 and request.headers.get("X-Leader") != currentLeaseHolder():
+        logger.warning(f"Replica {REPLICA_ID}: Rejected replication from {request.headers.get('X-Leader')}, which does not hold the lease.")
+        return jsonify({"message": "Ignoring replication request from a replica without the lease"}), 409
     orderData = request.get_json()
     transactionNum = orderData.get("transaction_number")
     stockName = orderData.get("stock_name")
@@ -331,41 +1156,55 @@ def replicateOrderToFollowers():
             tradeType in ["buy", "sell"] and isinstance(quantity, int) and quantity > 0):
         logger.info(f"Replica {REPLICA_ID} (Follower): Received invalid replication request data: {orderData}")
         return jsonify({"error": "Invalid replication data"}), 400
-    logger.info(f"Replica {REPLICA_ID} (Follower): Received replication request for order {transactionNum}.")
-    with orders_list_lock:
+    hot_logger.info("Replica %s (Follower): Received replication request for order %s.", REPLICA_ID, transactionNum)
+    sender = request.headers.get("X-Leader") or LEADER_ID
+    if sender:
+        recordPeerHighWater(sender, transactionNum)
+    with tracedLock(orders_list_lock, "orders_list_lock"):
         if any(order["transaction_number"] == transactionNum for order in ordersList):
-            logger.info(f"Replica {REPLICA_ID} (Follower): Order {transactionNum} already exists. Ignoring duplicate replication.")
+            hot_logger.info("Replica %s (Follower): Order %s already exists. Ignoring duplicate replication.", REPLICA_ID, transactionNum)
             return jsonify({"message": "Order already replicated"}), 200
         # Pass on to store the order details in the log for all the replicas
         loadOrderToDisk(orderData)
         loadOrderToMemory(orderData)
-    logger.info(f"Replica {REPLICA_ID} (Follower): Successfully replicated order {transactionNum}.")
+    hot_logger.info("Replica %s (Follower): Successfully replicated order %s.", REPLICA_ID, transactionNum)
     return jsonify({"message": "Order replicated successfully"}), 200
 
+# Order Response Cache - Logged orders never change, so the encoded 'GET /orders/<n>' body of the ORDER_BODY_CACHE_SIZE most
+# recently queried orders is kept and served again without scanning the log segments or encoding the order a second time
+ORDER_BODY_CACHE_SIZE = int(os.environ.get("ORDER_BODY_CACHE_SIZE", "10000"))
+order_bodies = OrderedDict() # transaction number -> encoded response body
+order_bodies_lock = threading.Lock()
+
+def cachedOrderBody(transactionNum):
+    with order_bodies_lock:
+        body = order_bodies.get(transactionNum)
+        if body is not None:
+            order_bodies.move_to_end(transactionNum)
+        return body
+
+def rememberOrderBody(transactionNum, order):
+    body = jsonEncode({"data": order})
+    if ORDER_BODY_CACHE_SIZE > 0:
+        with order_bodies_lock:
+            order_bodies[transactionNum] = body
+            order_bodies.move_to_end(transactionNum)
+            if len(order_bodies) > ORDER_BODY_CACHE_SIZE:
+                order_bodies.popitem(last=False)
+    return body
+
 # Query Order API endpoint which is used to query the order details using the transaction number,
 # when client wants to check the server reply matches the locally stored order information
 @app.route("/orders/<int:transactionNumToQuery>", methods=["GET"])
 def getOrder(transactionNumToQuery): 
     foundOrder = None
+    if LEADER_ID == SELF_URL and not holdsLease(): # A leader whose lease lapsed may already have been replaced
+        return jsonify({"error": {"code": 503, "message": "Service Unavailable: Leader does not hold a majority lease"}}), 503
+    body = cachedOrderBody(transactionNumToQuery)
+    if body is not None:
+        return app.response_class(body, mimetype="application/json"), 200
     try:
-        with order_log_lock:
-            
-            with open(ORDER_LOG_FILE, mode="r", newline="") as file: # Read from the order log file
-                reader = csv.DictReader(file)
-                for row in reader:
-                    try:
-                        transactionNum = int(row.get("transaction_number", -1))
-                        if transactionNum == transactionNumToQuery:
-                            foundOrder = {
-                                "transaction_number": transactionNum,
-                                "stock_name": row.get("stock_name"),
-                                "type": row.get("type"),
-                                "quantity": int(row.get("quantity", 0))
-                            }
-                            break
-                    except (ValueError, KeyError) as e:
-                        logger.info(f"Replica {REPLICA_ID}: Error parsing row in CSV: {e}")
-                        continue
+        foundOrder = findOrderOnDisk(transactionNumToQuery)
     except FileNotFoundError:
         logger.error(f"Replica {REPLICA_ID}: Order log file not found.")
         return jsonify({"error": {"code": 404, "message": "Order log not available"}}), 404
@@ -373,22 +1212,56 @@ def getOrder(transactionNumToQuery):
         logger.error(f"Replica {REPLICA_ID}: Error accessing order log: {e}")
         return jsonify({"error": {"code": 500, "message": "Internal server error"}}), 500
     if foundOrder:
-        return jsonify({"data": foundOrder}), 200
+        return app.response_class(rememberOrderBody(transactionNumToQuery, foundOrder), mimetype="application/json"), 200
     else:
         logger.error(f"Replica {REPLICA_ID}: Order {transactionNumToQuery} not found in log.")
         return jsonify({"error": {"code": 404, "message": "Order not found"}}), 404
 
+@app.route("/replication_status", methods=["GET"]) # Leader view of how far each follower lags behind, in transactions
+def getReplicationStatus():
+    with transaction_lock:
+        lastTransaction = transactionNumber - 1
+    with follower_status_lock:
+        followers = {
+            follower: {**status, "lag": max(0, lastTransaction - status["acked_transaction"])}
+            for follower, status in follower_status.items()
+        }
+    with peer_high_water_lock:
+        highWater = dict(peer_high_water)
+    return jsonify({"write_concern": WRITE_CONCERN, "last_transaction": lastTransaction, "followers": followers, "peer_high_water": highWater}), 200
+
 @app.route("/get_missing_orders/<int:lastOrderNum>", methods=["GET"])
 def getMissingOrders(lastOrderNum):
     logger.info(f"Replica {REPLICA_ID}: Received request for orders after {lastOrderNum}.")
+    upto = request.args.get("upto", type=int) # Optional upper bound, so a recovering leader only pulls the range it is missing
     with orders_list_lock:
         missingOrders = [
             order for order in ordersList
-            if order.get("transaction_number", -1) > lastOrderNum
+            if order.get("transaction_number", -1) > lastOrderNum and (upto is None or order["transaction_number"] <= upto)
         ]
     missingOrders.sort(key=lambda x: x['transaction_number'])
     logger.info(f"Replica {REPLICA_ID}: Found {len(missingOrders)} orders after {lastOrderNum}.")
-    return jsonify({"data": missingOrders}), 200
+    if request.accept_mimetypes.quality(SYNC_MEDIA_TYPE) > request.accept_mimetypes.quality("application/json"):
+        return syncResponse(encodeOrderColumns(missingOrders), SYNC_MEDIA_TYPE), 200
+    return syncResponse({"data": missingOrders}, "application/json"), 200
+
+@app.route("/analytics/orders", methods=["GET"])
+def getOrderAnalytics():
+    bounds = {}
+    for name, parameter, kind in [("start", "from", int), ("end", "to", int), ("since", "since", float), ("until", "until", float)]:
+        bounds[name] = request.args.get(parameter, type=kind)
+        if parameter in request.args and bounds[name] is None:
+            return jsonify({"error": {"code": 400, "message": f"Invalid '{parameter}' parameter"}}), 400
+    return jsonify({"data": order_analytics.summarize(symbol=request.args.get("symbol"), **bounds)}), 200
+
+@app.route("/range_digest", methods=["GET"]) # Anti-entropy digests over 'buckets' equal slices of the range [from, to]
+def getRangeDigest():
+    start = request.args.get("from", type=int)
+    end = request.args.get("to", type=int)
+    buckets = min(request.args.get("buckets", ANTI_ENTROPY_FANOUT, type=int), 256)
+    if start is None or end is None or start < 0 or end < start or buckets < 1:
+        return jsonify({"error": "Expected 0 <= from <= to and buckets >= 1"}), 400
+    return jsonify({"buckets": rangeDigests(start, end, buckets)}), 200
 
 @app.route("/max_transaction", methods=["GET"])
 def getMaximumTransaction():
@@ -398,19 +1271,60 @@ def getMaximumTransaction():
             maxTransactionInMemory = max((order.get("transaction_number", -1) for order in ordersList), default=-1)
     return jsonify({"max_transaction": maxTransactionInMemory}), 200
 
+# Production Serving - SERVER_MODE=gunicorn serves the app with gunicorn gthread workers instead of the Werkzeug development server.
+# Service state is initialized in the master before the fork, and the background threads are started again inside every worker
+# Reference: https://docs.gunicorn.org/en/stable/custom.html
+SERVER_MODE = os.environ.get("SERVER_MODE", "dev")
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "1"))
+WEB_THREADS = int(os.environ.get("WEB_THREADS", "32"))
+GRACEFUL_TIMEOUT = int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+
+def restartAfterFork(server, worker): # Threads do not survive fork, so the log listener, span exporter and anti-entropy are restarted
+    setupLogging()
+    if TRACING_ENABLED == 1:
+        Thread(target=exportSpans, daemon=True).start()
+    startAntiEntropy()
+
+def runServer(host, port, maxWorkers):
+    if SERVER_MODE != "gunicorn":
+        app.run(host=host, port=port, threaded=True)
+        return
+    from gunicorn.app.base import BaseApplication
+
+    class ProductionServer(BaseApplication):
+        def load_config(self):
+            workers = min(WEB_WORKERS, maxWorkers)
+            if workers < WEB_WORKERS:
+                logger.warning(f"WEB_WORKERS={WEB_WORKERS} capped to {workers} as the service state is held in process memory.")
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", WEB_THREADS)
+            self.cfg.set("graceful_timeout", GRACEFUL_TIMEOUT) # In-flight requests finish on SIGTERM before workers exit
+            self.cfg.set("post_fork", restartAfterFork)
+
+        def load(self):
+            return app
+
+    ProductionServer().run()
+
 # Reference: LAB 2 - Basic Order Service Implementation
 if __name__ == "__main__":
     try:
         max_transaction_num = orderLogInit()
         syncOnInit(max_transaction_num)
+        waitForSeals() # No segment is left half-sealed by the master's seal thread when the workers fork
         logger.info(f"Replica {REPLICA_ID}: Order log initialized and synchronization completed.")
     except Exception as e:
         logger.error(f"Replica {REPLICA_ID}: Error during initialization or synchronization: {e}")
         exit(1)
 
+    if SERVER_MODE != "gunicorn":
+        startAntiEntropy()
+
     try:
         logger.info(f"Replica {REPLICA_ID}: Server starting on {ORDER_HOST}:{ORDER_PORT}.")
-        app.run(host=ORDER_HOST, port=ORDER_PORT, threaded=True)
+        runServer(ORDER_HOST, ORDER_PORT, 1)
     except Exception as e:
         logger.error(f"Replica {REPLICA_ID}: Error while starting the Flask server: {e}")
         exit(1)
\ No newline at end of file
@@ -1,10 +1,62 @@
 # Importing the Required Libraries
-from flask import Flask, request, jsonify
-import logging, csv, os, requests
+from flask import Flask, request, jsonify, g
+import logging, csv, os, requests, threading, queue, json, time, random, atexit
+from logging.handlers import QueueHandler, QueueListener
+from threading import Thread
+from contextlib import contextmanager
 from rwlock import RWLock
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+# Logging - Request threads only enqueue log records, a QueueListener thread formats them (JSON by default) and writes to stderr.
+# Per-module levels come from LOG_LEVELS (e.g. "werkzeug=WARNING,__main__.hot=DEBUG") and hot-path logs are sampled at LOG_SAMPLE_RATE
+# Reference: https://docs.python.org/3/howto/logging-cookbook.html#dealing-with-handlers-that-block
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "werkzeug=WARNING")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+class SampleFilter(logging.Filter): # Keeps a fraction of the records below WARNING, warnings and errors always pass
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+def setupLogging():
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(logQueue)]
+    root.setLevel(LOG_LEVEL)
+    for entry in filter(None, LOG_LEVELS.split(",")):
+        name, _, level = entry.partition("=")
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+    listener = QueueListener(logQueue, handler)
+    listener.start()
+    atexit.register(listener.stop) # Flushes the queued records on shutdown
+    return listener
+
+setupLogging()
 logger = logging.getLogger(__name__)
+hot_logger = logging.getLogger(f"{__name__}.hot") # Per-request logs on the lookup/replication hot paths
+hot_logger.addFilter(SampleFilter(LOG_SAMPLE_RATE))
 
 # Reference: https://flask.palletsprojects.com/en/stable/quickstart/ 
 app = Flask(__name__)
@@ -19,6 +71,119 @@ CATALOG_FILE = "catalog.csv"
 catalog = {} # In-merory catalog
 catalog_lock = RWLock()
 
+# Distributed Tracing - W3C 'traceparent' header is propagated on every inter-service call, with one span per hop,
+# lock wait and disk write. Spans are exported in the background as JSON lines to TRACE_FILE or to a local collector
+# Reference: https://www.w3.org/TR/trace-context/
+TRACING_ENABLED = int(os.environ.get("TRACING_ENABLED", "0"))
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces_catalog.jsonl")
+TRACE_COLLECTOR_URL = os.environ.get("TRACE_COLLECTOR_URL", "")
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "catalog-service")
+
+trace_context = threading.local()
+trace_queue = queue.Queue()
+
+def startSpan(name, **attributes):
+    parent = getattr(trace_context, "span", None)
+    span = {
+        "trace_id": parent["trace_id"] if parent else os.urandom(16).hex(),
+        "span_id": os.urandom(8).hex(),
+        "parent_span_id": parent["span_id"] if parent else None,
+        "service": TRACE_SERVICE_NAME,
+        "name": name,
+        "start_time_unix_nano": time.time_ns(),
+        "attributes": attributes,
+        "parent": parent
+    }
+    trace_context.span = span
+    return span
+
+def endSpan(span):
+    span["end_time_unix_nano"] = time.time_ns()
+    trace_context.span = span.pop("parent")
+    trace_queue.put(span)
+
+@contextmanager
+def traceSpan(name, **attributes):
+    if TRACING_ENABLED != 1:
+        yield None
+        return
+    span = startSpan(name, **attributes)
+    try:
+        yield span
+    finally:
+        endSpan(span)
+
+@contextmanager
+def tracedLock(lock, name): # Records the time spent waiting for the lock as its own span
+    with traceSpan(f"lock_wait {name}"):
+        lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+def traceHeaders():
+    span = getattr(trace_context, "span", None)
+    if TRACING_ENABLED != 1 or not span:
+        return {}
+    return {"traceparent": f"00-{span['trace_id']}-{span['span_id']}-01"}
+
+def tracedRequest(method, url, **kwargs): # Client span for a single hop, the callee records the matching server span
+    with traceSpan(f"HTTP {method.upper()}", url=url) as span:
+        kwargs["headers"] = {**kwargs.get("headers", {}), **traceHeaders()}
+        response = getattr(requests, method)(url, **kwargs)
+        if span:
+            span["attributes"]["status_code"] = response.status_code
+        return response
+
+def withTraceContext(target): # Carries the current span into a background thread
+    parent = getattr(trace_context, "span", None)
+    def run(*args, **kwargs):
+        trace_context.span = parent
+        return target(*args, **kwargs)
+    return run
+
+def exportSpans():
+    while True:
+        batch = [trace_queue.get()]
+        while not trace_queue.empty() and len(batch) < 100:
+            batch.append(trace_queue.get())
+        try:
+            if TRACE_COLLECTOR_URL:
+                requests.post(f"{TRACE_COLLECTOR_URL}/v1/traces", json={"spans": batch}, timeout=2)
+            else:
+                with open(TRACE_FILE, mode="a") as file:
+                    file.writelines(json.dumps(span) + "\n" for span in batch)
+        except Exception as e:
+            logger.warning(f"Dropped {len(batch)} spans during export: {e}")
+
+@app.before_request
+def startRequestSpan():
+    if TRACING_ENABLED != 1:
+        return
+    trace_context.span = None
+    parts = request.headers.get("traceparent", "").split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        trace_context.span = {"trace_id": parts[1], "span_id": parts[2]} # Remote parent from the calling service
+    g.trace_span = startSpan(f"{request.method} {request.url_rule.rule if request.url_rule else request.path}")
+
+@app.after_request
+def recordResponseStatus(response):
+    span = g.get("trace_span")
+    if span:
+        span["attributes"]["status_code"] = response.status_code
+    return response
+
+@app.teardown_request
+def endRequestSpan(error=None):
+    span = g.pop("trace_span", None)
+    if span:
+        endSpan(span)
+        trace_context.span = None
+
+if TRACING_ENABLED == 1:
+    Thread(target=exportSpans, daemon=True).start()
+
 def catalogInit():
     global catalog
     try:
@@ -52,7 +217,7 @@ def catalogInit():
 # Helper Functions - Load and save catalog to disk, notify for invalidation when stock is updated
 def loadCatalogToDisk(stockName=None):
     try:
-        with catalog_lock.writer_lock:
+        with tracedLock(catalog_lock.writer_lock, "catalog_lock.writer"), traceSpan("disk_write", file=CATALOG_FILE):
             if stockName:
                 try:
                     with open(CATALOG_FILE, mode="r") as file:
@@ -85,9 +250,9 @@ def loadCatalogToDisk(stockName=None):
 def notifyForInvalidation(stockName):
     try:
         # Frontend call to invalidate cache
-        response = requests.post(f"{FRONTEND_SERVICE_URL}/invalidate/{stockName}")
+        response = tracedRequest("post", f"{FRONTEND_SERVICE_URL}/invalidate/{stockName}")
         if response.status_code == 200:
-            logger.info(f"Invalidation of cache request sent. Stock Name: {stockName}")
+            hot_logger.info("Invalidation of cache request sent. Stock Name: %s", stockName)
         else:
             logger.info(f"Failed to invalidate cache for stock: {stockName}")
     except requests.RequestException as e:
@@ -96,11 +261,11 @@ def notifyForInvalidation(stockName):
 # API Endpoints - GET and POST for stock lookup and update stocks which is requested from frontend service        
 @app.route("/stocks/<stockName>", methods=["GET"])
 def stockLookup(stockName):
+    hot_logger.info("Looking for stock: %s", stockName)
     try:
-        with catalog_lock.reader_lock:
+        with tracedLock(catalog_lock.reader_lock, "catalog_lock.reader"):
             stock = catalog.get(stockName)
             if stock:
-                logger.info(f"Looking for stock: {stockName}")
                 return jsonify({
                     "name": stockName,
                     "price": stock["price"],
@@ -123,7 +288,7 @@ def stockUpdate(stockName):
         if not tradeType or not stockQuantity:
             return jsonify({"error": {"code": 400, "message": "Request Data is invalid"}}), 400
 
-        with catalog_lock.writer_lock:  # Acquire writer lock while update
+        with tracedLock(catalog_lock.writer_lock, "catalog_lock.writer"):  # Acquire writer lock while update
             stock = catalog.get(stockName)
             if not stock:
                 return jsonify({"error": {"code": 404, "message": "No stock found."}}), 404
@@ -147,6 +312,42 @@ def stockUpdate(stockName):
         logger.error(f"Error during stock update for {stockName}: {e}")
         return jsonify({"error": {"code": 500, "message": "Internal server error"}}), 500
 
+# Production Serving - SERVER_MODE=gunicorn serves the app with gunicorn gthread workers instead of the Werkzeug development server.
+# Service state is initialized in the master before the fork, and the background threads are started again inside every worker
+# Reference: https://docs.gunicorn.org/en/stable/custom.html
+SERVER_MODE = os.environ.get("SERVER_MODE", "dev")
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "1"))
+WEB_THREADS = int(os.environ.get("WEB_THREADS", "32"))
+GRACEFUL_TIMEOUT = int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+
+def restartAfterFork(server, worker): # Threads do not survive fork, so the log listener and span exporter are restarted
+    setupLogging()
+    if TRACING_ENABLED == 1:
+        Thread(target=exportSpans, daemon=True).start()
+
+def runServer(host, port, maxWorkers):
+    if SERVER_MODE != "gunicorn":
+        app.run(host=host, port=port, threaded=True)
+        return
+    from gunicorn.app.base import BaseApplication
+
+    class ProductionServer(BaseApplication):
+        def load_config(self):
+            workers = min(WEB_WORKERS, maxWorkers)
+            if workers < WEB_WORKERS:
+                logger.warning(f"WEB_WORKERS={WEB_WORKERS} capped to {workers} as the service state is held in process memory.")
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", WEB_THREADS)
+            self.cfg.set("graceful_timeout", GRACEFUL_TIMEOUT) # In-flight requests finish on SIGTERM before workers exit
+            self.cfg.set("post_fork", restartAfterFork)
+
+        def load(self):
+            return app
+
+    ProductionServer().run()
+
 if __name__ == "__main__":
     try:
         catalogInit()
@@ -156,7 +357,7 @@ if __name__ == "__main__":
         exit(1) 
 
     try:
-        app.run(host=CATALOG_HOST, port=CATALOG_PORT, threaded=True)
+        runServer(CATALOG_HOST, CATALOG_PORT, 1)
     except Exception as e:
         logger.error(f"Error while starting the Flask server: {e}")
         exit(1) 
\ No newline at end of file
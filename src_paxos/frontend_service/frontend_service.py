@@ -1,10 +1,62 @@
 # Importing the Required Libraries
-from flask import Flask, request
-import requests, os, logging, time, threading
+from flask import Flask, request, g
+import requests, os, logging, time, threading, queue, json, random, atexit
+from logging.handlers import QueueHandler, QueueListener
+from threading import Thread
 from collections import deque
+from contextlib import contextmanager
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+# Logging - Request threads only enqueue log records, a QueueListener thread formats them (JSON by default) and writes to stderr.
+# Per-module levels come from LOG_LEVELS (e.g. "werkzeug=WARNING,__main__.hot=DEBUG") and hot-path logs are sampled at LOG_SAMPLE_RATE
+# Reference: https://docs.python.org/3/howto/logging-cookbook.html#dealing-with-handlers-that-block
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "werkzeug=WARNING")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+class SampleFilter(logging.Filter): # Keeps a fraction of the records below WARNING, warnings and errors always pass
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+def setupLogging():
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(logQueue)]
+    root.setLevel(LOG_LEVEL)
+    for entry in filter(None, LOG_LEVELS.split(",")):
+        name, _, level = entry.partition("=")
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+    listener = QueueListener(logQueue, handler)
+    listener.start()
+    atexit.register(listener.stop) # Flushes the queued records on shutdown
+    return listener
+
+setupLogging()
 logger = logging.getLogger(__name__)
+hot_logger = logging.getLogger(f"{__name__}.hot") # Per-request logs on the lookup/replication hot paths
+hot_logger.addFilter(SampleFilter(LOG_SAMPLE_RATE))
 
 # LRU Cache Implementation to cache most used stocks, where the stocks are invalidated when catalog is updated using server-push technique
 # Reference: https://www.geeksforgeeks.org/lru-cache-implementation/
@@ -15,17 +67,17 @@ class LRUCache:
         self.capacity = capacity
         self.lock = threading.Lock() 
 
-    def get(self, key):
+    def get(self, key): # Logging happens after the lock is released
         with self.lock: 
-            if key in self.cache:
+            value = self.cache.get(key)
+            if value is not None:
                 self.access_order.remove(key)
                 self.access_order.append(key)
-                logger.info(f"Cache hit for key: {key}") 
-                return self.cache[key]
-            logger.info(f"Cache miss for key: {key}") 
-            return None
+        hot_logger.info("Cache %s for key: %s", "hit" if value is not None else "miss", key)
+        return value
 
     def put(self, key, value):
+        lru_key = None
         with self.lock:
             if key in self.cache:
                 self.cache[key] = value
@@ -35,16 +87,19 @@ class LRUCache:
                 if len(self.cache) >= self.capacity:
                     lru_key = self.access_order.popleft()
                     del self.cache[lru_key]
-                    logger.info(f"Evicted {lru_key} from cache due to capacity limit.")
                 self.cache[key] = value
                 self.access_order.append(key)
+        if lru_key is not None:
+            hot_logger.info("Evicted %s from cache due to capacity limit.", lru_key)
 
     def invalidate(self, key):
         with self.lock: 
-            if key in self.cache:
+            invalidated = key in self.cache
+            if invalidated:
                 del self.cache[key]
                 self.access_order.remove(key)
-                logger.info(f"Invalidated {key} from cache.")
+        if invalidated:
+            hot_logger.info("Invalidated %s from cache.", key)
 
 # Reference: https://flask.palletsprojects.com/en/stable/quickstart/ 
 app = Flask(__name__)
@@ -66,6 +121,119 @@ else:
     logger.info("Set to No Cache")
     cache = None
 
+# Distributed Tracing - W3C 'traceparent' header is propagated on every inter-service call, with one span per hop,
+# lock wait and disk write. Spans are exported in the background as JSON lines to TRACE_FILE or to a local collector
+# Reference: https://www.w3.org/TR/trace-context/
+TRACING_ENABLED = int(os.environ.get("TRACING_ENABLED", "0"))
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces_frontend.jsonl")
+TRACE_COLLECTOR_URL = os.environ.get("TRACE_COLLECTOR_URL", "")
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "frontend-service")
+
+trace_context = threading.local()
+trace_queue = queue.Queue()
+
+def startSpan(name, **attributes):
+    parent = getattr(trace_context, "span", None)
+    span = {
+        "trace_id": parent["trace_id"] if parent else os.urandom(16).hex(),
+        "span_id": os.urandom(8).hex(),
+        "parent_span_id": parent["span_id"] if parent else None,
+        "service": TRACE_SERVICE_NAME,
+        "name": name,
+        "start_time_unix_nano": time.time_ns(),
+        "attributes": attributes,
+        "parent": parent
+    }
+    trace_context.span = span
+    return span
+
+def endSpan(span):
+    span["end_time_unix_nano"] = time.time_ns()
+    trace_context.span = span.pop("parent")
+    trace_queue.put(span)
+
+@contextmanager
+def traceSpan(name, **attributes):
+    if TRACING_ENABLED != 1:
+        yield None
+        return
+    span = startSpan(name, **attributes)
+    try:
+        yield span
+    finally:
+        endSpan(span)
+
+@contextmanager
+def tracedLock(lock, name): # Records the time spent waiting for the lock as its own span
+    with traceSpan(f"lock_wait {name}"):
+        lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+def traceHeaders():
+    span = getattr(trace_context, "span", None)
+    if TRACING_ENABLED != 1 or not span:
+        return {}
+    return {"traceparent": f"00-{span['trace_id']}-{span['span_id']}-01"}
+
+def tracedRequest(method, url, **kwargs): # Client span for a single hop, the callee records the matching server span
+    with traceSpan(f"HTTP {method.upper()}", url=url) as span:
+        kwargs["headers"] = {**kwargs.get("headers", {}), **traceHeaders()}
+        response = getattr(requests, method)(url, **kwargs)
+        if span:
+            span["attributes"]["status_code"] = response.status_code
+        return response
+
+def withTraceContext(target): # Carries the current span into a background thread
+    parent = getattr(trace_context, "span", None)
+    def run(*args, **kwargs):
+        trace_context.span = parent
+        return target(*args, **kwargs)
+    return run
+
+def exportSpans():
+    while True:
+        batch = [trace_queue.get()]
+        while not trace_queue.empty() and len(batch) < 100:
+            batch.append(trace_queue.get())
+        try:
+            if TRACE_COLLECTOR_URL:
+                requests.post(f"{TRACE_COLLECTOR_URL}/v1/traces", json={"spans": batch}, timeout=2)
+            else:
+                with open(TRACE_FILE, mode="a") as file:
+                    file.writelines(json.dumps(span) + "\n" for span in batch)
+        except Exception as e:
+            logger.warning(f"Dropped {len(batch)} spans during export: {e}")
+
+@app.before_request
+def startRequestSpan():
+    if TRACING_ENABLED != 1:
+        return
+    trace_context.span = None
+    parts = request.headers.get("traceparent", "").split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        trace_context.span = {"trace_id": parts[1], "span_id": parts[2]} # Remote parent from the calling service
+    g.trace_span = startSpan(f"{request.method} {request.url_rule.rule if request.url_rule else request.path}")
+
+@app.after_request
+def recordResponseStatus(response):
+    span = g.get("trace_span")
+    if span:
+        span["attributes"]["status_code"] = response.status_code
+    return response
+
+@app.teardown_request
+def endRequestSpan(error=None):
+    span = g.pop("trace_span", None)
+    if span:
+        endSpan(span)
+        trace_context.span = None
+
+if TRACING_ENABLED == 1:
+    Thread(target=exportSpans, daemon=True).start()
+
 # Helper functions - 3 Order Service Replicas are created and one of them is Elected as Leader, and the Leader is notified to all other replicas
 def findLeader():
     global LEADER_URL
@@ -73,7 +241,7 @@ def findLeader():
     for url in sorted(ORDER_SERVICE_URLS, reverse=True):
         logger.info(f"Pinging Order Service Replica at {url}")
         try:
-            response = requests.get(f"{url}/ping", timeout=5)
+            response = tracedRequest("get", f"{url}/ping", timeout=5)
             if response.status_code == 200:
                 LEADER_URL = url
                 logger.info(f"Leader selected: {LEADER_URL}")
@@ -87,7 +255,7 @@ def findLeader():
 def notifyOrderServiceReplicas(leader_url):
     for url in ORDER_SERVICE_URLS:
         try:
-            response = requests.post(f"{url}/set_leader", json={"leader_id": leader_url}, timeout=5)
+            response = tracedRequest("post", f"{url}/set_leader", json={"leader_id": leader_url}, timeout=5)
             if response.status_code == 200:
                 logger.info(f"Replica at {url} notified about the leader chosen: {leader_url}")
             else:
@@ -103,7 +271,7 @@ def orderHandler(order_data, max_retries=3):
     for attempt in range(max_retries):
         try:
             # STEP - 1: Check leadership & readiness    
-            resp = requests.get(f"{LEADER_URL}/ping", timeout=5)
+            resp = tracedRequest("get", f"{LEADER_URL}/ping", timeout=5)
             if resp.status_code != 200:
                 raise requests.RequestException("ping failed")
             if not resp.json().get("recovery_done", True):
@@ -112,7 +280,7 @@ def orderHandler(order_data, max_retries=3):
                 continue
 
             # STEP - 2: Try to post the order
-            resp = requests.post(f"{LEADER_URL}/orders", json=order_data, timeout=5) 
+            resp = tracedRequest("post", f"{LEADER_URL}/orders", json=order_data, timeout=5) 
             if resp.status_code == 503 and resp.json().get("error", {}).get("message") == "Leader initializing":
                 logger.info(f"Leader {LEADER_URL} still initializing, retrying...")
                 time.sleep(0.5)
@@ -133,10 +301,10 @@ def queryOrderHandler(order_number, max_retries=3): # Helper function to Query t
         findLeader()
     for attempt in range(max_retries):
         try:
-            response = requests.get(f"{LEADER_URL}/ping", timeout=5)
+            response = tracedRequest("get", f"{LEADER_URL}/ping", timeout=5)
             if response.status_code != 200:
                 raise requests.RequestException("Leader unresponsive")
-            response = requests.get(f"{LEADER_URL}/orders/{order_number}", timeout=5)
+            response = tracedRequest("get", f"{LEADER_URL}/orders/{order_number}", timeout=5)
             return response.json(), response.status_code
         except requests.RequestException as e:
             logger.info(f"Re-Selecting the Leader as, Leader at {LEADER_URL} is unresponsive. Attempt Number: {attempt+1}")
@@ -149,25 +317,22 @@ def queryOrderHandler(order_number, max_retries=3): # Helper function to Query t
 @app.route('/stocks/<stock_name>', methods=['GET'])
 def lookup(stock_name):
     if CACHE_ENABLED == 1:
-        logger.info("Cache enabled lookup")
         cached_data = cache.get(stock_name)
     else:
-        logger.info("No Cache enabled lookup")
         cached_data = None
     if cached_data:
-        logger.info(f"Cache hit: {stock_name}")
         return {
             "message": "Lookup successful",
             "data": cached_data
         }, 200
 
     try:
-        response = requests.get(f"{CATALOG_SERVICE_URL}/stocks/{stock_name}")
+        response = tracedRequest("get", f"{CATALOG_SERVICE_URL}/stocks/{stock_name}")
         if response.status_code == 200:
             data = response.json()
             if CACHE_ENABLED == 1:
                 cache.put(stock_name, data)
-                logger.info(f"Cache miss: {stock_name}. Adding to cache.")
+                hot_logger.info("Cache miss: %s. Adding to cache.", stock_name)
             return {
                 "message": "Lookup Successful",
                 "data": data
@@ -180,7 +345,7 @@ def lookup(stock_name):
 @app.route('/invalidate/<stock_name>', methods=['POST'])
 def invalidate(stock_name):
     cache.invalidate(stock_name)
-    logger.info(f"Cache invalidated: {stock_name}")
+    hot_logger.info("Cache invalidated: %s", stock_name)
     return {"message": f"Cache invalidated: {stock_name}"}, 200
 
 @app.route('/orders', methods=['POST'])
@@ -213,6 +378,42 @@ def get_order(order_number):
     else:
         return {"error": {"code": status_code, "message": response.get("error", "An error occurred")}}, status_code
 
+# Production Serving - SERVER_MODE=gunicorn serves the app with gunicorn gthread workers instead of the Werkzeug development server.
+# Service state is initialized in the master before the fork, and the background threads are started again inside every worker
+# Reference: https://docs.gunicorn.org/en/stable/custom.html
+SERVER_MODE = os.environ.get("SERVER_MODE", "dev")
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "1"))
+WEB_THREADS = int(os.environ.get("WEB_THREADS", "32"))
+GRACEFUL_TIMEOUT = int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+
+def restartAfterFork(server, worker): # Threads do not survive fork, so the log listener and span exporter are restarted
+    setupLogging()
+    if TRACING_ENABLED == 1:
+        Thread(target=exportSpans, daemon=True).start()
+
+def runServer(host, port, maxWorkers):
+    if SERVER_MODE != "gunicorn":
+        app.run(host=host, port=port, threaded=True)
+        return
+    from gunicorn.app.base import BaseApplication
+
+    class ProductionServer(BaseApplication):
+        def load_config(self):
+            workers = min(WEB_WORKERS, maxWorkers)
+            if workers < WEB_WORKERS:
+                logger.warning(f"WEB_WORKERS={WEB_WORKERS} capped to {workers} as the service state is held in process memory.")
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", WEB_THREADS)
+            self.cfg.set("graceful_timeout", GRACEFUL_TIMEOUT) # In-flight requests finish on SIGTERM before workers exit
+            self.cfg.set("post_fork", restartAfterFork)
+
+        def load(self):
+            return app
+
+    ProductionServer().run()
+
 # Reference: https://stackoverflow.com/questions/38876721/handle-flask-requests-concurrently-with-threaded-true
 if __name__ == "__main__":
     try:
@@ -222,7 +423,7 @@ if __name__ == "__main__":
         exit(1)
 
     try:
-        app.run(host=FRONTEND_HOST, port=FRONT_END_PORT, threaded=True)
+        runServer(FRONTEND_HOST, FRONT_END_PORT, WEB_WORKERS if CACHE_ENABLED != 1 else 1)
     except Exception as e:
         logger.error(f"Error while starting the Flask server: {e}")
         exit(1)
\ No newline at end of file
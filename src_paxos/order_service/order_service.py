@@ -1,10 +1,61 @@
 # Importint the Required libraries
-from flask import Flask, request, jsonify
-import requests, logging, csv, os, threading, time
+from flask import Flask, request, jsonify, g
+import requests, logging, csv, os, threading, time, queue, json, random, atexit
+from logging.handlers import QueueHandler, QueueListener
 from threading import Thread
+from contextlib import contextmanager
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+# Logging - Request threads only enqueue log records, a QueueListener thread formats them (JSON by default) and writes to stderr.
+# Per-module levels come from LOG_LEVELS (e.g. "werkzeug=WARNING,__main__.hot=DEBUG") and hot-path logs are sampled at LOG_SAMPLE_RATE
+# Reference: https://docs.python.org/3/howto/logging-cookbook.html#dealing-with-handlers-that-block
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "werkzeug=WARNING")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+class SampleFilter(logging.Filter): # Keeps a fraction of the records below WARNING, warnings and errors always pass
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+def setupLogging():
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(logQueue)]
+    root.setLevel(LOG_LEVEL)
+    for entry in filter(None, LOG_LEVELS.split(",")):
+        name, _, level = entry.partition("=")
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+    listener = QueueListener(logQueue, handler)
+    listener.start()
+    atexit.register(listener.stop) # Flushes the queued records on shutdown
+    return listener
+
+setupLogging()
 logger = logging.getLogger(__name__)
+hot_logger = logging.getLogger(f"{__name__}.hot") # Per-request logs on the lookup/replication hot paths
+hot_logger.addFilter(SampleFilter(LOG_SAMPLE_RATE))
 
 # Reference: https://www.geeksforgeeks.org/lru-cache-implementation/
 app = Flask(__name__)
@@ -31,13 +82,126 @@ ORDER_LOG_FILE = f"order_log_{REPLICA_ID}.csv"
 SELF_URL = f"http://order-service-paxos-{REPLICA_ID}:{ORDER_PORT}"
 LEADER_ID = None
 
+# Distributed Tracing - W3C 'traceparent' header is propagated on every inter-service call, with one span per hop,
+# lock wait and disk write. Spans are exported in the background as JSON lines to TRACE_FILE or to a local collector
+# Reference: https://www.w3.org/TR/trace-context/
+TRACING_ENABLED = int(os.environ.get("TRACING_ENABLED", "0"))
+TRACE_FILE = os.environ.get("TRACE_FILE", "traces_order.jsonl")
+TRACE_COLLECTOR_URL = os.environ.get("TRACE_COLLECTOR_URL", "")
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", f"order-service-{REPLICA_ID}")
+
+trace_context = threading.local()
+trace_queue = queue.Queue()
+
+def startSpan(name, **attributes):
+    parent = getattr(trace_context, "span", None)
+    span = {
+        "trace_id": parent["trace_id"] if parent else os.urandom(16).hex(),
+        "span_id": os.urandom(8).hex(),
+        "parent_span_id": parent["span_id"] if parent else None,
+        "service": TRACE_SERVICE_NAME,
+        "name": name,
+        "start_time_unix_nano": time.time_ns(),
+        "attributes": attributes,
+        "parent": parent
+    }
+    trace_context.span = span
+    return span
+
+def endSpan(span):
+    span["end_time_unix_nano"] = time.time_ns()
+    trace_context.span = span.pop("parent")
+    trace_queue.put(span)
+
+@contextmanager
+def traceSpan(name, **attributes):
+    if TRACING_ENABLED != 1:
+        yield None
+        return
+    span = startSpan(name, **attributes)
+    try:
+        yield span
+    finally:
+        endSpan(span)
+
+@contextmanager
+def tracedLock(lock, name): # Records the time spent waiting for the lock as its own span
+    with traceSpan(f"lock_wait {name}"):
+        lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+def traceHeaders():
+    span = getattr(trace_context, "span", None)
+    if TRACING_ENABLED != 1 or not span:
+        return {}
+    return {"traceparent": f"00-{span['trace_id']}-{span['span_id']}-01"}
+
+def tracedRequest(method, url, **kwargs): # Client span for a single hop, the callee records the matching server span
+    with traceSpan(f"HTTP {method.upper()}", url=url) as span:
+        kwargs["headers"] = {**kwargs.get("headers", {}), **traceHeaders()}
+        response = getattr(requests, method)(url, **kwargs)
+        if span:
+            span["attributes"]["status_code"] = response.status_code
+        return response
+
+def withTraceContext(target): # Carries the current span into a background thread
+    parent = getattr(trace_context, "span", None)
+    def run(*args, **kwargs):
+        trace_context.span = parent
+        return target(*args, **kwargs)
+    return run
+
+def exportSpans():
+    while True:
+        batch = [trace_queue.get()]
+        while not trace_queue.empty() and len(batch) < 100:
+            batch.append(trace_queue.get())
+        try:
+            if TRACE_COLLECTOR_URL:
+                requests.post(f"{TRACE_COLLECTOR_URL}/v1/traces", json={"spans": batch}, timeout=2)
+            else:
+                with open(TRACE_FILE, mode="a") as file:
+                    file.writelines(json.dumps(span) + "\n" for span in batch)
+        except Exception as e:
+            logger.warning(f"Dropped {len(batch)} spans during export: {e}")
+
+@app.before_request
+def startRequestSpan():
+    if TRACING_ENABLED != 1:
+        return
+    trace_context.span = None
+    parts = request.headers.get("traceparent", "").split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        trace_context.span = {"trace_id": parts[1], "span_id": parts[2]} # Remote parent from the calling service
+    g.trace_span = startSpan(f"{request.method} {request.url_rule.rule if request.url_rule else request.path}")
+
+@app.after_request
+def recordResponseStatus(response):
+    span = g.get("trace_span")
+    if span:
+        span["attributes"]["status_code"] = response.status_code
+    return response
+
+@app.teardown_request
+def endRequestSpan(error=None):
+    span = g.pop("trace_span", None)
+    if span:
+        endSpan(span)
+        trace_context.span = None
+
+if TRACING_ENABLED == 1:
+    Thread(target=exportSpans, daemon=True).start()
+
 # Helper Functions to manage the order log and synchronization which is used in the API endpoints to process the order requests from frontend service
 # This includes the order log initialization, loading orders to memory and disk, and appending missing orders from other replicas
 def getAllReplicas():
     return [f"http://order-service-paxos-{i}:{8997 + i}" for i in range(1, TOTAL_REPLICAS + 1)]
 
 def loadOrderToDisk(order):
-    with order_log_lock:
+    with tracedLock(order_log_lock, "order_log_lock"), traceSpan("disk_write", file=ORDER_LOG_FILE):
         try:
             if not all(k in order for k in ["transaction_number", "stock_name", "type", "quantity"]):
                 logger.error(f"Replica {REPLICA_ID}: Invalid order data provided for disk write: {order}")
@@ -52,7 +216,7 @@ def loadOrderToDisk(order):
 
 # Reference: https://docs.python.org/3/library/csv.html
 def loadOrderToMemory(order):
-    with orders_list_lock:
+    with tracedLock(orders_list_lock, "orders_list_lock"):
         if any(orderData["transaction_number"] == order["transaction_number"] for orderData in ordersList):
             return False
         ordersList.append(order)
@@ -63,7 +227,7 @@ def appendMissingOrders(maxTransaction):
     for url in getAllReplicas():
         if url == SELF_URL: continue
         try:
-            response = requests.get(f"{url}/get_missing_orders/{maxTransaction}", timeout = 5)
+            response = tracedRequest("get", f"{url}/get_missing_orders/{maxTransaction}", timeout = 5)
             if response.status_code == 200:
                 # Appending missing orders
                 fetchedOrders.extend(response.json().get("data", []))
@@ -113,7 +277,7 @@ def recover():
         for url in getAllReplicas():
             if url == SELF_URL: continue
             try:
-                response = requests.get(f"{url}/max_transaction", timeout = 2)
+                response = tracedRequest("get", f"{url}/max_transaction", timeout = 2)
                 if response.status_code==200:
                     currentMaxTransaction = max(currentMaxTransaction, response.json().get("max_transaction", -1))
             except:
@@ -179,7 +343,7 @@ def setLeader():
     logger.info(f"Leader changed from {prevLeader} ➔ {LEADER_ID}")
     leaderRecoveryCompleted = False
     if LEADER_ID == SELF_URL and prevLeader != SELF_URL:
-        Thread(target=recover, daemon=True).start()
+        Thread(target=withTraceContext(recover), daemon=True).start()
     else:
         leaderRecoveryCompleted = True
     return jsonify(message=f"Leader set to {LEADER_ID}")
@@ -194,11 +358,11 @@ def processOrder():
     if not stockName or tradeType not in ("buy","sell") or not isinstance(quantity,int) or quantity <= 0:
         return jsonify(error={"code":400,"message":"Invalid data"}),400
     try:
-        getResponse = requests.get(f"{CATALOG_SERVICE_URL}/stocks/{stockName}", timeout = 5)
+        getResponse = tracedRequest("get", f"{CATALOG_SERVICE_URL}/stocks/{stockName}", timeout = 5)
         getResponse.raise_for_status()
         if tradeType=="buy" and quantity > getResponse.json().get("quantity",0):
             return jsonify(error={"code":400,"message":"Insufficient stock"}),400
-        postResponse = requests.post(
+        postResponse = tracedRequest("post",
             f"{CATALOG_SERVICE_URL}/stocks/{stockName}",
             json={"type":tradeType,"quantity":quantity},
             timeout = 5
@@ -214,7 +378,7 @@ def processOrder():
     for url in getAllReplicas():
         if url==SELF_URL: continue
         try:
-            response = requests.post(f"{url}/paxos/prepare",json={"proposal_number":pid}, timeout = 2)
+            response = tracedRequest("post", f"{url}/paxos/prepare",json={"proposal_number":pid}, timeout = 2)
             if response.ok and response.json().get("promise"):
                 promises+=1
         except: pass
@@ -225,13 +389,13 @@ def processOrder():
     for url in getAllReplicas():
         if url==SELF_URL: continue
         try:
-            response = requests.post(f"{url}/paxos/accept", json={"proposal_number":pid,"value":orderData}, timeout = 2)
+            response = tracedRequest("post", f"{url}/paxos/accept", json={"proposal_number":pid,"value":orderData}, timeout = 2)
             if response.ok and response.json().get("accepted"):
                 accepts+=1
         except: pass
     if accepts < majorityAcceptors:
         return jsonify(error={"code":500,"message":"Failed accepts"}),500
-    with transaction_lock:
+    with tracedLock(transaction_lock, "transaction_lock"):
         transactionNum = transactionNumber
         transactionNumber += 1
     order = {
@@ -247,9 +411,9 @@ def processOrder():
     def replicate(orderToBeReplicated):
         for url in getAllReplicas():
             if url==SELF_URL: continue
-            try: requests.post(f"{url}/replicate_order",json=orderToBeReplicated, timeout = 2)
+            try: tracedRequest("post", f"{url}/replicate_order",json=orderToBeReplicated, timeout = 2)
             except: pass
-    Thread(target=replicate,args=(order,),daemon=True).start()
+    Thread(target=withTraceContext(replicate),args=(order,),daemon=True).start()
     
     return jsonify(data={"transaction_number":transactionNum})
 
@@ -294,6 +458,42 @@ def maxTransaction():
         logger.error(f"Replica {REPLICA_ID}: Error while calculating max transaction: {e}")
         return jsonify({"error": {"code": 500, "message": "Internal server error"}}), 500
 
+# Production Serving - SERVER_MODE=gunicorn serves the app with gunicorn gthread workers instead of the Werkzeug development server.
+# Service state is initialized in the master before the fork, and the background threads are started again inside every worker
+# Reference: https://docs.gunicorn.org/en/stable/custom.html
+SERVER_MODE = os.environ.get("SERVER_MODE", "dev")
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "1"))
+WEB_THREADS = int(os.environ.get("WEB_THREADS", "32"))
+GRACEFUL_TIMEOUT = int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+
+def restartAfterFork(server, worker): # Threads do not survive fork, so the log listener and span exporter are restarted
+    setupLogging()
+    if TRACING_ENABLED == 1:
+        Thread(target=exportSpans, daemon=True).start()
+
+def runServer(host, port, maxWorkers):
+    if SERVER_MODE != "gunicorn":
+        app.run(host=host, port=port, threaded=True)
+        return
+    from gunicorn.app.base import BaseApplication
+
+    class ProductionServer(BaseApplication):
+        def load_config(self):
+            workers = min(WEB_WORKERS, maxWorkers)
+            if workers < WEB_WORKERS:
+                logger.warning(f"WEB_WORKERS={WEB_WORKERS} capped to {workers} as the service state is held in process memory.")
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", WEB_THREADS)
+            self.cfg.set("graceful_timeout", GRACEFUL_TIMEOUT) # In-flight requests finish on SIGTERM before workers exit
+            self.cfg.set("post_fork", restartAfterFork)
+
+        def load(self):
+            return app
+
+    ProductionServer().run()
+
 # Reference: LAB 2  - Order Service Reference to implement the basic structure of the order service
 if __name__ == "__main__":
     try:
@@ -305,7 +505,7 @@ if __name__ == "__main__":
 
     try:
         logger.info(f"Replica {REPLICA_ID} starting on port {ORDER_PORT}")
-        app.run(host=ORDER_HOST, port=ORDER_PORT, threaded=True)
+        runServer(ORDER_HOST, ORDER_PORT, 1)
     except Exception as e:
         logger.error(f"Replica {REPLICA_ID}: Error while starting the Flask server: {e}")
         exit(1)
\ No newline at end of file
@@ -1,5 +1,8 @@
 # Importing required libraries
-import unittest, json, os, logging
+import unittest, tempfile, shutil, json, os, logging, multiprocessing, threading
+from unittest.mock import patch
+import numpy as np
+from src.catalog_service import catalog_service as svc
 from src.catalog_service.catalog_service import app, catalogInit, CATALOG_FILE
 
 logging.basicConfig(
@@ -94,5 +97,130 @@ class CatalogServiceTest(unittest.TestCase):
         err = rv.get_json()['error']
         self.assertEqual(err['code'], 404)
 
+    @patch('src.catalog_service.catalog_service.app.run')
+    def test_08_devServerMode(self, mock_run):
+        logger.info("-----Test 8: Default server mode runs the threaded development server-----")
+        svc.runServer("0.0.0.0", 8997, 1)
+        mock_run.assert_called_once_with(host="0.0.0.0", port=8997, threaded=True)
+
+    def test_09_gunicornServerMode(self):
+        logger.info("-----Test 9: gunicorn mode uses gthread workers, capped to the supported worker count-----")
+        from gunicorn.app.base import BaseApplication
+        configs = []
+        with patch.object(svc, 'SERVER_MODE', 'gunicorn'), patch.object(svc, 'WEB_WORKERS', 4), \
+             patch.object(BaseApplication, 'run', lambda server: configs.append(server.cfg)):
+            svc.runServer("0.0.0.0", 8997, 1)
+        self.assertEqual(configs[0].worker_class_str, 'gthread')
+        self.assertEqual(configs[0].workers, 1)
+        self.assertEqual(configs[0].threads, svc.WEB_THREADS)
+        self.assertEqual(configs[0].bind, ['0.0.0.0:8997'])
+
+    def test_10_sharedStockTableAcrossProcesses(self):
+        logger.info("-----Test 10: Shared-memory stock table updates are visible to forked worker processes-----")
+        table = svc.SharedStockTable({"APPL": {"price": 150.0, "quantity": 100}, "IBM": {"price": 100.0, "quantity": 100}})
+        worker = multiprocessing.get_context("fork").Process(target=table.trade, args=("IBM", "buy", 7))
+        worker.start()
+        worker.join()
+        self.assertEqual(table.get("IBM"), {"price": 100.0, "quantity": 93})
+        self.assertEqual(table.trade("APPL", "sell", 5), 105)
+        self.assertIsNone(table.get("NoSuchStock"))
+        self.assertIsNone(table.trade("NoSuchStock", "buy", 1))
+
+    def test_11_sharedBackendRoutes(self):
+        logger.info("-----Test 11: Lookup and trade routes on the shared-memory backend-----")
+        os.remove(CATALOG_FILE)
+        with patch.object(svc, 'CATALOG_BACKEND', 'shared'):
+            catalogInit()
+        self.assertIsInstance(svc.catalog, svc.SharedStockTable)
+        rv = self.client.post('/stocks/GOOG', data=json.dumps({"type": "buy", "quantity": 3}), content_type='application/json')
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(self.client.get('/stocks/GOOG').get_json()['quantity'], 97)
+        with open(CATALOG_FILE) as file:
+            self.assertIn("GOOG,280.0,97", file.read())
+
+    def test_12_bulkStockList(self):
+        logger.info("-----Test 12: 'GET /stocks' returns every stock in the catalog-----")
+        rv = self.client.get('/stocks')
+        self.assertEqual(rv.status_code, 200)
+        stocks = {stock['name']: stock for stock in rv.get_json()['stocks']}
+        self.assertEqual(stocks['APPL']['quantity'], 100)
+        self.assertEqual(len(stocks), len(svc.catalog.items()))
+
+    def test_13_catalogSnapshot(self):
+        logger.info("-----Test 13: The catalog starts from a memory-mapped snapshot until the CSV changes-----")
+        snapshotDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, snapshotDir)
+        self.client.post('/stocks/GOOG', data=json.dumps({"type": "buy", "quantity": 3}), content_type='application/json')
+        with patch.object(svc, 'CATALOG_SNAPSHOT_DIR', snapshotDir):
+            self.assertEqual(svc.writeCatalogSnapshot(), 10)
+            symbols, prices, quantities = svc.readCatalogSnapshot()
+            self.assertIsInstance(quantities, np.memmap)
+            for backend in ('local', 'shared'):
+                with patch.object(svc, 'CATALOG_BACKEND', backend), patch.object(svc.csv, 'DictReader', side_effect=AssertionError('CSV parsed')):
+                    catalogInit()
+                self.assertEqual(svc.catalog.get('GOOG'), {"price": 280.0, "quantity": 97})
+            self.client.post('/stocks/GOOG', data=json.dumps({"type": "buy", "quantity": 90}), content_type='application/json')
+            self.assertIsNone(svc.readCatalogSnapshot()) # The CSV changed after the conversion
+            os.remove(CATALOG_FILE)
+            catalogInit()
+            self.assertEqual(svc.catalog.get('GOOG')['quantity'], 97)
+            self.assertTrue(os.path.exists(CATALOG_FILE))
+
+    def test_14_preSerializedLookups(self):
+        logger.info("-----Test 14: Lookup bodies are serialized once per stock version, also across worker processes-----")
+        for table in (svc.LocalStockTable, svc.SharedStockTable):
+            stocks = table({"IBM": {"price": 100.0, "quantity": 100}})
+            body = stocks.response("IBM")
+            self.assertEqual(json.loads(body), {"name": "IBM", "price": 100.0, "quantity": 100})
+            self.assertIs(stocks.response("IBM"), body)
+            self.assertIsNone(stocks.response("NoSuchStock"))
+            if table is svc.SharedStockTable:
+                worker = multiprocessing.get_context("fork").Process(target=stocks.trade, args=("IBM", "buy", 4))
+                worker.start()
+                worker.join()
+            else:
+                stocks.trade("IBM", "buy", 4)
+            self.assertEqual(json.loads(stocks.response("IBM"))["quantity"], 96)
+
+    def test_15_partitionedCatalog(self):
+        logger.info("-----Test 15: A catalog partition only loads and trades the stocks it owns-----")
+        owned = {'GOOG', 'AMZN', 'AMD'} # CRC-32 % 2 == 0
+        with patch.object(svc, 'CATALOG_PARTITIONS', 2), patch.object(svc, 'CATALOG_PARTITION', 0), patch.object(svc, 'CATALOG_SNAPSHOT', 0):
+            catalogInit() # The full catalog file of test set-up, only the owned rows are loaded
+            self.assertEqual({stockName for stockName, _ in svc.catalog.items()}, owned)
+            self.assertEqual(self.client.get('/stocks/GOOG').status_code, 200)
+            rv = self.client.get('/stocks/APPL')
+            self.assertEqual(rv.status_code, 421)
+            self.assertIn('partition 1', rv.get_json()['error']['message'])
+            rv = self.client.post('/stocks/APPL', data=json.dumps({"type": "buy", "quantity": 1}), content_type='application/json')
+            self.assertEqual(rv.status_code, 421)
+            self.assertEqual(self.client.get('/stocks/NoSuchStock').status_code, 421 if svc.catalogPartition('NoSuchStock', 2) else 404)
+            os.remove(CATALOG_FILE)
+            catalogInit()
+            with open(CATALOG_FILE) as file:
+                self.assertEqual({row.split(',')[0] for row in file.read().split()[1:]}, owned)
+
+    def test_16_snapshotRefresh(self):
+        logger.info("-----Test 16: The snapshot is converted again in the background after trades change the CSV-----")
+        snapshotDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, snapshotDir)
+        stop = threading.Event()
+        with patch.object(svc, 'CATALOG_SNAPSHOT_DIR', snapshotDir), patch.object(svc, 'CATALOG_SNAPSHOT_INTERVAL', 0.01):
+            svc.writeCatalogSnapshot()
+            self.client.post('/stocks/GOOG', data=json.dumps({"type": "buy", "quantity": 3}), content_type='application/json')
+            self.assertIsNone(svc.readCatalogSnapshot()) # Stale until the refresh converts the CSV again
+            refresher = threading.Thread(target=svc.refreshCatalogSnapshot, args=(stop,))
+            refresher.start()
+            try:
+                for _ in range(500):
+                    if svc.readCatalogSnapshot() is not None:
+                        break
+                    threading.Event().wait(0.01)
+            finally:
+                stop.set()
+                refresher.join()
+            symbols, _, quantities = svc.readCatalogSnapshot()
+            self.assertEqual(int(quantities[list(symbols).index('GOOG')]), svc.catalog.get('GOOG')['quantity'])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,6 +1,11 @@
 # Importing the required libraries
-import unittest, logging, requests
-from unittest.mock import patch
+import unittest, logging, requests, json, aiohttp, asyncio, threading, os, tempfile, multiprocessing
+from unittest.mock import patch, MagicMock, AsyncMock
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer
+from aiohttp.test_utils import TestClient, TestServer
+from src.frontend_service import frontend_service as svc
 from src.frontend_service.frontend_service import (
     app, cache,
     orderHandler, queryOrderHandler
@@ -18,6 +23,9 @@ class FrontendServiceTest(unittest.TestCase):
         logger.info("setUp: Clearing cache and resetting test client")
         cache.cache.clear()
         cache.access_order.clear()
+        cache.bodies.clear()
+        svc.negative_cache.entries.clear()
+        svc.order_cache.entries.clear()
         self.client = app.test_client()
 
     def test_01_lookupThroughCatalog(self):
@@ -105,5 +113,578 @@ class FrontendServiceTest(unittest.TestCase):
         err = rv.get_json()['error']
         self.assertEqual(err['code'], 404)
 
+    @patch('src.frontend_service.frontend_service.requests.get')
+    def test_09_traceContextPropagation(self, mock_get):
+        logger.info("-----Test 9: 'traceparent' is propagated to the Catalog hop and spans are recorded-----")
+        mock_get.return_value = MagicMock(status_code=200, content=json.dumps({"name": "TRACE", "price": 1.0, "quantity": 1}).encode())
+        svc.TRACING_ENABLED = 1
+        try:
+            rv = self.client.get('/stocks/TRACE', headers={'traceparent': '00-' + 'a' * 32 + '-' + 'b' * 16 + '-01'})
+        finally:
+            svc.TRACING_ENABLED = 0
+        self.assertEqual(rv.status_code, 200)
+        outgoing = mock_get.call_args.kwargs['headers']['traceparent']
+        self.assertTrue(outgoing.startswith('00-' + 'a' * 32 + '-'))
+        spans = []
+        while not svc.trace_queue.empty():
+            spans.append(svc.trace_queue.get())
+        serverSpan = next(span for span in spans if span['name'] == 'GET /stocks/<stock_name>')
+        clientSpan = next(span for span in spans if span['name'] == 'HTTP GET')
+        self.assertEqual(serverSpan['parent_span_id'], 'b' * 16)
+        self.assertEqual(clientSpan['parent_span_id'], serverSpan['span_id'])
+        self.assertEqual(outgoing.split('-')[2], clientSpan['span_id'])
+        self.assertEqual(clientSpan['attributes']['status_code'], 200)
+
+    def test_10_sampledJsonLogging(self):
+        logger.info("-----Test 10: Hot-path records are sampled and formatted as JSON-----")
+        record = logging.LogRecord("svc.hot", logging.INFO, __file__, 1, "Cache hit for key: %s", ("APPL",), None)
+        warning = logging.LogRecord("svc.hot", logging.WARNING, __file__, 1, "Slow lookup", (), None)
+        self.assertFalse(svc.SampleFilter(0.0).filter(record))
+        self.assertTrue(svc.SampleFilter(1.0).filter(record))
+        self.assertTrue(svc.SampleFilter(0.0).filter(warning))
+        entry = json.loads(svc.JsonFormatter().format(record))
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['logger'], 'svc.hot')
+        self.assertEqual(entry['message'], 'Cache hit for key: APPL')
+
+    @patch('src.frontend_service.frontend_service.requests.get')
+    def test_11_singleFlightLookup(self, mock_get):
+        logger.info("-----Test 11: Concurrent cache misses for one stock share a single Catalog fetch-----")
+        release = threading.Event()
+        def slowCatalog(*args, **kwargs):
+            release.wait(5)
+            return MagicMock(status_code=200, content=json.dumps({"name": "HOT", "price": 10.0, "quantity": 100}).encode())
+        mock_get.side_effect = slowCatalog
+        results, coalesced = [], svc.lookup_flights.coalesced
+        def lookupHot():
+            results.append(app.test_client().get('/stocks/HOT').status_code)
+        threads = [threading.Thread(target=lookupHot) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        while svc.lookup_flights.coalesced < coalesced + 7 and not release.wait(0.01):
+            pass
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [200] * 8)
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertIsNotNone(cache.get('HOT'))
+
+    @patch('src.frontend_service.frontend_service.requests.get')
+    def test_12_invalidateDuringFlight(self, mock_get):
+        logger.info("-----Test 12: An invalidation during an in-flight fetch keeps its result out of the cache-----")
+        def catalogThenInvalidate(*args, **kwargs):
+            self.client.post('/invalidate/MOVE')
+            return MagicMock(status_code=200, content=json.dumps({"name": "MOVE", "price": 1.0, "quantity": 1}).encode())
+        mock_get.side_effect = catalogThenInvalidate
+        rv = self.client.get('/stocks/MOVE')
+        self.assertEqual(rv.status_code, 200)
+        self.assertIsNone(cache.get('MOVE'))
+        self.assertEqual(svc.lookup_flights.calls, {})
+
+    @patch('src.frontend_service.frontend_service.requests.get')
+    def test_13_negativeCache(self, mock_get):
+        logger.info("-----Test 13: Unknown stocks are answered from the negative cache until invalidated or expired-----")
+        mock_get.return_value = MagicMock(status_code=404, content=json.dumps({"error": {"code": 404, "message": "No stock found."}}).encode())
+        hits = svc.negative_cache.hits
+        for _ in range(3):
+            rv = self.client.get('/stocks/INTC')
+            self.assertEqual(rv.status_code, 404)
+            self.assertEqual(rv.get_json()['error']['code'], 404)
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(self.client.get('/cache/stats').get_json()['negative_hits'], hits + 2)
+        self.client.post('/invalidate/INTC')
+        self.client.get('/stocks/INTC')
+        self.assertEqual(mock_get.call_count, 2)
+        with patch('src.frontend_service.frontend_service.time.monotonic', return_value=svc.time.monotonic() + svc.NEGATIVE_CACHE_TTL + 1):
+            self.client.get('/stocks/INTC')
+        self.assertEqual(mock_get.call_count, 3)
+
+    def test_14_negativeCacheBounded(self):
+        logger.info("-----Test 14: The negative cache evicts its oldest entry when full-----")
+        negative = svc.NegativeCache(2, 60)
+        for name in ("A", "B", "C"):
+            negative.put(name, {"error": {"code": 404}})
+        self.assertIsNone(negative.get("A"))
+        self.assertIsNotNone(negative.get("C"))
+        self.assertEqual(list(negative.entries), ["B", "C"])
+
+    def waitForRefreshes(self):
+        for _ in range(500):
+            if not svc.pending_refreshes:
+                return
+            threading.Event().wait(0.01)
+        self.fail("Background refresh did not finish")
+
+    @patch('src.frontend_service.frontend_service.requests.get')
+    def test_15_staleWhileRevalidate(self, mock_get):
+        logger.info("-----Test 15: An invalidated entry is served stale while one background fetch refreshes it-----")
+        mock_get.return_value = MagicMock(status_code=200, content=json.dumps({"name": "SWR", "price": 2.0, "quantity": 90}).encode())
+        cache.put('SWR', {"name": "SWR", "price": 2.0, "quantity": 100})
+        with patch.object(svc, 'CACHE_STALE_SECONDS', 5.0):
+            self.client.post('/invalidate/SWR')
+            self.assertIsNone(cache.get('SWR'))
+            rv = self.client.get('/stocks/SWR')
+            self.assertEqual(rv.get_json()['data']['quantity'], 100)
+            self.waitForRefreshes()
+            self.assertEqual(mock_get.call_count, 1)
+            self.assertEqual(self.client.get('/stocks/SWR').get_json()['data']['quantity'], 90)
+            self.client.post('/invalidate/SWR')
+            with patch('src.frontend_service.frontend_service.time.monotonic', return_value=svc.time.monotonic() + 10):
+                rv = self.client.get('/stocks/SWR') # Past the staleness bound, so the lookup blocks on the Catalog
+            self.assertEqual(mock_get.call_count, 2)
+            self.assertEqual(rv.get_json()['data']['quantity'], 90)
+
+    @patch('src.frontend_service.frontend_service.requests.get')
+    def test_16_refreshAhead(self, mock_get):
+        logger.info("-----Test 16: A hot stock is fetched again in the background right after its invalidation-----")
+        mock_get.return_value = MagicMock(status_code=200, content=json.dumps({"name": "HOT", "price": 3.0, "quantity": 7}).encode())
+        cache.put('COLD', {"name": "COLD", "price": 1.0, "quantity": 1})
+        cache.put('HOT', {"name": "HOT", "price": 3.0, "quantity": 8})
+        with patch.object(svc, 'REFRESH_AHEAD_KEYS', 1), patch.object(svc, 'REFRESH_AHEAD_DELAY', 0):
+            self.client.post('/invalidate/COLD')
+            self.client.post('/invalidate/HOT')
+            self.waitForRefreshes()
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertIsNone(cache.get('COLD'))
+        self.assertEqual(cache.get('HOT')['quantity'], 7)
+
+    @patch('src.frontend_service.frontend_service.requests.get')
+    def test_17_snapshotWarmup(self, mock_get):
+        logger.info("-----Test 17: Hot keys saved on exit are fetched again on the next start-----")
+        mock_get.side_effect = lambda url, **kwargs: MagicMock(status_code=200, content=json.dumps({"name": url.rsplit('/', 1)[1], "price": 1.0, "quantity": 5}).encode())
+        snapshot = os.path.join(tempfile.mkdtemp(), 'cache_snapshot.json')
+        with patch.object(svc, 'CACHE_SNAPSHOT_FILE', snapshot), patch.object(svc, 'CACHE_WARMUP', 'snapshot'):
+            cache.put('MSFT', {"name": "MSFT", "price": 1.0, "quantity": 5})
+            cache.put('APPL', {"name": "APPL", "price": 1.0, "quantity": 5})
+            svc.saveCacheSnapshot()
+            cache.cache.clear()
+            cache.access_order.clear()
+            svc.warmCache()
+        self.assertEqual(list(cache.access_order), ['MSFT', 'APPL'])
+        self.assertEqual(mock_get.call_count, 2)
+
+    @patch('src.frontend_service.frontend_service.requests.get')
+    def test_18_catalogWarmup(self, mock_get):
+        logger.info("-----Test 18: A bulk Catalog dump fills the cache unless an invalidation arrives meanwhile-----")
+        dump = {"stocks": [{"name": name, "price": 1.0, "quantity": 5} for name in ("A", "B", "C", "D", "E", "F")]}
+        mock_get.return_value = MagicMock(status_code=200, content=json.dumps(dump).encode())
+        with patch.object(svc, 'CACHE_SNAPSHOT_FILE', os.path.join(tempfile.mkdtemp(), 'missing.json')), patch.object(svc, 'CACHE_WARMUP', 'catalog'):
+            svc.warmCache()
+            self.assertEqual(sorted(cache.cache), ['A', 'B', 'C', 'D', 'E'][:svc.CACHE_SIZE])
+            cache.cache.clear()
+            cache.access_order.clear()
+            mock_get.side_effect = lambda *args, **kwargs: (self.client.post('/invalidate/A'), mock_get.return_value)[1]
+            svc.warmCache()
+        self.assertEqual(cache.cache, {})
+
+    def test_19_tinyLfuScanResistance(self):
+        logger.info("-----Test 19: A catalog scan evicts the hot set under LRU but not under TinyLFU admission-----")
+        def scanAfterHotLookups(policy):
+            lru = svc.LRUCache(3, policy)
+            for _ in range(5):
+                for name in ("APPL", "MSFT", "TSLA"):
+                    if lru.get(name) is None:
+                        lru.put(name, {"name": name})
+            for index in range(30):
+                name = f"SCAN{index}"
+                if lru.get(name) is None:
+                    lru.put(name, {"name": name})
+            return lru
+        self.assertEqual(sorted(scanAfterHotLookups(None).cache), ['SCAN27', 'SCAN28', 'SCAN29'])
+        tinylfu = scanAfterHotLookups(svc.TinyLFUAdmission(3))
+        self.assertEqual(sorted(tinylfu.cache), ['APPL', 'MSFT', 'TSLA'])
+        self.assertEqual(tinylfu.rejected, 30)
+
+    @patch('src.frontend_service.frontend_service.requests.get')
+    def test_20_hitRatioStats(self, mock_get):
+        logger.info("-----Test 20: 'GET /cache/stats' reports the cache hit ratio-----")
+        mock_get.return_value = MagicMock(status_code=200, content=json.dumps({"name": "RATIO", "price": 1.0, "quantity": 1}).encode())
+        cache.hits = cache.misses = 0
+        for _ in range(4):
+            self.client.get('/stocks/RATIO')
+        stats = self.client.get('/cache/stats').get_json()
+        self.assertEqual((stats['hits'], stats['misses']), (3, 1))
+        self.assertEqual(stats['hit_ratio'], 0.75)
+        self.assertEqual(stats['policy'], svc.CACHE_POLICY)
+
+    @patch('src.frontend_service.frontend_service.requests.get')
+    def test_21_queryFromFollowers(self, mock_get):
+        logger.info("-----Test 21: Order queries are spread over the followers, with the leader as fallback-----")
+        leader, followers = "http://order-service-3:9000", ["http://order-service-1:8998", "http://order-service-2:8999"]
+        order = {"data": {"transaction_number": 4, "stock_name": "APPL", "type": "buy", "quantity": 1}}
+        replicated = set(followers)
+        def replica(url, **kwargs):
+            base = url.rsplit('/', 2)[0] if '/orders/' in url else url.rsplit('/', 1)[0]
+            if base == "http://order-service-1:8998" and base not in replicated:
+                raise requests.ConnectionError("down")
+            found = base == leader or base in replicated
+            return MagicMock(status_code=200 if found else 404, content=json.dumps(order if found else {"error": "Order not found"}).encode())
+        mock_get.side_effect = replica
+        selector = svc.ReplicaSelector(followers + [leader])
+        with patch.object(svc, 'order_replicas', selector), patch.object(svc, 'LEADER_URL', leader):
+            queried = set()
+            for _ in range(3):
+                self.assertEqual(svc.queryOrderHandler(4), (order, 200))
+                queried.add(mock_get.call_args.args[0])
+            self.assertEqual(queried, {f"{url}/orders/4" for url in followers + [leader]})
+            replicated.clear() # Followers have not caught up yet, or are down
+            mock_get.reset_mock()
+            for _ in range(3):
+                self.assertEqual(svc.queryOrderHandler(4), (order, 200))
+            self.assertEqual(mock_get.call_args.args[0], f"{leader}/orders/4")
+            self.assertGreater(selector.unhealthy_until.get("http://order-service-1:8998", 0), 0)
+
+    def test_22_leastLoadedReplica(self):
+        logger.info("-----Test 22: 'least_loaded' picks the replica with the fewest queries in flight-----")
+        selector = svc.ReplicaSelector(["http://a", "http://b"])
+        with selector.track("http://a"):
+            self.assertEqual(selector.choose("least_loaded"), "http://b")
+        selector.markUnhealthy("http://b")
+        self.assertEqual(selector.choose("least_loaded"), "http://a")
+        self.assertEqual(selector.choose("round_robin"), "http://a")
+
+    @patch('src.frontend_service.frontend_service.queryOrderHandler')
+    @patch('src.frontend_service.frontend_service.orderHandler')
+    def test_23_completedOrderCache(self, mock_order, mock_query):
+        logger.info("-----Test 23: Placed and queried orders are served from the order cache-----")
+        mock_order.return_value = ({"data": {"transaction_number": 11}}, 200)
+        self.client.post('/orders', json={"stock_name": "MSFT", "type": "sell", "quantity": 3})
+        rv = self.client.get('/orders/11')
+        self.assertEqual(rv.get_json()['data'], {"number": 11, "name": "MSFT", "type": "sell", "quantity": 3})
+        mock_query.return_value = ({"data": {"transaction_number": 12, "stock_name": "APPL", "type": "buy", "quantity": 1}}, 200)
+        self.client.get('/orders/12')
+        self.assertEqual(self.client.get('/orders/12').get_json()['data']['name'], 'APPL')
+        mock_query.return_value = ({"error": {"code": 404, "message": "Order not found"}}, 404)
+        self.assertEqual(self.client.get('/orders/13').status_code, 404)
+        self.assertEqual(self.client.get('/orders/13').status_code, 404)
+        self.assertEqual(mock_query.call_count, 3)
+
+    @patch('src.frontend_service.frontend_service.requests.post')
+    @patch('src.frontend_service.frontend_service.requests.get')
+    def test_24_concurrentLeaderElection(self, mock_get, mock_post):
+        logger.info("-----Test 24: Replicas are probed concurrently, only the leader's notification is awaited and a dead replica is skipped-----")
+        urls = ["http://order-service-1:8998", "http://order-service-2:8999", "http://order-service-3:9000"]
+        def ping(url, **kwargs):
+            threading.Event().wait(0.2)
+            if url.startswith("http://order-service-3"):
+                raise requests.ConnectTimeout("dead")
+            return MagicMock(status_code=200, content=b'{"status":"healthy"}')
+        notified = []
+        def setLeader(url, **kwargs):
+            threading.Event().wait(0.2 if url.startswith("http://order-service-2") else 0.4)
+            notified.append(url.rsplit('/', 1)[0])
+            return MagicMock(status_code=200)
+        mock_get.side_effect = ping
+        mock_post.side_effect = setLeader
+        with patch.object(svc, 'ORDER_SERVICE_URLS', urls), patch.object(svc, 'LEADER_URL', None):
+            start = svc.time.monotonic()
+            svc.findLeader()
+            elapsed = svc.time.monotonic() - start
+            self.assertEqual(svc.LEADER_URL, "http://order-service-2:8999")
+            self.assertEqual(notified, ["http://order-service-2:8999"])
+            self.assertLess(elapsed, 0.6) # Serial probing and waiting for every notification would take well over a second
+            for _ in range(200): # The background notification finishes while the mocks apply
+                if len(notified) == 2:
+                    break
+                threading.Event().wait(0.01)
+        self.assertEqual(sorted(notified), urls[:2]) # The dead replica is never notified
+        self.assertTrue(all(call.kwargs['timeout'] <= svc.ELECTION_TIMEOUT_MAX for call in mock_post.call_args_list))
+
+    def test_25_adaptiveProbeTimeout(self):
+        logger.info("-----Test 25: The probe timeout follows the observed ping round trip within its bounds-----")
+        with patch.object(svc, 'probe_rtt', None):
+            self.assertEqual(svc.probeTimeout(), svc.ELECTION_TIMEOUT_MAX)
+            for _ in range(20):
+                svc.recordProbeRtt(0.002)
+            self.assertEqual(svc.probeTimeout(), svc.ELECTION_TIMEOUT_MIN)
+            for _ in range(50):
+                svc.recordProbeRtt(0.1)
+            self.assertAlmostEqual(svc.probeTimeout(), 0.4, places=2)
+
+    @patch('src.frontend_service.frontend_service.requests.post')
+    @patch('src.frontend_service.frontend_service.requests.get')
+    def test_26_electionFollowsLeaseHolder(self, mock_get, mock_post):
+        logger.info("-----Test 26: A replica holding a live lease stays leader even if a higher replica answers-----")
+        urls = ["http://order-service-1:8998", "http://order-service-2:8999", "http://order-service-3:9000"]
+        mock_get.return_value = MagicMock(status_code=200, content=json.dumps({"status": "healthy", "lease_holder": urls[1]}).encode())
+        mock_post.return_value = MagicMock(status_code=200)
+        with patch.object(svc, 'ORDER_SERVICE_URLS', urls), patch.object(svc, 'LEADER_URL', None):
+            svc.findLeader()
+            self.assertEqual(svc.LEADER_URL, urls[1])
+
+    def test_27_changeFeedCoalescesUpdates(self):
+        logger.info("-----Test 27: 'GET /stream/stocks' pushes the latest catalog update per subscribed stock-----")
+        rv = self.client.get('/stream/stocks?symbols=FEED')
+        self.assertEqual(rv.mimetype, 'text/event-stream')
+        stream = iter(rv.response)
+        self.assertEqual(next(stream), b': subscribed\n\n')
+        for quantity in (99, 98):
+            self.client.post('/invalidate/FEED', json={"name": "FEED", "price": 10.0, "quantity": quantity})
+        self.client.post('/invalidate/OTHER', json={"name": "OTHER", "price": 1.0, "quantity": 5})
+        self.client.post('/invalidate/FEED') # A notification without the stock only invalidates the cache
+        event = next(stream).decode()
+        self.assertEqual(event, 'event: quote\ndata: {"name":"FEED","price":10.0,"quantity":98}\n\n')
+        self.assertEqual(len(svc.change_feed.subscribers), 1)
+        rv.close()
+        self.assertEqual(len(svc.change_feed.subscribers), 0)
+
+    def test_28_changeFeedDisconnectsSlowSubscriber(self):
+        logger.info("-----Test 28: A subscriber with more pending stocks than its buffer is disconnected-----")
+        feed = svc.ChangeFeed(max_subscribers=1, capacity=2)
+        subscriber = feed.subscribe(None, lambda: None)
+        self.assertIsNone(feed.subscribe(None, lambda: None))
+        for stock_name in ('A', 'B', 'A'):
+            feed.publish(stock_name, {"name": stock_name})
+        self.assertEqual((subscriber.coalesced, subscriber.overflowed), (1, False))
+        feed.publish('C', {"name": 'C'})
+        self.assertTrue(subscriber.overflowed)
+        self.assertEqual([update["name"] for update in subscriber.drain()], ['B', 'A', 'C'])
+
+    @patch('src.frontend_service.frontend_service.requests.get')
+    def test_29_lookupBodyEncodedOnce(self, mock_get):
+        logger.info("-----Test 29: Cached lookups reuse the encoded body until the stock is invalidated-----")
+        mock_get.return_value = MagicMock(status_code=200, content=b'{"name":"ENC","price":5.0,"quantity":50}')
+        with patch.object(svc, 'jsonEncode', wraps=svc.jsonEncode) as encode:
+            bodies = [self.client.get('/stocks/ENC').data for _ in range(3)]
+            self.assertEqual(encode.call_count, 1)
+            self.assertEqual(json.loads(bodies[2]), {"message": "Lookup successful", "data": {"name": "ENC", "price": 5.0, "quantity": 50}})
+            self.assertEqual(bodies[0], bodies[2])
+            self.client.post('/invalidate/ENC')
+            mock_get.return_value = MagicMock(status_code=200, content=b'{"name":"ENC","price":5.0,"quantity":49}')
+            self.assertEqual(self.client.get('/stocks/ENC').get_json()['data']['quantity'], 49)
+            self.assertEqual(self.client.get('/stocks/ENC').get_json()['data']['quantity'], 49)
+        self.assertEqual(mock_get.call_count, 2)
+
+    @patch('src.frontend_service.frontend_service.requests.get')
+    def test_30_partitionedCatalogLookup(self, mock_get):
+        logger.info("-----Test 30: Lookups go to the catalog partition that owns the stock-----")
+        urls = ['http://catalog-service-1:8997', 'http://catalog-service-2:8997']
+        mock_get.side_effect = lambda url, **kwargs: MagicMock(status_code=200, content=json.dumps({"name": url.rsplit('/', 1)[1], "price": 1.0, "quantity": 1}).encode())
+        with patch.object(svc, 'CATALOG_SERVICE_URLS', urls):
+            for stock_name in ('GOOG', 'APPL', 'AMD', 'TSLA'):
+                self.assertEqual(self.client.get(f'/stocks/{stock_name}').status_code, 200)
+        self.assertEqual([call.args[0] for call in mock_get.call_args_list], [
+            f'{urls[0]}/stocks/GOOG', f'{urls[1]}/stocks/APPL', f'{urls[0]}/stocks/AMD', f'{urls[1]}/stocks/TSLA'
+        ])
+
+    def test_31_electionPoolAfterFork(self):
+        logger.info("-----Test 31: A worker forked after the start-up election gets an election pool of its own-----")
+        pool = svc.electionPool()
+        self.assertEqual(pool.submit(lambda: 1).result(timeout=2), 1)
+        worker = multiprocessing.get_context("fork").Process(target=lambda: svc.electionPool().submit(lambda: 1).result(timeout=2))
+        worker.start()
+        worker.join(5)
+        self.assertEqual(worker.exitcode, 0)
+        self.assertIs(svc.electionPool(), pool)
+
+    @patch('src.frontend_service.frontend_service.requests.post')
+    @patch('src.frontend_service.frontend_service.requests.get')
+    def test_32_leaderPingTimeout(self, mock_get, mock_post):
+        logger.info("-----Test 32: The leader ping before an order is bounded by the adaptive probe timeout-----")
+        mock_get.return_value = MagicMock(status_code=200)
+        mock_post.return_value = MagicMock(status_code=200, content=b'{"data":{"transaction_number":3}}')
+        with patch.object(svc, 'LEADER_URL', 'http://order-service-3:9000'), patch.object(svc, 'probe_rtt', 0.001), \
+             patch.object(svc, 'findLeader') as find_leader:
+            self.assertEqual(svc.probeTimeout(), svc.ELECTION_TIMEOUT_MIN)
+            self.assertEqual(svc.orderHandler({"stock_name": "APPL", "type": "buy", "quantity": 1}), ({"data": {"transaction_number": 3}}, 200))
+            self.assertEqual(mock_get.call_args.kwargs['timeout'], svc.ELECTION_TIMEOUT_MIN)
+        find_leader.assert_not_called()
+
+    @patch('src.frontend_service.frontend_service.orderHandler')
+    def test_33_orderCommittedWithoutFollowerAcks(self, mock_handle):
+        logger.info("-----Test 33: An order committed on the leader but short of follower acks is not reported as failed-----")
+        mock_handle.return_value = ({
+            "error": {"code": 504, "message": "Order 77 committed on the leader but acknowledged by 0 of 1 required followers"},
+            "data": {"transaction_number": 77}
+        }, 504)
+        rv = self.client.post('/orders', json={"stock_name": "APPL", "type": "buy", "quantity": 1})
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.get_json()['data'], {"transaction_number": 77, "durability_pending": True})
+        self.assertEqual(self.client.get('/orders/77').get_json()['data']['name'], 'APPL') # Cached like any placed order
+        mock_handle.return_value = ({"error": {"code": 504, "message": "Gateway timeout"}}, 504)
+        self.assertEqual(self.client.post('/orders', json={"stock_name": "APPL", "type": "buy", "quantity": 1}).status_code, 504)
+
+    def test_34_changeFeedLeavesThreadsForLookups(self):
+        logger.info("-----Test 34: With the subscriber cap reached, a server with WEB_THREADS threads still answers lookups-----")
+        class PoolServer(BaseWSGIServer): # A fixed number of request threads, like a gunicorn gthread worker
+            def __init__(self, threads, *args):
+                super().__init__(*args)
+                self.pool = ThreadPoolExecutor(max_workers=threads)
+
+            def process_request(self, request, client_address):
+                self.pool.submit(self.serveRequest, request, client_address)
+
+            def serveRequest(self, request, client_address):
+                try:
+                    self.finish_request(request, client_address)
+                finally:
+                    self.shutdown_request(request)
+        with patch.dict(os.environ, {"WEB_THREADS": "4"}):
+            feed = svc.ChangeFeed(svc.defaultFeedSubscribers(), svc.CHANGE_FEED_BUFFER)
+        server = PoolServer(4, '127.0.0.1', 0, app)
+        Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_port}'
+        streams = []
+        with patch.object(svc, 'change_feed', feed), patch.object(svc, 'CHANGE_FEED_HEARTBEAT', 0.05), \
+             patch.object(svc, 'fetchStock', return_value=({"name": "CAP", "price": 1.0, "quantity": 1}, 200)):
+            try:
+                for _ in range(feed.max_subscribers):
+                    streams.append(requests.get(f'{url}/stream/stocks', stream=True, timeout=5))
+                    self.assertEqual(next(streams[-1].iter_lines(chunk_size=1)), b': subscribed')
+                self.assertEqual(requests.get(f'{url}/stream/stocks', timeout=5).status_code, 503)
+                self.assertEqual(requests.get(f'{url}/stocks/CAP', timeout=5).json()['data']['name'], 'CAP')
+            finally:
+                for stream in streams:
+                    stream.close()
+                server.shutdown()
+                server.pool.shutdown(wait=True)
+
+    def test_35_orderCacheEvictsLeastRecentlyUsed(self):
+        logger.info("-----Test 35: The order cache evicts the least recently used order once full-----")
+        orders = svc.OrderCache(2)
+        orders.put(1, {"transaction_number": 1})
+        orders.put(2, {"transaction_number": 2})
+        self.assertEqual(orders.get(1), {"transaction_number": 1})
+        orders.put(3, {"transaction_number": 3})
+        self.assertIsNone(orders.get(2))
+        self.assertEqual(list(orders.entries), [1, 3])
+        self.assertEqual(orders.hits, 1)
+
+    def test_36_changeFeedWithoutCache(self):
+        logger.info("-----Test 36: With the cache disabled, an invalidation still reaches change feed subscribers-----")
+        with patch.object(svc, 'CACHE_ENABLED', 0), patch.object(svc, 'cache', None):
+            rv = self.client.get('/stream/stocks?symbols=FEED')
+            stream = iter(rv.response)
+            self.assertEqual(next(stream), b': subscribed\n\n')
+            self.assertEqual(self.client.post('/invalidate/FEED', json={"name": "FEED", "price": 10.0, "quantity": 96}).status_code, 200)
+            self.assertEqual(next(stream).decode(), 'event: quote\ndata: {"name":"FEED","price":10.0,"quantity":96}\n\n')
+            rv.close()
+
+# Async Front-end Tests - Same routes served by the aiohttp application
+class AsyncFrontendServiceTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        cache.cache.clear()
+        cache.access_order.clear()
+        cache.bodies.clear()
+        svc.negative_cache.entries.clear()
+        svc.order_cache.entries.clear()
+        self.client = TestClient(TestServer(svc.createAsyncApp()))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    @patch('src.frontend_service.frontend_service.asyncTracedRequest', new_callable=AsyncMock)
+    async def test_01_asyncLookupMissThenHit(self, mock_request):
+        logger.info("-----Async Test 1: 'GET /stocks/<name>' fetches from Catalog once, then serves from cache-----")
+        mock_request.return_value = ({"name": "IBM", "price": 100.0, "quantity": 100}, 200)
+        for _ in range(2):
+            rv = await self.client.get('/stocks/IBM')
+            self.assertEqual(rv.status, 200)
+            payload = await rv.json()
+            self.assertEqual(payload['message'], 'Lookup successful')
+            self.assertEqual(payload['data']['name'], 'IBM')
+        self.assertEqual(mock_request.await_count, 1)
+        rv = await self.client.post('/invalidate/IBM')
+        self.assertEqual(rv.status, 200)
+        self.assertIsNone(cache.get('IBM'))
+
+    @patch('src.frontend_service.frontend_service.asyncTracedRequest', new_callable=AsyncMock)
+    async def test_02_asyncLookupNotFound(self, mock_request):
+        logger.info("-----Async Test 2: Catalog 404 is passed through and not cached-----")
+        mock_request.return_value = ({"error": {"code": 404, "message": "No stock found."}}, 404)
+        rv = await self.client.get('/stocks/NoSuchStock')
+        self.assertEqual(rv.status, 404)
+        self.assertEqual((await rv.json())['error']['code'], 404)
+        self.assertIsNone(cache.get('NoSuchStock'))
+        rv = await self.client.get('/stocks/NoSuchStock')
+        self.assertEqual(rv.status, 404)
+        self.assertEqual(mock_request.await_count, 1)
+
+    @patch('src.frontend_service.frontend_service.ORDER_READ_POLICY', 'leader')
+    @patch('src.frontend_service.frontend_service.asyncLeaderRequest', new_callable=AsyncMock)
+    async def test_03_asyncOrderAndQuery(self, mock_leader):
+        logger.info("-----Async Test 3: 'POST /orders' and 'GET /orders/<id>' go to the leader-----")
+        mock_leader.return_value = ({"data": {"transaction_number": 42}}, 200)
+        rv = await self.client.post('/orders', json={"stock_name": "APPL", "type": "buy", "quantity": 1})
+        self.assertEqual(rv.status, 200)
+        self.assertEqual((await rv.json())['data']['transaction_number'], 42)
+        mock_leader.return_value = ({"data": {"transaction_number": 42, "stock_name": "APPL", "type": "buy", "quantity": 1}}, 200)
+        rv = await self.client.get('/orders/42')
+        self.assertEqual(rv.status, 200)
+        self.assertEqual((await rv.json())['data'], {"number": 42, "name": "APPL", "type": "buy", "quantity": 1})
+        self.assertEqual(mock_leader.await_count, 1) # The placed order is served from the order cache
+        rv = await self.client.get('/orders/43')
+        self.assertEqual(mock_leader.await_args.args[1:], ("get", "/orders/43"))
+
+    @patch('src.frontend_service.frontend_service.findLeader')
+    @patch('src.frontend_service.frontend_service.asyncTracedRequest', new_callable=AsyncMock)
+    async def test_04_asyncLeaderFailover(self, mock_request, mock_find_leader):
+        logger.info("-----Async Test 4: Unresponsive leader triggers one re-election and a retry-----")
+        def elect():
+            svc.LEADER_URL = "http://order-service-2:8999"
+        mock_find_leader.side_effect = elect
+        svc.LEADER_URL = "http://order-service-3:9000"
+        mock_request.side_effect = [
+            aiohttp.ClientError("down"),
+            ({"status": "healthy"}, 200),
+            ({"data": {"transaction_number": 3}}, 200)
+        ]
+        body, status_code = await svc.asyncLeaderRequest(self.client.app, "post", "/orders", json={})
+        self.assertEqual(status_code, 200)
+        self.assertEqual(mock_find_leader.call_count, 1)
+        self.assertEqual(mock_request.await_args.args[2], "http://order-service-2:8999/orders")
+
+    @patch('src.frontend_service.frontend_service.asyncTracedRequest', new_callable=AsyncMock)
+    async def test_05_asyncSingleFlightLookup(self, mock_request):
+        logger.info("-----Async Test 5: Concurrent cache misses share one Catalog fetch on the event loop-----")
+        release = asyncio.Event()
+        async def slowCatalog(*args, **kwargs):
+            await release.wait()
+            return {"name": "HOT", "price": 10.0, "quantity": 100}, 200
+        mock_request.side_effect = slowCatalog
+        lookups = [asyncio.ensure_future(self.client.get('/stocks/HOT')) for _ in range(8)]
+        flights = self.client.app[svc.lookup_flights_key]
+        while flights.coalesced < 7:
+            await asyncio.sleep(0.01)
+        release.set()
+        responses = await asyncio.gather(*lookups)
+        self.assertEqual([rv.status for rv in responses], [200] * 8)
+        self.assertEqual(mock_request.await_count, 1)
+
+    @patch('src.frontend_service.frontend_service.asyncTracedRequest', new_callable=AsyncMock)
+    async def test_06_asyncStaleWhileRevalidate(self, mock_request):
+        logger.info("-----Async Test 6: Stale entries are served while a background task refreshes them-----")
+        mock_request.return_value = ({"name": "SWR", "price": 2.0, "quantity": 90}, 200)
+        cache.put('SWR', {"name": "SWR", "price": 2.0, "quantity": 100})
+        with patch.object(svc, 'CACHE_STALE_SECONDS', 5.0):
+            await self.client.post('/invalidate/SWR')
+            rv = await self.client.get('/stocks/SWR')
+            self.assertEqual((await rv.json())['data']['quantity'], 100)
+            await asyncio.gather(*self.client.app[svc.refresh_tasks_key])
+        self.assertEqual(mock_request.await_count, 1)
+        self.assertEqual(cache.get('SWR')['quantity'], 90)
+
+    async def test_07_asyncChangeFeed(self):
+        logger.info("-----Async Test 7: Catalog updates are streamed to subscribers as server-sent events-----")
+        rv = await self.client.get('/stream/stocks?symbols=FEED')
+        self.assertEqual(rv.headers['Content-Type'], 'text/event-stream')
+        self.assertEqual(await rv.content.readuntil(b'\n\n'), b': subscribed\n\n')
+        await self.client.post('/invalidate/FEED', json={"name": "FEED", "price": 10.0, "quantity": 97})
+        event = await asyncio.wait_for(rv.content.readuntil(b'\n\n'), 2)
+        self.assertEqual(event, b'event: quote\ndata: {"name":"FEED","price":10.0,"quantity":97}\n\n')
+        rv.close()
+
+    async def test_08_asyncChangeFeedWithoutCache(self):
+        logger.info("-----Async Test 8: With the cache disabled, an invalidation still reaches change feed subscribers-----")
+        with patch.object(svc, 'CACHE_ENABLED', 0), patch.object(svc, 'cache', None):
+            rv = await self.client.get('/stream/stocks?symbols=FEED')
+            self.assertEqual(await rv.content.readuntil(b'\n\n'), b': subscribed\n\n')
+            self.assertEqual((await self.client.post('/invalidate/FEED', json={"name": "FEED", "price": 10.0, "quantity": 95})).status, 200)
+            event = await asyncio.wait_for(rv.content.readuntil(b'\n\n'), 2)
+            self.assertEqual(event, b'event: quote\ndata: {"name":"FEED","price":10.0,"quantity":95}\n\n')
+            rv.close()
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,5 +1,6 @@
 # Importing the required libraries
-import unittest, os, logging
+import unittest, os, glob, stat, logging, threading, requests, gzip, json, multiprocessing
+from unittest.mock import patch, MagicMock
 from src.order_service import order_service as svc
 from src.order_service.order_service import app
 
@@ -17,11 +18,26 @@ class OrderServiceTest(unittest.TestCase):
             logger.debug(f"Removed existing log file {svc.ORDER_LOG_FILE}")
         except FileNotFoundError:
             logger.debug("No existing log file to remove")
+        self.removeSealedSegments()
         svc.LEADER_ID = None
+        for task in svc.leader_tasks: # Background work of an earlier leader must not run into the next test
+            task.join(timeout=5)
         svc.transaction_number = 0
         svc.ordersList.clear()
+        svc.order_analytics.rebuild([])
+        svc.granted_lease.update(holder=None, expiry=0.0)
+        svc.lease_expiry = 0.0
+        svc.peer_high_water.clear()
+        svc.order_bodies.clear()
         self.client = app.test_client()
 
+    def removeSealedSegments(self):
+        for path in glob.glob(f'order_log_{svc.REPLICA_ID}.*'):
+            os.remove(path)
+        svc.log_segments.clear()
+        svc.pending_segments.clear()
+        svc.active_segment_rows = 0
+
     def test_01_healthCheck(self):
         logger.info("-----Test 1: Health ping returns healthy status-----")
         rv = self.client.get('/ping')
@@ -89,5 +105,438 @@ class OrderServiceTest(unittest.TestCase):
         data = rv2.get_json().get('data')
         self.assertEqual(data, payload)
 
+    def test_10_replicateOrderRecordsSpans(self):
+        logger.info("-----Test 10: Replication records lock wait and disk write spans under the caller's trace-----")
+        svc.LEADER_ID = None
+        payload = {'transaction_number': 8, 'stock_name': 'ABC', 'type': 'buy', 'quantity': 2}
+        svc.TRACING_ENABLED = 1
+        try:
+            rv = self.client.post('/replicate_order', json=payload, headers={'traceparent': '00-' + 'c' * 32 + '-' + 'd' * 16 + '-01'})
+        finally:
+            svc.TRACING_ENABLED = 0
+        self.assertEqual(rv.status_code, 200)
+        spans = []
+        while not svc.trace_queue.empty():
+            spans.append(svc.trace_queue.get())
+        names = {span['name'] for span in spans}
+        self.assertIn('POST /replicate_order', names)
+        self.assertIn('lock_wait orders_list_lock', names)
+        self.assertIn('disk_write', names)
+        self.assertTrue(all(span['trace_id'] == 'c' * 32 for span in spans))
+
+    def placeOrderAsLeader(self, followerReply):
+        svc.LEADER_ID = svc.SELF_URL
+        svc.leaderRecoveryCompleted = True
+        def post(url, **kwargs):
+            if url.endswith('/replicate_order'):
+                return followerReply(url)
+            return MagicMock(status_code=200)
+        with patch('src.order_service.order_service.requests.get', return_value=MagicMock(status_code=200, content=json.dumps({"quantity": 100}).encode())), \
+             patch('src.order_service.order_service.requests.post', side_effect=post):
+            return self.client.post('/orders', json={'stock_name': 'ABC', 'type': 'buy', 'quantity': 1})
+
+    def test_11_majorityWriteConcern(self):
+        logger.info("-----Test 11: 'majority' answers after one follower ack without waiting for the slow follower-----")
+        slowFollower = threading.Event()
+        def followerReply(url):
+            if url.startswith('http://order-service-3'):
+                slowFollower.wait(5)
+            return MagicMock(status_code=200)
+        with patch.object(svc, 'WRITE_CONCERN', 'majority'):
+            rv = self.placeOrderAsLeader(followerReply)
+        self.assertEqual(rv.status_code, 200)
+        status = self.client.get('/replication_status').get_json()
+        transaction = rv.get_json()['data']['transaction_number']
+        self.assertEqual(status['followers']['http://order-service-2:8999']['acked_transaction'], transaction)
+        self.assertEqual(status['followers']['http://order-service-2:8999']['lag'], 0)
+        slowFollower.set()
+
+    def test_12_allWriteConcernUnmet(self):
+        logger.info("-----Test 12: 'all' reports a 504 when a follower cannot acknowledge the order-----")
+        def followerReply(url):
+            if url.startswith('http://order-service-3'):
+                raise requests.ConnectionError("down")
+            return MagicMock(status_code=200)
+        with patch.object(svc, 'WRITE_CONCERN', 'all'):
+            rv = self.placeOrderAsLeader(followerReply)
+        self.assertEqual(rv.status_code, 504)
+        self.assertIn('1 of 2', rv.get_json()['error']['message'])
+        self.assertGreaterEqual(svc.follower_status['http://order-service-3:9000']['failures'], 1)
+
+    def test_13_leaseGrantedToOneCandidate(self):
+        logger.info("-----Test 13: A replica grants its lease to one candidate until the lease expires-----")
+        leaderA, leaderB = 'http://order-service-3:9000', 'http://order-service-2:8999'
+        rv = self.client.post('/lease', json={'candidate': leaderA, 'duration': 2})
+        self.assertTrue(rv.get_json()['granted'])
+        rv = self.client.post('/lease', json={'candidate': leaderB, 'duration': 2})
+        self.assertEqual(rv.get_json(), {'granted': False, 'holder': leaderA})
+        self.assertTrue(self.client.post('/lease', json={'candidate': leaderA, 'duration': 2}).get_json()['granted'])
+        self.assertEqual(self.client.get('/ping').get_json()['lease_holder'], leaderA)
+        with patch('src.order_service.order_service.time.monotonic', return_value=svc.time.monotonic() + 3):
+            self.assertTrue(self.client.post('/lease', json={'candidate': leaderB, 'duration': 2}).get_json()['granted'])
+
+    def test_14_replicationNeedsLeaseHolder(self):
+        logger.info("-----Test 14: Followers reject replication from a replica that does not hold their lease-----")
+        payload = {'transaction_number': 3, 'stock_name': 'ABC', 'type': 'buy', 'quantity': 1}
+        svc.grantLease('http://order-service-3:9000', 2)
+        with patch.object(svc, 'LEASE_ENABLED', 1):
+            rv = self.client.post('/replicate_order', json=payload, headers={'X-Leader': 'http://order-service-2:8999'})
+            self.assertEqual(rv.status_code, 409)
+            rv = self.client.post('/replicate_order', json=payload, headers={'X-Leader': 'http://order-service-3:9000'})
+            self.assertEqual(rv.status_code, 200)
+
+    def test_15_leaderNeedsMajorityLease(self):
+        logger.info("-----Test 15: The leader takes orders only while a majority granted it the lease-----")
+        svc.LEADER_ID = svc.SELF_URL
+        svc.leaderRecoveryCompleted = True
+        def grant(granted):
+            return lambda url, **kwargs: MagicMock(status_code=200, content=json.dumps({'granted': granted}).encode())
+        with patch.object(svc, 'LEASE_ENABLED', 1):
+            with patch('src.order_service.order_service.requests.post', side_effect=grant(False)):
+                self.assertFalse(svc.acquireLease())
+            rv = self.client.post('/orders', json={'stock_name': 'ABC', 'type': 'buy', 'quantity': 1})
+            self.assertEqual(rv.status_code, 503)
+            self.assertEqual(self.client.get('/orders/0').status_code, 503)
+            with patch('src.order_service.order_service.requests.post', side_effect=grant(True)):
+                self.assertTrue(svc.acquireLease())
+            self.assertTrue(svc.holdsLease())
+            self.assertEqual(self.client.get('/orders/0').status_code, 404)
+
+    def test_16_missingOrdersUpperBound(self):
+        logger.info("-----Test 16: 'get_missing_orders' honours the optional 'upto' bound-----")
+        for transaction in range(5):
+            svc.loadOrderToMemory({'transaction_number': transaction, 'stock_name': 'ABC', 'type': 'buy', 'quantity': 1})
+        rv = self.client.get('/get_missing_orders/1?upto=3')
+        self.assertEqual([order['transaction_number'] for order in rv.get_json()['data']], [2, 3])
+
+    def test_17_incrementalLeaderRecovery(self):
+        logger.info("-----Test 17: A new leader positions its counter past every high-water mark and fetches only the missing range-----")
+        for transaction in range(2):
+            svc.loadOrderToMemory({'transaction_number': transaction, 'stock_name': 'ABC', 'type': 'buy', 'quantity': 1})
+        deadPeer, livePeer = 'http://order-service-3:9000', 'http://order-service-2:8999'
+        svc.recordPeerHighWater(deadPeer, 5) # Acknowledged orders earlier, unreachable now
+        fetched = []
+        def peerGet(url, **kwargs):
+            if url.startswith(deadPeer):
+                raise requests.exceptions.ConnectionError()
+            if url.endswith('/max_transaction'):
+                return MagicMock(status_code=200, content=json.dumps({'max_transaction': 3}).encode())
+            fetched.append((url, kwargs.get('params')))
+            orders = [{'transaction_number': t, 'stock_name': 'ABC', 'type': 'sell', 'quantity': 1} for t in (2, 3)]
+            return MagicMock(status_code=200, content=json.dumps({'data': orders}).encode())
+        with patch('src.order_service.order_service.requests.get', side_effect=peerGet):
+            self.assertEqual(svc.recoverStateForLeader(), 5)
+            self.assertEqual(svc.transactionNumber, 6)
+            svc.catchUpFromPeers(5)
+        self.assertEqual(fetched, [(f'{livePeer}/get_missing_orders/1', {'upto': 5})])
+        self.assertEqual(sorted(order['transaction_number'] for order in svc.ordersList), [0, 1, 2, 3])
+        self.assertEqual(svc.missingTransactions(5), [4, 5])
+
+    def test_18_leaderAcceptsOrdersDuringCatchUp(self):
+        logger.info("-----Test 18: The new leader accepts orders while the catch-up runs in the background-----")
+        caughtUp = threading.Event()
+        with patch.object(svc, 'recoverStateForLeader', return_value=-1), \
+             patch.object(svc, 'catchUpFromPeers', side_effect=lambda seen: caughtUp.wait(2)):
+            rv = self.client.post('/set_leader', json={'leader_id': svc.SELF_URL})
+            self.assertEqual(rv.status_code, 200)
+            self.assertTrue(svc.leaderRecoveryCompleted)
+            self.assertFalse(caughtUp.is_set())
+            caughtUp.set()
+
+    def test_19_rangeDigest(self):
+        logger.info("-----Test 19: 'range_digest' returns one digest per bucket, independent of arrival order-----")
+        for transaction in (3, 0, 2, 1):
+            svc.loadOrderToMemory({'transaction_number': transaction, 'stock_name': 'ABC', 'type': 'buy', 'quantity': 1})
+        rv = self.client.get('/range_digest?from=0&to=7&buckets=2')
+        buckets = rv.get_json()['buckets']
+        self.assertEqual([(b['from'], b['to'], b['count']) for b in buckets], [(0, 3, 4), (4, 7, 0)])
+        self.assertEqual(buckets, svc.rangeDigests(0, 7, 2))
+        self.assertEqual(self.client.get('/range_digest?from=5&to=1').status_code, 400)
+
+    def test_20_antiEntropyRepairsGap(self):
+        logger.info("-----Test 20: Anti-entropy narrows down to the differing range and fetches only that range-----")
+        peerOrders = [{'transaction_number': t, 'stock_name': 'ABC', 'type': 'buy', 'quantity': 1} for t in range(1000)]
+        for order in peerOrders:
+            if order['transaction_number'] != 517: # A lost '/replicate_order' below the max
+                svc.loadOrderToMemory(order)
+        peer = 'http://order-service-2:8999'
+        fetched = []
+        def peerGet(url, params=None, **kwargs):
+            if url.endswith('/max_transaction'):
+                return MagicMock(status_code=200, content=json.dumps({'max_transaction': 999}).encode())
+            if url.endswith('/range_digest'):
+                digests = []
+                for low, high in svc.splitRange(params['from'], params['to'], params['buckets']):
+                    digest = 0
+                    for order in peerOrders[low:high + 1]:
+                        digest ^= svc.orderDigest(order)
+                    digests.append({'from': low, 'to': high, 'count': high - low + 1, 'digest': f'{digest:064x}'})
+                return MagicMock(status_code=200, content=json.dumps({'buckets': digests}).encode())
+            lastOrderNum = int(url.rsplit('/', 1)[1])
+            fetched.append((lastOrderNum + 1, params['upto']))
+            return MagicMock(status_code=200, content=json.dumps({'data': peerOrders[lastOrderNum + 1:params['upto'] + 1]}).encode())
+        with patch('src.order_service.order_service.requests.get', side_effect=peerGet):
+            self.assertEqual(svc.antiEntropyRound(peer), 1)
+        self.assertEqual(len(fetched), 1)
+        self.assertTrue(fetched[0][0] <= 517 <= fetched[0][1])
+        self.assertLessEqual(fetched[0][1] - fetched[0][0] + 1, svc.ANTI_ENTROPY_LEAF_SIZE)
+        self.assertEqual(svc.missingTransactions(999), [])
+
+    def test_21_columnarCompressedSync(self):
+        logger.info("-----Test 21: 'get_missing_orders' negotiates the columnar encoding and gzip compression-----")
+        orders = [{'transaction_number': t, 'stock_name': 'ABC', 'type': 'buy', 'quantity': 1} for t in range(100)]
+        for order in orders:
+            svc.loadOrderToMemory(order)
+        rv = self.client.get('/get_missing_orders/0')
+        self.assertEqual(rv.get_json()['data'], orders[1:])
+        rv = self.client.get('/get_missing_orders/0', headers={'Accept': f'{svc.SYNC_MEDIA_TYPE}, application/json;q=0.5', 'Accept-Encoding': 'gzip'})
+        self.assertEqual(rv.mimetype, svc.SYNC_MEDIA_TYPE)
+        self.assertEqual(rv.headers['Content-Encoding'], 'gzip')
+        payload = json.loads(gzip.decompress(rv.data))
+        self.assertEqual(payload['columns']['transaction_number'], list(range(1, 100)))
+        self.assertEqual(svc.decodeOrderColumns(payload), orders[1:])
+        self.assertLess(len(rv.data), len(json.dumps({'data': orders[1:]})) // 4)
+
+    def test_22_parallelRangeSync(self):
+        logger.info("-----Test 22: Start-up sync fetches distinct ranges from different peers and falls back on failure-----")
+        peerOrders = [{'transaction_number': t, 'stock_name': 'ABC', 'type': 'buy', 'quantity': 1} for t in range(10)]
+        peerA, peerB = 'http://order-service-2:8999', 'http://order-service-3:9000'
+        fetched = []
+        lock = threading.Lock()
+        def peerGet(url, params=None, **kwargs):
+            if url.endswith('/max_transaction'):
+                return MagicMock(status_code=200, content=json.dumps({'max_transaction': 9}).encode())
+            lastOrderNum = int(url.rsplit('/', 1)[1])
+            with lock:
+                fetched.append((url.split('/get_missing_orders')[0], lastOrderNum + 1, params['upto']))
+            if url.startswith(peerB):
+                raise requests.exceptions.ConnectionError()
+            return MagicMock(status_code=200, content=json.dumps(svc.encodeOrderColumns(peerOrders[lastOrderNum + 1:params['upto'] + 1])).encode())
+        with patch('src.order_service.order_service.requests.get', side_effect=peerGet):
+            self.assertEqual(svc.appendMissingOrders(-1), 10)
+        self.assertEqual(sorted(fetched), [(peerA, 0, 4), (peerA, 5, 9), (peerB, 5, 9)])
+        self.assertEqual(svc.missingTransactions(9), [])
+
+    def writeOrders(self, count):
+        orders = [{'transaction_number': t, 'stock_name': 'ABC', 'type': 'buy', 'quantity': t + 1} for t in range(count)]
+        for order in reversed(orders): # Out of order, as replication can deliver them
+            svc.loadOrderToDisk(order)
+        self.addCleanup(self.removeSealedSegments)
+        svc.waitForSeals() # Seals run in the background
+        return orders
+
+    def test_23_orderLogSegments(self):
+        logger.info("-----Test 23: Full segments are sealed read-only with their range in the manifest-----")
+        with patch.object(svc, 'ORDER_LOG_SEGMENT_ROWS', 3):
+            orders = self.writeOrders(7)
+        self.assertEqual([(s['min_transaction'], s['max_transaction'], s['rows']) for s in svc.log_segments], [(4, 6, 3), (1, 3, 3)])
+        with open(svc.ORDER_LOG_MANIFEST) as file:
+            self.assertEqual(json.load(file)['segments'], svc.log_segments)
+        self.assertFalse(os.stat(svc.log_segments[0]['file']).st_mode & stat.S_IWUSR)
+        self.assertEqual(svc.active_segment_rows, 1)
+        for order in orders:
+            self.assertEqual(self.client.get(f"/orders/{order['transaction_number']}").get_json()['data'], order)
+        svc.log_segments.clear()
+        self.assertEqual(svc.orderLogInit(), 6)
+        self.assertEqual(svc.ordersList, orders)
+        self.assertEqual(svc.active_segment_rows, 1)
+
+    def test_24_compressedOrderLogSegments(self):
+        logger.info("-----Test 24: Sealed segments can be gzip-compressed and are still served-----")
+        with patch.object(svc, 'ORDER_LOG_SEGMENT_ROWS', 4), patch.object(svc, 'ORDER_LOG_COMPRESS', 1):
+            orders = self.writeOrders(4)
+        segmentFile = svc.log_segments[0]['file']
+        self.assertTrue(segmentFile.endswith('.csv.gz'))
+        with gzip.open(segmentFile, 'rt') as file:
+            self.assertEqual(file.readline().strip(), 'transaction_number,stock_name,type,quantity,timestamp')
+        self.assertEqual(self.client.get('/orders/2').get_json()['data'], orders[2])
+
+    def test_25_orderAnalytics(self):
+        logger.info("-----Test 25: 'analytics/orders' aggregates volume and net position per symbol-----")
+        trades = [('ABC', 'buy', 5, 100.0), ('ABC', 'sell', 2, 200.0), ('XYZ', 'buy', 7, 300.0), ('ABC', 'buy', 1, None)]
+        for transaction, (stock, trade, quantity, timestamp) in enumerate(trades):
+            order = {'transaction_number': transaction, 'stock_name': stock, 'type': trade, 'quantity': quantity}
+            if timestamp is not None:
+                order['timestamp'] = timestamp
+            svc.loadOrderToMemory(order)
+        data = self.client.get('/analytics/orders').get_json()['data']
+        self.assertEqual(data['orders'], 4)
+        self.assertEqual(data['symbols']['ABC'], {'orders': 3, 'buy_volume': 6, 'sell_volume': 2, 'net_position': 4})
+        self.assertEqual(data['symbols']['XYZ'], {'orders': 1, 'buy_volume': 7, 'sell_volume': 0, 'net_position': 7})
+        data = self.client.get('/analytics/orders?from=1&to=2').get_json()['data']
+        self.assertEqual(sorted(data['symbols']), ['ABC', 'XYZ'])
+        self.assertEqual(data['symbols']['ABC']['net_position'], -2)
+        data = self.client.get('/analytics/orders?since=150&symbol=ABC').get_json()['data'] # The order without a timestamp is left out
+        self.assertEqual(data, {'orders': 1, 'symbols': {'ABC': {'orders': 1, 'buy_volume': 0, 'sell_volume': 2, 'net_position': -2}}})
+        self.assertEqual(self.client.get('/analytics/orders?from=abc').status_code, 400)
+
+    def test_26_orderAnalyticsRebuiltOnInit(self):
+        logger.info("-----Test 26: Analytics arrays grow on append and are rebuilt from the log on start-up-----")
+        orders = [{'transaction_number': t, 'stock_name': f'S{t % 3}', 'type': 'buy', 'quantity': 1, 'timestamp': 1000.0 + t} for t in range(3000)]
+        for order in orders:
+            svc.loadOrderToDisk(order)
+            svc.loadOrderToMemory(order)
+        self.assertEqual(self.client.get('/analytics/orders?until=1999').get_json()['data']['orders'], 1000)
+        svc.order_analytics.rebuild([])
+        self.assertEqual(svc.orderLogInit(), 2999)
+        self.assertEqual(svc.ordersList[5], orders[5])
+        self.assertEqual(svc.order_analytics.summarize(symbol='S1')['symbols']['S1']['buy_volume'], 1000)
+
+    def test_27_orderBodyCache(self):
+        logger.info("-----Test 27: Queried orders are served from the encoded body cache without reading the log-----")
+        order = {'transaction_number': 0, 'stock_name': 'ABC', 'type': 'buy', 'quantity': 4}
+        svc.loadOrderToDisk(order)
+        self.assertEqual(self.client.get('/orders/0').get_json()['data']['quantity'], 4)
+        with patch.object(svc, 'findOrderOnDisk', side_effect=AssertionError('log read')):
+            rv = self.client.get('/orders/0')
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.get_json()['data']['stock_name'], 'ABC')
+        self.assertEqual(self.client.get('/orders/1').status_code, 404)
+        svc.orderLogInit()
+        self.assertEqual(len(svc.order_bodies), 0)
+
+    def test_28_partitionedCatalogTrade(self):
+        logger.info("-----Test 28: Orders read and update the stock on the catalog partition that owns it-----")
+        urls = ['http://catalog-service-1:8997', 'http://catalog-service-2:8997']
+        calls = []
+        def catalog(method):
+            def call(url, **kwargs):
+                calls.append((method, url))
+                return MagicMock(status_code=200, content=json.dumps({"quantity": 100}).encode())
+            return call
+        svc.LEADER_ID = svc.SELF_URL
+        svc.leaderRecoveryCompleted = True
+        with patch.object(svc, 'CATALOG_SERVICE_URLS', urls), patch.object(svc, 'TOTAL_REPLICAS', 1), \
+             patch('src.order_service.order_service.requests.get', side_effect=catalog('get')), \
+             patch('src.order_service.order_service.requests.post', side_effect=catalog('post')):
+            for stockName in ('GOOG', 'APPL'):
+                self.assertEqual(self.client.post('/orders', json={'stock_name': stockName, 'type': 'buy', 'quantity': 1}).status_code, 200)
+        catalogCalls = [call for call in calls if '/stocks/' in call[1]]
+        self.assertEqual(catalogCalls, [
+            ('get', f'{urls[0]}/stocks/GOOG'), ('post', f'{urls[0]}/stocks/GOOG'),
+            ('get', f'{urls[1]}/stocks/APPL'), ('post', f'{urls[1]}/stocks/APPL')
+        ])
+
+    def test_29_hungFollowerDoesNotBlockAcks(self):
+        logger.info("-----Test 29: A hung follower only delays its own replication, 'majority' keeps answering-----")
+        hung = threading.Event()
+        orders = 3 * svc.REPLICATION_THREADS # More than the threads of one follower
+        def post(url, **kwargs):
+            if url.startswith('http://order-service-3'):
+                hung.wait(10)
+            return MagicMock(status_code=200)
+        sender = svc.followerSender('http://order-service-3:9000')
+        with patch.object(svc, 'WRITE_CONCERN', 'majority'), patch('src.order_service.order_service.requests.post', side_effect=post):
+            start = svc.time.monotonic()
+            results = [svc.sendToFollowers({'transaction_number': t, 'stock_name': 'ABC', 'type': 'buy', 'quantity': 1}) for t in range(orders)]
+            self.assertLess(svc.time.monotonic() - start, svc.REPLICATION_TIMEOUT)
+            self.assertEqual(results, [(1, 1)] * orders)
+            self.assertEqual(sender.pending, orders)
+            with patch.object(sender, 'backlog', orders):
+                self.assertIsNone(sender.submit(lambda: True))
+            hung.set()
+            sender.executor.submit(lambda: None).result(timeout=5)
+            while sender.pending:
+                svc.time.sleep(0.01)
+
+    def test_30_traceContextClearedAfterTask(self):
+        logger.info("-----Test 30: A pooled thread drops the caller's span once the traced task returns-----")
+        svc.trace_context.span = {"trace_id": 'e' * 32, "span_id": 'f' * 16}
+        task = svc.withTraceContext(lambda: svc.trace_context.span['trace_id'])
+        svc.trace_context.span = None
+        with svc.ThreadPoolExecutor(max_workers=1) as pool:
+            self.assertEqual(pool.submit(task).result(), 'e' * 32)
+            self.assertIsNone(pool.submit(lambda: getattr(svc.trace_context, 'span', None)).result())
+
+    def test_31_rangeDigestHashesOutsideLock(self):
+        logger.info("-----Test 31: 'range_digest' hashes the orders after releasing the orders list lock-----")
+        for transaction in range(4):
+            svc.loadOrderToMemory({'transaction_number': transaction, 'stock_name': 'ABC', 'type': 'buy', 'quantity': 1})
+        lockedWhileHashing = []
+        digest = svc.orderDigest
+        def hashOrder(order):
+            lockedWhileHashing.append(svc.orders_list_lock.locked())
+            return digest(order)
+        with patch.object(svc, 'orderDigest', side_effect=hashOrder):
+            buckets = svc.rangeDigests(0, 7, 2)
+        self.assertEqual(lockedWhileHashing, [False] * 4)
+        self.assertEqual([bucket['count'] for bucket in buckets], [4, 0])
+
+    def test_32_sealOffWritePath(self):
+        logger.info("-----Test 32: A full segment is only renamed on the write path, the seal thread compacts it later-----")
+        sealing = threading.Event()
+        svc.sealPool().submit(sealing.wait, 5) # Holds the seal thread
+        self.addCleanup(self.removeSealedSegments)
+        with patch.object(svc, 'ORDER_LOG_SEGMENT_ROWS', 3):
+            for transaction in range(3):
+                svc.loadOrderToDisk({'transaction_number': transaction, 'stock_name': 'ABC', 'type': 'buy', 'quantity': 1})
+            pendingFile = svc.pending_segments[0]
+            self.assertEqual(svc.log_segments, [])
+            self.assertEqual(svc.active_segment_rows, 0)
+            self.assertEqual(svc.findOrderOnDisk(1)['transaction_number'], 1)
+            sealing.set()
+            svc.waitForSeals()
+        self.assertEqual([(s['min_transaction'], s['max_transaction']) for s in svc.log_segments], [(0, 2)])
+        self.assertEqual(svc.pending_segments, [])
+        self.assertFalse(os.path.exists(pendingFile))
+        self.assertEqual(svc.findOrderOnDisk(1)['transaction_number'], 1)
+
+    def test_33_pendingSegmentSealedOnRestart(self):
+        logger.info("-----Test 33: A segment rotated but not sealed before a restart is sealed by 'orderLogInit'-----")
+        self.addCleanup(self.removeSealedSegments)
+        for transaction in (1, 0):
+            svc.loadOrderToDisk({'transaction_number': transaction, 'stock_name': 'ABC', 'type': 'buy', 'quantity': 1})
+        with svc.order_log_lock:
+            svc.rotateActiveSegment()
+        svc.pending_segments.clear()
+        self.assertEqual(svc.orderLogInit(), 1)
+        self.assertEqual([(s['min_transaction'], s['max_transaction'], s['rows']) for s in svc.log_segments], [(0, 1, 2)])
+        self.assertEqual(svc.pending_segments, [])
+        self.assertEqual(glob.glob(f'order_log_{svc.REPLICA_ID}.*.pending.csv'), [])
+
+    def test_34_jsonProviderOptions(self):
+        logger.info("-----Test 34: The JSON provider follows jsonify's arguments and honors or rejects encoding options-----")
+        with app.app_context():
+            self.assertEqual(svc.jsonify(1, 2).get_json(), [1, 2])
+            self.assertEqual(svc.jsonify(b=1, a=2).get_json(), {'b': 1, 'a': 2})
+            self.assertIsNone(svc.jsonify().get_json())
+            with self.assertRaises(TypeError):
+                svc.jsonify(1, a=2)
+        self.assertEqual(app.json.dumps({'b': 1, 'a': [2]}, sort_keys=True), '{"a":[2],"b":1}')
+        self.assertEqual(app.json.dumps({'a': 1}, indent=2), '{\n  "a": 1\n}')
+        with self.assertRaises(TypeError):
+            app.json.dumps({'a': 1}, ensure_ascii=False)
+        with patch.object(svc, 'JSON_CODEC', 'json'):
+            self.assertEqual(app.json.dumps({'b': 1, 'a': [2]}, sort_keys=True), '{"a":[2],"b":1}')
+            self.assertEqual(app.json.dumps({'a': 1}, indent=2), '{\n  "a": 1\n}')
+
+    def test_35_sealPoolAfterFork(self):
+        logger.info("-----Test 35: A worker forked after a start-up seal gets a seal pool of its own-----")
+        pool = svc.sealPool()
+        svc.waitForSeals()
+        worker = multiprocessing.get_context("fork").Process(target=lambda: svc.sealPool().submit(lambda: 1).result(timeout=2))
+        worker.start()
+        worker.join(5)
+        self.assertEqual(worker.exitcode, 0)
+        self.assertIs(svc.sealPool(), pool)
+
+    def test_36_catchUpFetchesOnlyGaps(self):
+        logger.info("-----Test 36: Catch-up requests each missing range on its own, not everything after the first hole-----")
+        for transaction in (0, 2, 3, 4, 7, 8):
+            svc.loadOrderToMemory({'transaction_number': transaction, 'stock_name': 'ABC', 'type': 'buy', 'quantity': 1})
+        self.assertEqual(svc.missingRanges(10), [(1, 1), (5, 6), (9, 10)])
+        peer = 'http://order-service-2:8999'
+        svc.recordPeerHighWater(peer, 8)
+        fetched = []
+        def peerGet(url, params=None, **kwargs):
+            lastOrderNum = int(url.rsplit('/', 1)[1])
+            fetched.append((lastOrderNum, params['upto']))
+            orders = [{'transaction_number': t, 'stock_name': 'ABC', 'type': 'sell', 'quantity': 1} for t in range(lastOrderNum + 1, params['upto'] + 1)]
+            return MagicMock(status_code=200, content=json.dumps({'data': orders}).encode())
+        with patch('src.order_service.order_service.requests.get', side_effect=peerGet):
+            svc.catchUpFromPeers(10)
+        self.assertEqual(fetched, [(0, 1), (4, 6)]) # The peer's high-water mark is below the last range
+        self.assertEqual(svc.missingTransactions(10), [9, 10])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
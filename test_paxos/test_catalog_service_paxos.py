@@ -1,5 +1,7 @@
 # Importing required libraries
 import unittest, json, os, logging
+from unittest.mock import patch
+from src_paxos.catalog_service import catalog_service as svc
 from src_paxos.catalog_service.catalog_service import app, catalogInit, CATALOG_FILE
 
 logging.basicConfig(
@@ -94,5 +96,23 @@ class CatalogServiceTest(unittest.TestCase):
         err = rv.get_json()['error']
         self.assertEqual(err['code'], 404)
 
+    @patch('src_paxos.catalog_service.catalog_service.app.run')
+    def test_08_devServerMode(self, mock_run):
+        logger.info("-----Test 8: Default server mode runs the threaded development server-----")
+        svc.runServer("0.0.0.0", 8997, 1)
+        mock_run.assert_called_once_with(host="0.0.0.0", port=8997, threaded=True)
+
+    def test_09_gunicornServerMode(self):
+        logger.info("-----Test 9: gunicorn mode uses gthread workers, capped to the supported worker count-----")
+        from gunicorn.app.base import BaseApplication
+        configs = []
+        with patch.object(svc, 'SERVER_MODE', 'gunicorn'), patch.object(svc, 'WEB_WORKERS', 4), \
+             patch.object(BaseApplication, 'run', lambda server: configs.append(server.cfg)):
+            svc.runServer("0.0.0.0", 8997, 1)
+        self.assertEqual(configs[0].worker_class_str, 'gthread')
+        self.assertEqual(configs[0].workers, 1)
+        self.assertEqual(configs[0].threads, svc.WEB_THREADS)
+        self.assertEqual(configs[0].bind, ['0.0.0.0:8997'])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,6 +1,7 @@
 # Importing the required libraries
-import unittest, logging, requests
-from unittest.mock import patch
+import unittest, logging, requests, json
+from unittest.mock import patch, MagicMock
+from src_paxos.frontend_service import frontend_service as svc
 from src_paxos.frontend_service.frontend_service import (
     app, cache,
     orderHandler, queryOrderHandler
@@ -105,5 +106,39 @@ class FrontendServiceTest(unittest.TestCase):
         err = rv.get_json()['error']
         self.assertEqual(err['code'], 404)
 
+    @patch('src_paxos.frontend_service.frontend_service.requests.get')
+    def test_09_traceContextPropagation(self, mock_get):
+        logger.info("-----Test 9: 'traceparent' is propagated to the Catalog hop and spans are recorded-----")
+        mock_get.return_value = MagicMock(status_code=200, json=lambda: {"name": "TRACE", "price": 1.0, "quantity": 1})
+        svc.TRACING_ENABLED = 1
+        try:
+            rv = self.client.get('/stocks/TRACE', headers={'traceparent': '00-' + 'a' * 32 + '-' + 'b' * 16 + '-01'})
+        finally:
+            svc.TRACING_ENABLED = 0
+        self.assertEqual(rv.status_code, 200)
+        outgoing = mock_get.call_args.kwargs['headers']['traceparent']
+        self.assertTrue(outgoing.startswith('00-' + 'a' * 32 + '-'))
+        spans = []
+        while not svc.trace_queue.empty():
+            spans.append(svc.trace_queue.get())
+        serverSpan = next(span for span in spans if span['name'] == 'GET /stocks/<stock_name>')
+        clientSpan = next(span for span in spans if span['name'] == 'HTTP GET')
+        self.assertEqual(serverSpan['parent_span_id'], 'b' * 16)
+        self.assertEqual(clientSpan['parent_span_id'], serverSpan['span_id'])
+        self.assertEqual(outgoing.split('-')[2], clientSpan['span_id'])
+        self.assertEqual(clientSpan['attributes']['status_code'], 200)
+
+    def test_10_sampledJsonLogging(self):
+        logger.info("-----Test 10: Hot-path records are sampled and formatted as JSON-----")
+        record = logging.LogRecord("svc.hot", logging.INFO, __file__, 1, "Cache hit for key: %s", ("APPL",), None)
+        warning = logging.LogRecord("svc.hot", logging.WARNING, __file__, 1, "Slow lookup", (), None)
+        self.assertFalse(svc.SampleFilter(0.0).filter(record))
+        self.assertTrue(svc.SampleFilter(1.0).filter(record))
+        self.assertTrue(svc.SampleFilter(0.0).filter(warning))
+        entry = json.loads(svc.JsonFormatter().format(record))
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['logger'], 'svc.hot')
+        self.assertEqual(entry['message'], 'Cache hit for key: APPL')
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
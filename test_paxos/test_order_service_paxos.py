@@ -108,5 +108,24 @@ class OrderServiceTest(unittest.TestCase):
         self.assertIn('accepted', accept_data)
         self.assertTrue(accept_data['accepted'])
 
+    def test_11_replicateOrderRecordsSpans(self):
+        logger.info("-----Test 11: Replication records lock wait and disk write spans under the caller's trace-----")
+        svc.LEADER_ID = None
+        payload = {'transaction_number': 8, 'stock_name': 'ABC', 'type': 'buy', 'quantity': 2}
+        svc.TRACING_ENABLED = 1
+        try:
+            rv = self.client.post('/replicate_order', json=payload, headers={'traceparent': '00-' + 'c' * 32 + '-' + 'd' * 16 + '-01'})
+        finally:
+            svc.TRACING_ENABLED = 0
+        self.assertEqual(rv.status_code, 200)
+        spans = []
+        while not svc.trace_queue.empty():
+            spans.append(svc.trace_queue.get())
+        names = {span['name'] for span in spans}
+        self.assertIn('POST /replicate_order', names)
+        self.assertIn('lock_wait orders_list_lock', names)
+        self.assertIn('disk_write', names)
+        self.assertTrue(all(span['trace_id'] == 'c' * 32 for span in spans))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file